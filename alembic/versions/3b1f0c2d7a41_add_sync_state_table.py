@@ -0,0 +1,34 @@
+"""add sync_state table
+
+Revision ID: 3b1f0c2d7a41
+Revises: 69c8df7554b9
+Create Date: 2026-10-18 09:12:03.481220
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b1f0c2d7a41'
+down_revision: Union[str, None] = '69c8df7554b9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'sync_state',
+        sa.Column('athlete_id', sa.Integer(), nullable=False),
+        sa.Column('watermark', sa.Integer(), nullable=True),
+        sa.Column('last_synced_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('athlete_id'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('sync_state')
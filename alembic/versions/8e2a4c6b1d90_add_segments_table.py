@@ -0,0 +1,73 @@
+"""add segments table
+
+Revision ID: 8e2a4c6b1d90
+Revises: 3b1f0c2d7a41
+Create Date: 2026-10-18 10:03:47.912654
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e2a4c6b1d90'
+down_revision: Union[str, None] = '3b1f0c2d7a41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # db.py's create_all may already have created the (empty) table.
+    if not sa.inspect(op.get_bind()).has_table('segments'):
+        op.create_table(
+            'segments',
+            sa.Column('segment_id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(), nullable=True),
+            sa.Column('activity_type', sa.String(), nullable=True),
+            sa.Column('distance', sa.Float(), nullable=True),
+            sa.Column('average_grade', sa.Float(), nullable=True),
+            sa.Column('maximum_grade', sa.Float(), nullable=True),
+            sa.Column('elevation_high', sa.Float(), nullable=True),
+            sa.Column('elevation_low', sa.Float(), nullable=True),
+            sa.Column('start_lat', sa.Float(), nullable=True),
+            sa.Column('start_lng', sa.Float(), nullable=True),
+            sa.Column('end_lat', sa.Float(), nullable=True),
+            sa.Column('end_lng', sa.Float(), nullable=True),
+            sa.Column('kom_time', sa.Integer(), nullable=True),
+            sa.Column('qom_time', sa.Integer(), nullable=True),
+            sa.Column('polyline', sa.String(), nullable=True),
+            sa.Column('fetched_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('segment_id'),
+        )
+
+    # One row per distinct segment, with the polyline of its most recent
+    # effort. fetched_at stays NULL so the fetcher still picks up the
+    # KOM/QOM and start/end coordinates once.
+    op.execute("""
+        INSERT OR IGNORE INTO segments (segment_id, name, distance, average_grade, polyline)
+        SELECT e.segment_id, MAX(e.segment_name), MAX(e.distance), MAX(e.average_grade),
+               (SELECT latest.segment_polyline FROM segment_efforts latest
+                WHERE latest.segment_id = e.segment_id AND latest.segment_polyline IS NOT NULL
+                ORDER BY latest.start_date DESC, latest.id DESC LIMIT 1)
+        FROM segment_efforts e
+        WHERE e.segment_id IS NOT NULL
+        GROUP BY e.segment_id
+    """)
+
+    with op.batch_alter_table('segment_efforts') as batch_op:
+        batch_op.drop_column('segment_polyline')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column('segment_efforts', sa.Column('segment_polyline', sa.String(), nullable=True))
+    op.execute("""
+        UPDATE segment_efforts
+        SET segment_polyline = (
+            SELECT polyline FROM segments WHERE segments.segment_id = segment_efforts.segment_id
+        )
+    """)
+    op.drop_table('segments')
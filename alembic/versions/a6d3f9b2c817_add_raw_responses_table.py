@@ -0,0 +1,39 @@
+"""add raw_responses table
+
+Revision ID: a6d3f9b2c817
+Revises: f2c6d8a3e914
+Create Date: 2026-10-18 18:02:17.553904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a6d3f9b2c817'
+down_revision: Union[str, None] = 'f2c6d8a3e914'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # db.py's init_db may already have created the table.
+    if sa.inspect(op.get_bind()).has_table('raw_responses'):
+        return
+    op.create_table(
+        'raw_responses',
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('object_id', sa.Integer(), nullable=False),
+        sa.Column('digest', sa.String(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=True),
+        sa.Column('fetched_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('kind', 'object_id'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('raw_responses')
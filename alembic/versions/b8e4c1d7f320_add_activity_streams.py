@@ -0,0 +1,45 @@
+"""add activity_streams table
+
+Revision ID: b8e4c1d7f320
+Revises: a6d3f9b2c817
+Create Date: 2026-10-18 20:41:09.218344
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e4c1d7f320'
+down_revision: Union[str, None] = 'a6d3f9b2c817'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    if 'streams_fetched_at' not in {c['name'] for c in inspector.get_columns('activities')}:
+        op.add_column('activities', sa.Column('streams_fetched_at', sa.DateTime(), nullable=True))
+    # db.py's init_db may already have created the table.
+    if inspector.has_table('activity_streams'):
+        return
+    op.create_table(
+        'activity_streams',
+        sa.Column('activity_id', sa.Integer(), nullable=False),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('length', sa.Integer(), nullable=False),
+        sa.Column('scale', sa.Float(), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(['activity_id'], ['activities.id']),
+        sa.PrimaryKeyConstraint('activity_id', 'type'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('activity_streams')
+    with op.batch_alter_table('activities') as batch_op:
+        batch_op.drop_column('streams_fetched_at')
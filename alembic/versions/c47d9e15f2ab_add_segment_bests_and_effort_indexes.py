@@ -0,0 +1,63 @@
+"""add segment_bests and effort indexes
+
+Revision ID: c47d9e15f2ab
+Revises: 8e2a4c6b1d90
+Create Date: 2026-10-18 11:27:15.204378
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c47d9e15f2ab'
+down_revision: Union[str, None] = '8e2a4c6b1d90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_segment_efforts_segment_date', 'segment_efforts',
+                    ['segment_id', 'start_date'], if_not_exists=True)
+    op.create_index('ix_segment_efforts_pr_segment', 'segment_efforts',
+                    ['is_pr', 'segment_id'], if_not_exists=True)
+
+    # db.py's create_all may already have created the (empty) table.
+    if not sa.inspect(op.get_bind()).has_table('segment_bests'):
+        op.create_table(
+            'segment_bests',
+            sa.Column('segment_id', sa.Integer(), nullable=False),
+            sa.Column('best_time', sa.Integer(), nullable=True),
+            sa.Column('best_effort_id', sa.Integer(), nullable=True),
+            sa.Column('attempt_count', sa.Integer(), nullable=True),
+            sa.Column('pr_count', sa.Integer(), nullable=True),
+            sa.Column('last_attempt_date', sa.DateTime(), nullable=True),
+            sa.Column('last_pr_date', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('segment_id'),
+        )
+
+    # Backfill from existing efforts (same query as ingest.refresh_segment_bests).
+    op.execute("DELETE FROM segment_bests")
+    op.execute("""
+        INSERT INTO segment_bests (segment_id, best_time, best_effort_id, attempt_count,
+                                   pr_count, last_attempt_date, last_pr_date)
+        SELECT e.segment_id, MIN(e.elapsed_time),
+               (SELECT b.effort_id FROM segment_efforts b
+                WHERE b.segment_id = e.segment_id AND b.elapsed_time IS NOT NULL
+                ORDER BY b.elapsed_time, b.effort_id LIMIT 1),
+               COUNT(*), SUM(CASE WHEN e.is_pr THEN 1 ELSE 0 END), MAX(e.start_date),
+               MAX(CASE WHEN e.is_pr THEN e.start_date END)
+        FROM segment_efforts e
+        WHERE e.segment_id IS NOT NULL
+        GROUP BY e.segment_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('segment_bests')
+    op.drop_index('ix_segment_efforts_pr_segment', table_name='segment_efforts')
+    op.drop_index('ix_segment_efforts_segment_date', table_name='segment_efforts')
@@ -0,0 +1,48 @@
+"""add webhook_events table
+
+Revision ID: c5a7e2f9d416
+Revises: b8e4c1d7f320
+Create Date: 2026-10-18 21:12:40.771205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5a7e2f9d416'
+down_revision: Union[str, None] = 'b8e4c1d7f320'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # db.py's init_db may already have created the table.
+    if sa.inspect(op.get_bind()).has_table('webhook_events'):
+        return
+    op.create_table(
+        'webhook_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('object_type', sa.String(), nullable=False),
+        sa.Column('object_id', sa.Integer(), nullable=False),
+        sa.Column('aspect_type', sa.String(), nullable=False),
+        sa.Column('owner_id', sa.Integer(), nullable=True),
+        sa.Column('subscription_id', sa.Integer(), nullable=True),
+        sa.Column('event_time', sa.Integer(), nullable=True),
+        sa.Column('updates', sa.String(), nullable=True),
+        sa.Column('received_at', sa.DateTime(), nullable=False),
+        sa.Column('processed_at', sa.DateTime(), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=True),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_webhook_events_pending', 'webhook_events', ['processed_at', 'id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_webhook_events_pending', table_name='webhook_events')
+    op.drop_table('webhook_events')
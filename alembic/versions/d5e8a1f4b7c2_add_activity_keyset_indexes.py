@@ -0,0 +1,32 @@
+"""add activity keyset indexes
+
+Revision ID: d5e8a1f4b7c2
+Revises: c47d9e15f2ab
+Create Date: 2026-10-18 12:41:09.337512
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5e8a1f4b7c2'
+down_revision: Union[str, None] = 'c47d9e15f2ab'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_activities_start_date_id', 'activities',
+                    ['start_date', 'id'], if_not_exists=True)
+    op.create_index('ix_activities_type_start_date', 'activities',
+                    ['type', 'start_date'], if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_activities_type_start_date', table_name='activities')
+    op.drop_index('ix_activities_start_date_id', table_name='activities')
@@ -0,0 +1,72 @@
+"""add activities.athlete_id and activity_rollups
+
+Revision ID: d7b3e6a9c158
+Revises: c5a7e2f9d416
+Create Date: 2026-10-18 23:04:17.512903
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7b3e6a9c158'
+down_revision: Union[str, None] = 'c5a7e2f9d416'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+ROLLUP_PERIODS = {
+    'week': "date(start_date, 'weekday 0', '-6 days')",
+    'month': "date(start_date, 'start of month')",
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if 'athlete_id' not in {c['name'] for c in inspector.get_columns('activities')}:
+        op.add_column('activities', sa.Column('athlete_id', sa.Integer(), nullable=True))
+        # Everything stored so far came from the one athlete that has synced.
+        if bind.execute(sa.text("SELECT count(*) FROM sync_state")).scalar() == 1:
+            op.execute("UPDATE activities SET athlete_id = (SELECT athlete_id FROM sync_state)")
+    if 'ix_activities_athlete_start_date' not in {i['name'] for i in inspector.get_indexes('activities')}:
+        op.create_index('ix_activities_athlete_start_date', 'activities', ['athlete_id', 'start_date'])
+
+    # db.py's init_db may already have created the table.
+    if not inspector.has_table('activity_rollups'):
+        op.create_table(
+            'activity_rollups',
+            sa.Column('athlete_id', sa.Integer(), nullable=False),
+            sa.Column('type', sa.String(), nullable=False),
+            sa.Column('period', sa.String(), nullable=False),
+            sa.Column('period_start', sa.Date(), nullable=False),
+            sa.Column('count', sa.Integer(), nullable=False),
+            sa.Column('distance', sa.Float(), nullable=True),
+            sa.Column('moving_time', sa.Integer(), nullable=True),
+            sa.Column('elapsed_time', sa.Integer(), nullable=True),
+            sa.Column('elevation_gain', sa.Float(), nullable=True),
+            sa.PrimaryKeyConstraint('athlete_id', 'type', 'period', 'period_start'),
+        )
+    # Same grouping as rollups.rollup_select; `python rollups.py` redoes it.
+    op.execute("DELETE FROM activity_rollups")
+    for period, start in ROLLUP_PERIODS.items():
+        op.execute(f"""
+            INSERT INTO activity_rollups
+                (athlete_id, type, period, period_start, count, distance, moving_time, elapsed_time, elevation_gain)
+            SELECT coalesce(athlete_id, 0), coalesce(type, 'Unknown'), '{period}', {start},
+                   count(*), sum(distance), sum(moving_time), sum(elapsed_time), sum(total_elevation_gain)
+            FROM activities
+            GROUP BY coalesce(athlete_id, 0), coalesce(type, 'Unknown'), {start}
+        """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('activity_rollups')
+    op.drop_index('ix_activities_athlete_start_date', table_name='activities')
+    with op.batch_alter_table('activities') as batch_op:
+        batch_op.drop_column('athlete_id')
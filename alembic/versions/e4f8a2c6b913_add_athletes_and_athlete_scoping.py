@@ -0,0 +1,123 @@
+"""add athletes table and athlete ids on efforts, bests and sync jobs
+
+Revision ID: e4f8a2c6b913
+Revises: d7b3e6a9c158
+Create Date: 2026-10-19 01:26:53.208411
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4f8a2c6b913'
+down_revision: Union[str, None] = 'd7b3e6a9c158'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+
+    # db.py's init_db may already have created the table.
+    if not inspector.has_table('athletes'):
+        op.create_table(
+            'athletes',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('username', sa.String(), nullable=True),
+            sa.Column('firstname', sa.String(), nullable=True),
+            sa.Column('lastname', sa.String(), nullable=True),
+            sa.Column('refresh_token', sa.String(), nullable=False),
+            sa.Column('access_token', sa.String(), nullable=True),
+            sa.Column('expires_at', sa.Integer(), nullable=True),
+            sa.Column('scope', sa.String(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.Column('revoked_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+
+    if 'athlete_id' not in {c['name'] for c in inspector.get_columns('sync_jobs')}:
+        op.add_column('sync_jobs', sa.Column('athlete_id', sa.Integer(), nullable=True))
+        op.create_index('ix_sync_jobs_athlete_id', 'sync_jobs', ['athlete_id'])
+
+    if 'athlete_id' not in {c['name'] for c in inspector.get_columns('segment_efforts')}:
+        op.add_column('segment_efforts', sa.Column('athlete_id', sa.Integer(), nullable=True))
+        op.execute("""
+            UPDATE segment_efforts
+            SET athlete_id = (SELECT athlete_id FROM activities WHERE activities.id = segment_efforts.activity_id)
+        """)
+        op.create_index('ix_segment_efforts_athlete_segment_date', 'segment_efforts',
+                        ['athlete_id', 'segment_id', 'start_date'])
+
+    # The key becomes (athlete_id, segment_id); the rows are derived, so rebuild them.
+    if 'athlete_id' not in {c['name'] for c in inspector.get_columns('segment_bests')}:
+        op.drop_table('segment_bests')
+        op.create_table(
+            'segment_bests',
+            sa.Column('athlete_id', sa.Integer(), nullable=False),
+            sa.Column('segment_id', sa.Integer(), nullable=False),
+            sa.Column('best_time', sa.Integer(), nullable=True),
+            sa.Column('best_effort_id', sa.Integer(), nullable=True),
+            sa.Column('attempt_count', sa.Integer(), nullable=True),
+            sa.Column('pr_count', sa.Integer(), nullable=True),
+            sa.Column('last_attempt_date', sa.DateTime(), nullable=True),
+            sa.Column('last_pr_date', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('athlete_id', 'segment_id'),
+        )
+        op.create_index('ix_segment_bests_segment', 'segment_bests', ['segment_id'])
+        # Same query as ingest.refresh_segment_bests.
+        op.execute("""
+            INSERT INTO segment_bests (athlete_id, segment_id, best_time, best_effort_id, attempt_count,
+                                       pr_count, last_attempt_date, last_pr_date)
+            SELECT coalesce(e.athlete_id, 0), e.segment_id, MIN(e.elapsed_time),
+                   (SELECT b.effort_id FROM segment_efforts b
+                    WHERE b.segment_id = e.segment_id AND coalesce(b.athlete_id, 0) = coalesce(e.athlete_id, 0)
+                      AND b.effort_id IS NOT NULL AND b.elapsed_time IS NOT NULL
+                    ORDER BY b.elapsed_time, b.effort_id LIMIT 1),
+                   COUNT(*), SUM(CASE WHEN e.is_pr THEN 1 ELSE 0 END), MAX(e.start_date),
+                   MAX(CASE WHEN e.is_pr THEN e.start_date END)
+            FROM segment_efforts e
+            WHERE e.segment_id IS NOT NULL AND e.effort_id IS NOT NULL
+            GROUP BY coalesce(e.athlete_id, 0), e.segment_id
+        """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_segment_bests_segment', table_name='segment_bests')
+    op.drop_table('segment_bests')
+    op.create_table(
+        'segment_bests',
+        sa.Column('segment_id', sa.Integer(), nullable=False),
+        sa.Column('best_time', sa.Integer(), nullable=True),
+        sa.Column('best_effort_id', sa.Integer(), nullable=True),
+        sa.Column('attempt_count', sa.Integer(), nullable=True),
+        sa.Column('pr_count', sa.Integer(), nullable=True),
+        sa.Column('last_attempt_date', sa.DateTime(), nullable=True),
+        sa.Column('last_pr_date', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('segment_id'),
+    )
+    op.execute("""
+        INSERT INTO segment_bests (segment_id, best_time, best_effort_id, attempt_count,
+                                   pr_count, last_attempt_date, last_pr_date)
+        SELECT e.segment_id, MIN(e.elapsed_time),
+               (SELECT b.effort_id FROM segment_efforts b
+                WHERE b.segment_id = e.segment_id AND b.elapsed_time IS NOT NULL
+                ORDER BY b.elapsed_time, b.effort_id LIMIT 1),
+               COUNT(*), SUM(CASE WHEN e.is_pr THEN 1 ELSE 0 END), MAX(e.start_date),
+               MAX(CASE WHEN e.is_pr THEN e.start_date END)
+        FROM segment_efforts e
+        WHERE e.segment_id IS NOT NULL
+        GROUP BY e.segment_id
+    """)
+    op.drop_index('ix_segment_efforts_athlete_segment_date', table_name='segment_efforts')
+    with op.batch_alter_table('segment_efforts') as batch_op:
+        batch_op.drop_column('athlete_id')
+    op.drop_index('ix_sync_jobs_athlete_id', table_name='sync_jobs')
+    with op.batch_alter_table('sync_jobs') as batch_op:
+        batch_op.drop_column('athlete_id')
+    op.drop_table('athletes')
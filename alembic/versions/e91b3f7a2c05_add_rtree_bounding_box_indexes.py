@@ -0,0 +1,40 @@
+"""add rtree bounding box indexes
+
+Revision ID: e91b3f7a2c05
+Revises: d5e8a1f4b7c2
+Create Date: 2026-10-18 14:05:52.618430
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from db import activity_rtree, segment_rtree, RTREE_COLUMNS
+from ingest import index_bounds
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e91b3f7a2c05'
+down_revision: Union[str, None] = 'd5e8a1f4b7c2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    conn = op.get_bind()
+    for name in ("activity_rtree", "segment_rtree"):
+        op.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING rtree({', '.join(RTREE_COLUMNS)})")
+
+    # Backfill from the stored polylines.
+    rows = conn.execute(sa.text("SELECT id, polyline FROM activities WHERE polyline IS NOT NULL")).all()
+    index_bounds(conn, activity_rtree, [r.id for r in rows], [r.polyline for r in rows])
+    rows = conn.execute(sa.text("SELECT segment_id, polyline FROM segments WHERE polyline IS NOT NULL")).all()
+    index_bounds(conn, segment_rtree, [r.segment_id for r in rows], [r.polyline for r in rows])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TABLE IF EXISTS segment_rtree")
+    op.execute("DROP TABLE IF EXISTS activity_rtree")
@@ -0,0 +1,52 @@
+"""add sync_jobs table
+
+Revision ID: f2c6d8a3e914
+Revises: e91b3f7a2c05
+Create Date: 2026-10-18 16:20:41.207315
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2c6d8a3e914'
+down_revision: Union[str, None] = 'e91b3f7a2c05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # db.py's create_all may already have created the table.
+    if sa.inspect(op.get_bind()).has_table('sync_jobs'):
+        return
+    op.create_table(
+        'sync_jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('limit', sa.Integer(), nullable=True),
+        sa.Column('full', sa.Boolean(), nullable=True),
+        sa.Column('refresh', sa.Boolean(), nullable=True),
+        sa.Column('workers', sa.Integer(), nullable=True),
+        sa.Column('listed', sa.Integer(), nullable=True),
+        sa.Column('inserted_activities', sa.Integer(), nullable=True),
+        sa.Column('inserted_segments', sa.Integer(), nullable=True),
+        sa.Column('failed_activities', sa.Integer(), nullable=True),
+        sa.Column('checkpoint', sa.Integer(), nullable=True),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_sync_jobs_status', 'sync_jobs', ['status'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_sync_jobs_status', table_name='sync_jobs')
+    op.drop_table('sync_jobs')
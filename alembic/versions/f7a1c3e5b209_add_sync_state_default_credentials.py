@@ -0,0 +1,32 @@
+"""add default_credentials flag to sync_state
+
+Revision ID: f7a1c3e5b209
+Revises: e4f8a2c6b913
+Create Date: 2026-10-18 21:52:17.604318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7a1c3e5b209'
+down_revision: Union[str, None] = 'e4f8a2c6b913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # db.py's init_db may already have created the table with the column.
+    if 'default_credentials' in {c['name'] for c in sa.inspect(op.get_bind()).get_columns('sync_state')}:
+        return
+    op.add_column('sync_state', sa.Column('default_credentials', sa.Boolean(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('sync_state') as batch_op:
+        batch_op.drop_column('default_credentials')
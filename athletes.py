@@ -0,0 +1,200 @@
+# athletes.py
+import threading
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select, update
+
+import strava_api
+from db import Activity, Athlete, SessionLocal, SyncState
+
+
+def save_tokens(athlete_id, data, session_factory=SessionLocal):
+    """Store a token response (refresh or code exchange) for the athlete."""
+    values = {"access_token": data["access_token"], "expires_at": data.get("expires_at"),
+              "updated_at": datetime.now(timezone.utc)}
+    if data.get("refresh_token"):
+        values["refresh_token"] = data["refresh_token"]
+    session = session_factory()
+    try:
+        session.execute(update(Athlete).where(Athlete.id == athlete_id).values(**values))
+        session.commit()
+    finally:
+        session.close()
+
+
+class UnknownAthlete(Exception):
+    """No usable tokens for the athlete: never connected, or access revoked."""
+
+    def __init__(self, athlete_id, reason="is not connected"):
+        super().__init__(f"athlete {athlete_id} {reason}")
+        self.athlete_id = athlete_id
+
+
+class AthleteClients:
+    """One StravaClient per connected athlete, built from the athletes table on first use.
+
+    Every client shares the default client's rate limiter and connection
+    pool, so the app-level limits are enforced across athletes, and passes
+    its athlete id to the limiter so waiting athletes are served in turn.
+    Refreshed tokens are written back to the athlete's row.
+
+    The default client only ever acts for the athlete its own credentials
+    belong to; asking for anyone else without stored tokens raises
+    UnknownAthlete rather than reading the wrong athlete's data.
+    """
+
+    def __init__(self, session_factory=SessionLocal, default=None):
+        self.session_factory = session_factory
+        self.default = default or strava_api.client
+        self._clients = {}
+        self._default_athlete_id = None
+        self._lock = threading.Lock()
+
+    def default_athlete_id(self):
+        """Id of the athlete the default credentials belong to; asks Strava once.
+
+        For sync and webhook paths only: request handlers use
+        default_athlete(), which never calls Strava.
+        """
+        if self._default_athlete_id is None:
+            self._default_athlete_id = self.default.athlete_id or self.default.get_athlete()["id"]
+        return self._default_athlete_id
+
+    def get(self, athlete_id):
+        """Client acting for `athlete_id`, or the default client for None.
+
+        Raises UnknownAthlete for an athlete that revoked access, or that
+        has no stored tokens and isn't the default credentials' athlete.
+        """
+        if athlete_id is None:
+            return self.default
+        with self._lock:
+            client = self._clients.get(athlete_id)
+            if client is not None:
+                return client
+            session = self.session_factory()
+            try:
+                athlete = session.get(Athlete, athlete_id)
+            finally:
+                session.close()
+            if athlete is not None and athlete.revoked_at is not None:
+                raise UnknownAthlete(athlete_id, "revoked access")
+            if athlete is None:
+                if athlete_id == self.default_athlete_id():
+                    return self.default
+                raise UnknownAthlete(athlete_id)
+            client = strava_api.StravaClient(
+                refresh_token=athlete.refresh_token, rate_limiter=self.default.rate_limiter,
+                session=self.default.session, athlete_id=athlete_id,
+                access_token=athlete.access_token, expires_at=athlete.expires_at or 0,
+                on_token=lambda data: save_tokens(athlete_id, data, self.session_factory),
+            )
+            self._clients[athlete_id] = client
+            return client
+
+    def forget(self, athlete_id):
+        with self._lock:
+            self._clients.pop(athlete_id, None)
+
+
+clients = AthleteClients()
+
+
+def client_for(athlete_id):
+    return clients.get(athlete_id)
+
+
+def register(session, data):
+    """Create or update the athlete from an authorization code exchange. The caller commits."""
+    profile = data["athlete"]
+    now = datetime.now(timezone.utc)
+    athlete = session.get(Athlete, profile["id"]) or Athlete(id=profile["id"], created_at=now)
+    athlete.username = profile.get("username")
+    athlete.firstname = profile.get("firstname")
+    athlete.lastname = profile.get("lastname")
+    athlete.refresh_token = data["refresh_token"]
+    athlete.access_token = data.get("access_token")
+    athlete.expires_at = data.get("expires_at")
+    athlete.scope = data.get("scope", athlete.scope)
+    athlete.updated_at = now
+    athlete.revoked_at = None
+    session.add(athlete)
+    clients.forget(athlete.id)
+    return athlete
+
+
+def revoke(session, athlete_id):
+    """Stop acting for an athlete who deauthorized the app. The caller commits."""
+    session.execute(update(Athlete).where(Athlete.id == athlete_id).values(
+        revoked_at=datetime.now(timezone.utc), access_token=None,
+    ))
+    clients.forget(athlete_id)
+
+
+def active_athletes(session):
+    """Ids of athletes we can still sync, in the order they connected."""
+    return session.execute(
+        select(Athlete.id).where(Athlete.revoked_at.is_(None)).order_by(Athlete.created_at, Athlete.id)
+    ).scalars().all()
+
+
+def remember_default(session, athlete_id):
+    """Record `athlete_id` as the default credentials' athlete. The caller commits."""
+    session.execute(update(SyncState).where(SyncState.athlete_id != athlete_id,
+                                            SyncState.default_credentials.is_(True))
+                    .values(default_credentials=False))
+    session.execute(update(SyncState).where(SyncState.athlete_id == athlete_id)
+                    .values(default_credentials=True))
+
+
+def default_athlete(session):
+    """Athlete shown by endpoints whose request names none.
+
+    The only athlete with activities, else the athlete the default
+    credentials last synced as. Read from the database only, so request
+    handlers never wait on Strava; None while neither is known.
+    """
+    # Separate subqueries, so SQLite answers each from one end of the athlete index.
+    low, high = session.execute(select(select(func.min(Activity.athlete_id)).scalar_subquery(),
+                                       select(func.max(Activity.athlete_id)).scalar_subquery())).one()
+    if low == high:
+        return low
+    return session.execute(
+        select(SyncState.athlete_id).where(SyncState.default_credentials.is_(True))
+    ).scalar()
+
+
+def athlete_json(athlete):
+    return {
+        "id": athlete.id,
+        "username": athlete.username,
+        "firstname": athlete.firstname,
+        "lastname": athlete.lastname,
+        "scope": athlete.scope,
+        "created_at": athlete.created_at,
+        "revoked_at": athlete.revoked_at,
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    from db import init_db
+
+    init_db()
+    session = SessionLocal()
+    try:
+        if len(sys.argv) >= 3 and sys.argv[1] == "add":
+            # An athlete whose refresh token was obtained elsewhere, e.g. with the Strava CLI flow.
+            probe = strava_api.StravaClient(refresh_token=sys.argv[2], rate_limiter=strava_api.rate_limiter)
+            token = probe.get_access_token()
+            data = {"athlete": probe.get_athlete(), "refresh_token": probe.refresh_token,
+                    "access_token": token, "expires_at": probe._expires_at}
+            athlete = register(session, data)
+            session.commit()
+            print(f"✅ Added athlete {athlete.id} ({athlete.firstname} {athlete.lastname}).")
+        else:
+            for athlete in session.execute(select(Athlete).order_by(Athlete.id)).scalars():
+                status = "revoked" if athlete.revoked_at else "active"
+                print(f"{athlete.id}\t{athlete.firstname or ''} {athlete.lastname or ''}\t{status}")
+    finally:
+        session.close()
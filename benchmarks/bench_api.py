@@ -0,0 +1,265 @@
+# benchmarks/bench_api.py
+#
+# End-to-end benchmark on synthetic data:
+#   1. /sync throughput against a local fake Strava (benchmarks/fake_strava.py),
+#   2. direct ingest of the rest of the corpus,
+#   3. latency percentiles of the read endpoints, with the response cache
+#      cleared before every request ("cold") and with it warm.
+#
+# Results are written as JSON; --compare reports regressions against an
+# earlier run and exits non-zero if any metric got worse than --threshold.
+#
+#   python benchmarks/bench_api.py --size 100k --out baseline-100k.json
+#   python benchmarks/bench_api.py --size 100k --compare baseline-100k.json
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+from fake_strava import FakeStrava, start_server  # noqa: E402
+from synthetic import Corpus, parse_size, populate  # noqa: E402
+
+# Metrics where a bigger number is better; everything else is a duration.
+HIGHER_IS_BETTER = {"activities_per_s"}
+# p99 over a few hundred requests is too noisy to fail a run on; it is still reported.
+GATED = {"activities_per_s", "p50_ms", "p95_ms"}
+
+
+def percentiles(samples):
+    ms = np.array(samples) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_sync(client, fake, activities, workers):
+    """Queue a full sync of `activities` and time it until the job finishes."""
+    before = dict(fake.calls)
+    started = time.perf_counter()
+    job = client.post("/sync", params={"limit": activities, "full": True, "workers": workers}).json()
+    while job["status"] not in ("done", "failed"):
+        time.sleep(0.02)
+        job = client.get(f"/sync/jobs/{job['id']}").json()
+    elapsed = time.perf_counter() - started
+    calls = {k: v - before.get(k, 0) for k, v in fake.calls.items()}
+    return {
+        "status": job["status"],
+        "activities": job["inserted_activities"],
+        "segment_efforts": job["inserted_segments"],
+        "seconds": round(elapsed, 3),
+        "activities_per_s": round(job["inserted_activities"] / elapsed, 2),
+        "api_calls": calls,
+    }
+
+
+def bench_endpoint(client, cache, paths, requests, cold):
+    """Request `paths` round-robin `requests` times; returns latency percentiles."""
+    # Warm up connections, and in warm mode put every path in the cache.
+    for path in paths if not cold else paths[:1]:
+        client.get(path)
+    samples = []
+    for i in range(requests):
+        if cold:
+            cache.bump_generation()
+        started = time.perf_counter()
+        response = client.get(paths[i % len(paths)])
+        samples.append(time.perf_counter() - started)
+        assert response.status_code == 200, (paths[i % len(paths)], response.status_code, response.text[:200])
+    return percentiles(samples)
+
+
+def read_requests(corpus, encode_cursor, seed):
+    """Request shapes per endpoint; several per endpoint so cold runs don't repeat one query."""
+    rng = random.Random(seed)
+    middle = corpus.activities // 2
+    cursor = encode_cursor(datetime.fromtimestamp(corpus.start_epoch(middle), timezone.utc).replace(tzinfo=None), middle)
+    segment_ids = [rng.randint(1, corpus.segments) for _ in range(50)]
+    return {
+        "activities": ["/activities?limit=100"],
+        "activities_type": ["/activities?limit=100&type=Run"],
+        "activities_cursor": [f"/activities?limit=100&cursor={cursor}"],
+        "prs_table": ["/prs_table"],
+        "segment_progress": [f"/segment/{sid}/progress" for sid in segment_ids],
+        "segments_progress_batch": [
+            "/segments/progress?ids=" + ",".join(str(s) for s in rng.sample(range(1, corpus.segments + 1),
+                                                                             min(50, corpus.segments)))
+            for _ in range(10)
+        ],
+    }
+
+
+def run(args):
+    corpus = Corpus(parse_size(args.size), seed=args.seed)
+    short_limit, daily_limit = (int(v) for v in args.rate_limit.split(","))
+    fake = FakeStrava(corpus, args.latency, args.jitter, short_limit, daily_limit)
+    server, url = start_server(fake)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="strava-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    db_path = os.path.join(workdir, "bench.db")
+    if os.path.exists(db_path):
+        sys.exit(f"{db_path} already exists; use an empty --workdir")
+    # Read by db.py, strava_api.py, raw_store.py and heatmap.py at import time.
+    os.environ.update({
+        "STRAVA_DATABASE_URL": f"sqlite:///{db_path}",
+        "STRAVA_AUTH_URL": f"{url}/oauth/token",
+        "STRAVA_BASE_URL": f"{url}/api/v3",
+        "STRAVA_HEATMAP_DIR": os.path.join(workdir, "heatmap"),
+        "STRAVA_RAW_STORE": os.path.join(workdir, "raw_store"),
+    })
+    from fastapi.testclient import TestClient
+    import main
+    from cache import response_cache
+    from db import SessionLocal, SegmentEffort
+
+    results = {"meta": {
+        "size": corpus.activities,
+        "segments": corpus.segments,
+        "seed": args.seed,
+        "sync_activities": min(args.sync, corpus.activities),
+        "latency_s": args.latency,
+        "workers": args.workers,
+        "requests": args.requests,
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }}
+
+    with TestClient(main.app) as client:
+        print(f"Syncing {results['meta']['sync_activities']} activities from {url} ...")
+        results["sync"] = bench_sync(client, fake, results["meta"]["sync_activities"], args.workers)
+
+        rest = range(results["meta"]["sync_activities"] + 1, corpus.activities + 1)
+        print(f"Ingesting {len(rest)} more activities directly ...")
+        session = SessionLocal()
+        try:
+            started = time.perf_counter()
+            populate(session, corpus, rest)
+            elapsed = time.perf_counter() - started
+            results["ingest"] = {
+                "activities": len(rest),
+                "seconds": round(elapsed, 3),
+                "activities_per_s": round(len(rest) / elapsed, 2) if rest else None,
+            }
+            results["meta"]["segment_efforts"] = session.query(SegmentEffort).count()
+        finally:
+            session.close()
+        response_cache.bump_generation()
+
+        results["endpoints"] = {}
+        for name, paths in read_requests(corpus, main.encode_cursor, args.seed).items():
+            print(f"Timing {name} ...")
+            results["endpoints"][name] = {
+                "cold": bench_endpoint(client, response_cache, paths, args.requests, cold=True),
+                "warm": bench_endpoint(client, response_cache, paths, args.requests, cold=False),
+            }
+    server.shutdown()
+    return results
+
+
+def flatten(results):
+    """{"sync.activities_per_s": ..., "endpoints.prs_table.cold.p95_ms": ...} for comparable metrics."""
+    metrics = {}
+    for section in ("sync", "ingest"):
+        value = (results.get(section) or {}).get("activities_per_s")
+        if value:
+            metrics[f"{section}.activities_per_s"] = value
+    for name, modes in results.get("endpoints", {}).items():
+        for mode, stats in modes.items():
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                metrics[f"endpoints.{name}.{mode}.{key}"] = stats[key]
+    return metrics
+
+
+def compare(baseline, results, threshold, min_delta_ms=1.0):
+    """Print every metric against the baseline; returns the ones that regressed.
+
+    A latency only counts as a regression if it also grew by `min_delta_ms`,
+    so millisecond-scale jitter on fast endpoints doesn't fail a run.
+    """
+    old, new = flatten(baseline), flatten(results)
+    regressions = []
+    print(f"\n{'metric':<50} {'baseline':>10} {'now':>10} {'change':>8}")
+    for key in sorted(old.keys() & new.keys()):
+        change = (new[key] - old[key]) / old[key] if old[key] else 0.0
+        metric = key.rsplit(".", 1)[-1]
+        worse = -change if metric in HIGHER_IS_BETTER else change
+        flag = ""
+        if metric in GATED and worse > threshold and (
+                metric in HIGHER_IS_BETTER or new[key] - old[key] >= min_delta_ms):
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print(f"{key:<50} {old[key]:>10.2f} {new[key]:>10.2f} {change:>+8.0%}{flag}")
+    if baseline.get("meta", {}).get("size") != results["meta"]["size"]:
+        print("⚠️ Baseline was run at a different size; numbers are not comparable.")
+    return regressions
+
+
+def summary(results):
+    sync = results["sync"]
+    print(f"\nsync: {sync['activities']} activities in {sync['seconds']} s "
+          f"({sync['activities_per_s']}/s, status {sync['status']})")
+    if results["ingest"]["activities"]:
+        print(f"ingest: {results['ingest']['activities']} activities ({results['ingest']['activities_per_s']}/s)")
+    print(f"\n{'endpoint':<26} {'mode':<5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, modes in results["endpoints"].items():
+        for mode, stats in modes.items():
+            print(f"{name:<26} {mode:<5} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sync and read endpoints on synthetic data")
+    parser.add_argument("--size", default="1k", help="activities in the database: 1k, 100k, 1M or a count")
+    parser.add_argument("--sync", type=int, default=500, help="activities to ingest through /sync")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02, help="fake API latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--rate-limit", default="100000,1000000", help="fake API 15-minute,daily limits")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and mode")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="directory for the database, created if missing (default: a new temp dir)")
+    parser.add_argument("--out", help="write results as JSON here")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.25, help="relative change counted as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="smallest latency increase counted as a regression")
+    args = parser.parse_args()
+
+    results = run(args)
+    summary(results)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold, args.min_delta_ms)
+        if regressions:
+            sys.exit(f"\n{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# benchmarks/bench_polyline.py
+#
+# Compare polyline_codec's batch decoder/encoder with the `polyline` package.
+#
+#   python benchmarks/bench_polyline.py [--routes 5000] [--points 400] [--db strava.db]
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+import polyline
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import polyline_codec  # noqa: E402
+
+
+def synthetic_corpus(routes, points, seed=0):
+    """Random-walk routes around random start points, encoded with `polyline`."""
+    rng = np.random.default_rng(seed)
+    corpus = []
+    for _ in range(routes):
+        n = int(rng.integers(2, points * 2))
+        start = rng.uniform([-60, -170], [60, 170])
+        walk = start + np.cumsum(rng.normal(0, 2e-4, size=(n, 2)), axis=0)
+        corpus.append(polyline.encode([tuple(p) for p in np.round(walk, 5)]))
+    return corpus
+
+
+def timed(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run(corpus, label):
+    total_chars = sum(len(p) for p in corpus)
+    print(f"\n{label}: {len(corpus)} polylines, {total_chars / 1e6:.1f}M chars")
+
+    t_ref, ref = timed(lambda: [polyline.decode(p) for p in corpus])
+    t_vec, (coords, offsets) = timed(lambda: polyline_codec.decode_batch(corpus))
+    for i in range(0, len(corpus), max(1, len(corpus) // 50)):
+        expected = np.array(ref[i], dtype=np.float64).reshape(-1, 2)
+        assert np.allclose(coords[offsets[i]:offsets[i + 1]], expected), f"mismatch at {i}"
+    print(f"  decode  polyline: {t_ref * 1000:8.1f} ms   batch: {t_vec * 1000:8.1f} ms   "
+          f"x{t_ref / t_vec:.1f}  ({len(coords)} points)")
+
+    t_ref, _ = timed(lambda: [polyline.encode(r) for r in ref])
+    t_vec, encoded = timed(lambda: polyline_codec.encode_batch(coords, offsets))
+    assert encoded == list(corpus), "encode mismatch"
+    print(f"  encode  polyline: {t_ref * 1000:8.1f} ms   batch: {t_vec * 1000:8.1f} ms   "
+          f"x{t_ref / t_vec:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark polyline_codec against polyline")
+    parser.add_argument("--routes", type=int, default=5000)
+    parser.add_argument("--points", type=int, default=400, help="mean points per route")
+    parser.add_argument("--db", help="also decode activities.polyline from this SQLite file")
+    args = parser.parse_args()
+
+    run(synthetic_corpus(args.routes, args.points), "synthetic")
+    if args.db:
+        conn = sqlite3.connect(args.db)
+        corpus = [r[0] for r in conn.execute("SELECT polyline FROM activities WHERE polyline != ''")]
+        run(corpus, f"{args.db} activities")
+
+
+if __name__ == "__main__":
+    main()
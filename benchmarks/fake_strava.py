@@ -0,0 +1,235 @@
+# benchmarks/fake_strava.py
+#
+# Local stand-in for the Strava API serving a synthetic Corpus, with
+# configurable latency and rate limits. Point the app at it with
+#
+#   STRAVA_AUTH_URL=http://127.0.0.1:8765/oauth/token
+#   STRAVA_BASE_URL=http://127.0.0.1:8765/api/v3
+#
+#   python benchmarks/fake_strava.py --activities 1k --port 8765 --latency 0.05
+#
+# With --athletes N it serves N athletes (ids 1..N), each with their own
+# activities. The authorization code for athlete k is "k", and the tokens
+# it hands out tell the athletes apart; unknown tokens act as athlete 1.
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic import Corpus, parse_size  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ratelimit import SHORT_WINDOW, DAILY_WINDOW  # noqa: E402
+
+ACTIVITY_PATH = re.compile(r"^/api/v3/activities/(\d+)$")
+STREAMS_PATH = re.compile(r"^/api/v3/activities/(\d+)/streams$")
+SEGMENT_PATH = re.compile(r"^/api/v3/segments/(\d+)$")
+TOKEN = re.compile(r"^fake-(?:access|refresh)-token-(\d+)$")
+# Activity ids of the k-th athlete start after (k - 1) * this.
+ATHLETE_ID_STRIDE = 10 ** 8
+
+
+def shifted(payload, offset):
+    """Activity payload with its id (and its efforts' ids) moved into the athlete's range."""
+    if offset:
+        payload["id"] += offset
+        for effort in payload.get("segment_efforts", []):
+            effort["id"] += offset * 10
+    return payload
+
+
+class FakeStrava:
+    """Request handling state: the corpus, latency and per-window usage."""
+
+    def __init__(self, corpus, latency=0.0, jitter=0.0, short_limit=600, daily_limit=30000, athletes=1):
+        self.corpus = corpus
+        # athlete id -> (corpus, activity id offset); all share the segments.
+        self.athletes = {corpus.athlete_id: (corpus, 0)}
+        for k in range(1, athletes):
+            other = Corpus(corpus.activities, corpus.segments, seed=corpus.seed + k,
+                           athlete_id=corpus.athlete_id + k)
+            self.athletes[other.athlete_id] = (other, k * ATHLETE_ID_STRIDE)
+        self.calls_by_athlete = {}
+        self.latency = latency
+        self.jitter = jitter
+        self.limits = (short_limit, daily_limit)
+        self.usage = [0, 0]
+        self.windows = [None, None]
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def athlete_for(self, token):
+        """Athlete id a token belongs to; the first athlete for anything else."""
+        match = TOKEN.match(token or "")
+        athlete_id = int(match.group(1)) if match else None
+        return athlete_id if athlete_id in self.athletes else self.corpus.athlete_id
+
+    def tokens(self, athlete_id):
+        return {
+            "access_token": f"fake-access-token-{athlete_id}",
+            "refresh_token": f"fake-refresh-token-{athlete_id}",
+            "expires_at": int(time.time()) + 6 * 3600,
+        }
+
+    def count(self, endpoint, athlete_id=None):
+        """Record one API call; returns (allowed, rate-limit headers)."""
+        now = int(time.time())
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            if athlete_id is not None:
+                self.calls_by_athlete[athlete_id] = self.calls_by_athlete.get(athlete_id, 0) + 1
+            for i, window in enumerate((SHORT_WINDOW, DAILY_WINDOW)):
+                if self.windows[i] != now // window:
+                    self.windows[i] = now // window
+                    self.usage[i] = 0
+            allowed = all(u < lim for u, lim in zip(self.usage, self.limits))
+            if allowed:
+                self.usage = [u + 1 for u in self.usage]
+            usage = list(self.usage)
+        limit_value = f"{self.limits[0]},{self.limits[1]}"
+        usage_value = f"{usage[0]},{usage[1]}"
+        headers = {
+            "X-RateLimit-Limit": limit_value, "X-RateLimit-Usage": usage_value,
+            "X-ReadRateLimit-Limit": limit_value, "X-ReadRateLimit-Usage": usage_value,
+        }
+        return allowed, headers
+
+    def wait(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.jitter * random.random())
+
+    def activities_page(self, query, athlete_id=None):
+        corpus, offset = self.athletes[athlete_id or self.corpus.athlete_id]
+        after = int(query["after"][0]) if "after" in query else None
+        before = int(query["before"][0]) if "before" in query else None
+        per_page = min(int(query.get("per_page", ["30"])[0]), 200)
+        page = int(query.get("page", ["1"])[0])
+        ids = corpus.ids_between(after, before)
+        # Like Strava: oldest first with `after`, newest first otherwise.
+        if after is None:
+            ids = ids[::-1]
+        return [shifted(a, offset) for a in corpus.summaries(ids[(page - 1) * per_page:page * per_page])]
+
+    def activity_owner(self, activity_id):
+        """(corpus, local id) of a served activity id, or None."""
+        for corpus, offset in self.athletes.values():
+            if 1 <= activity_id - offset <= corpus.activities:
+                return corpus, activity_id - offset
+        return None
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            form = parse_qs(self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode())
+            if urlparse(self.path).path != "/oauth/token":
+                return self.send_json(404, {"message": "Record Not Found"})
+            fake.count("token")
+            if form.get("grant_type") == ["authorization_code"]:
+                code = form.get("code", [""])[0]
+                if not code.isdigit() or int(code) not in fake.athletes:
+                    return self.send_json(400, {"message": "Bad Request", "errors": [{"code": "invalid"}]})
+                athlete_id = int(code)
+            else:
+                athlete_id = fake.athlete_for(form.get("refresh_token", [""])[0])
+            self.send_json(200, {
+                **fake.tokens(athlete_id),
+                "athlete": {"id": athlete_id, "firstname": "Synthetic", "lastname": str(athlete_id)},
+            })
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            athlete_id = fake.athlete_for(self.headers.get("Authorization", "").removeprefix("Bearer "))
+            if url.path == "/api/v3/athlete":
+                endpoint, build = "athlete", lambda: {"id": athlete_id, "firstname": "Synthetic"}
+            elif url.path == "/api/v3/athlete/activities":
+                endpoint, build = "activities", lambda: fake.activities_page(query, athlete_id)
+            elif ACTIVITY_PATH.match(url.path):
+                owner = fake.activity_owner(int(ACTIVITY_PATH.match(url.path).group(1)))
+                if owner is None:
+                    return self.send_json(404, {"message": "Record Not Found"})
+                corpus, local_id = owner
+                endpoint, build = "activity", lambda: shifted(corpus.details([local_id])[0],
+                                                              fake.athletes[corpus.athlete_id][1])
+            elif STREAMS_PATH.match(url.path):
+                owner = fake.activity_owner(int(STREAMS_PATH.match(url.path).group(1)))
+                if owner is None:
+                    return self.send_json(404, {"message": "Record Not Found"})
+                corpus, local_id = owner
+                keys = set(query.get("keys", [""])[0].split(","))
+                endpoint, build = "streams", lambda: {
+                    k: v for k, v in corpus.streams(local_id).items() if k in keys
+                }
+            elif SEGMENT_PATH.match(url.path):
+                segment_id = int(SEGMENT_PATH.match(url.path).group(1))
+                if not 1 <= segment_id <= fake.corpus.segments:
+                    return self.send_json(404, {"message": "Record Not Found"})
+                endpoint, build = "segment", lambda: fake.corpus.segment(segment_id)
+            else:
+                return self.send_json(404, {"message": "Record Not Found"})
+
+            allowed, headers = fake.count(endpoint, athlete_id)
+            fake.wait()
+            if not allowed:
+                return self.send_json(429, {"message": "Rate Limit Exceeded"}, headers)
+            self.send_json(200, build(), headers)
+
+    return Handler
+
+
+def start_server(fake, host="127.0.0.1", port=0):
+    """Serve `fake` on a daemon thread; returns (server, root URL)."""
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-strava", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic Strava API")
+    parser.add_argument("--activities", default="1k")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds")
+    parser.add_argument("--rate-limit", default="600,30000", help="15-minute,daily request limits")
+    parser.add_argument("--athletes", type=int, default=1, help="athletes served, each with --activities")
+    args = parser.parse_args()
+
+    short_limit, daily_limit = (int(v) for v in args.rate_limit.split(","))
+    fake = FakeStrava(Corpus(parse_size(args.activities), seed=args.seed), args.latency, args.jitter,
+                      short_limit, daily_limit, args.athletes)
+    server, url = start_server(fake, port=args.port)
+    print(f"Fake Strava on {url} (STRAVA_AUTH_URL={url}/oauth/token STRAVA_BASE_URL={url}/api/v3)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
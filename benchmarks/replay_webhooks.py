@@ -0,0 +1,113 @@
+# benchmarks/replay_webhooks.py
+#
+# Posts Strava push events to a running receiver, to exercise the webhook
+# queue without a public URL. Events are either synthesized for a range of
+# activity ids (pair with benchmarks/fake_strava.py serving the same ids) or
+# read from a JSON-lines file of real event bodies.
+#
+#   python benchmarks/replay_webhooks.py --url http://127.0.0.1:8000/webhook --ids 1-200 --updates 2
+#   python benchmarks/replay_webhooks.py --url http://127.0.0.1:8000/webhook --file events.jsonl
+#
+# With --wait, polls /activities/{id}/matches (404 until the activity is
+# stored) and reports how long ingestion took after the last event.
+import argparse
+import json
+import random
+import sys
+import time
+
+import requests
+
+
+def parse_ids(value):
+    """"1-200" or "5,7,9" to a list of ids."""
+    ids = []
+    for part in value.split(","):
+        first, _, last = part.partition("-")
+        ids.extend(range(int(first), int(last or first) + 1))
+    return ids
+
+
+def synthesize(ids, aspect, updates, owner_id=1, subscription_id=1, seed=0):
+    """One `aspect` event per id, each followed by `updates` update events.
+
+    Activities are interleaved at random, as in a real burst, but each
+    activity's own events stay in order.
+    """
+    rng = random.Random(seed)
+    now = int(time.time())
+    queues = []
+    for activity_id in ids:
+        queue = [{"aspect_type": aspect, "object_id": activity_id, "updates": {}}]
+        queue += [{"aspect_type": "update", "object_id": activity_id, "updates": {"title": f"Edited {n + 1}"}}
+                  for n in range(updates)]
+        queues.append(queue)
+    events = []
+    while queues:
+        queue = rng.choice(queues)
+        events.append({"object_type": "activity", "event_time": now, "owner_id": owner_id,
+                       "subscription_id": subscription_id, **queue.pop(0)})
+        if not queue:
+            queues.remove(queue)
+    return events
+
+
+def read_file(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def post_events(url, events, session=None):
+    """POST every event; returns the latency of each request in seconds."""
+    session = session or requests.Session()
+    latencies = []
+    for event in events:
+        started = time.perf_counter()
+        response = session.post(url, json=event, timeout=10)
+        latencies.append(time.perf_counter() - started)
+        response.raise_for_status()
+    return latencies
+
+
+def wait_for_activities(api, ids, timeout):
+    """Seconds until every id in `ids` has been ingested, or None on timeout."""
+    started = time.perf_counter()
+    missing = set(ids)
+    while missing and time.perf_counter() - started < timeout:
+        for activity_id in list(missing):
+            if requests.get(f"{api}/activities/{activity_id}/matches", timeout=10).status_code == 200:
+                missing.discard(activity_id)
+        if missing:
+            time.sleep(0.25)
+    return None if missing else time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay Strava push events against a webhook receiver")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/webhook")
+    parser.add_argument("--ids", help="activity ids to synthesize events for, e.g. 1-200")
+    parser.add_argument("--aspect", default="create", choices=("create", "update", "delete"))
+    parser.add_argument("--updates", type=int, default=0, help="update events after each one")
+    parser.add_argument("--owner-id", type=int, default=1)
+    parser.add_argument("--file", help="JSON-lines file of event bodies to post instead")
+    parser.add_argument("--wait", type=float, help="seconds to wait for created activities to show up")
+    args = parser.parse_args()
+
+    if args.file:
+        events = read_file(args.file)
+    elif args.ids:
+        events = synthesize(parse_ids(args.ids), args.aspect, args.updates, args.owner_id)
+    else:
+        sys.exit("give --ids or --file")
+
+    latencies = sorted(post_events(args.url, events))
+    print(f"Posted {len(events)} events; receiver p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+          f"max {latencies[-1] * 1000:.1f} ms")
+    if args.wait and args.ids and args.aspect == "create":
+        api = args.url.rsplit("/webhook", 1)[0]
+        took = wait_for_activities(api, parse_ids(args.ids), args.wait)
+        print("Not all activities arrived in time" if took is None else f"All activities ingested after {took:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+# benchmarks/synthetic.py
+#
+# Deterministic fake Strava data: activity summaries/details with segment
+# efforts and route polylines, plus segment details. Every object is built
+# from its id alone, so the fake API can serve any page of a 1M-activity
+# history without keeping it in memory.
+#
+# Fill a database directly (skipping the API):
+#
+#   python benchmarks/synthetic.py --activities 100000 --db /tmp/bench.db
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from polyline_codec import encode_batch  # noqa: E402
+
+SIZES = {"1k": 1_000, "100k": 100_000, "1M": 1_000_000}
+# Activities are spread evenly over ten years starting here.
+EPOCH0 = 1420070400  # 2015-01-01T00:00:00Z
+SPAN = 10 * 365 * 86400
+CITIES = [(45.50, -73.57), (48.85, 2.35), (37.77, -122.42), (51.51, -0.13), (-33.87, 151.21)]
+# ~30 m between GPS points, in degrees.
+STEP = 2.7e-4
+METERS_PER_DEGREE = 111_320.0
+
+
+def iso(epoch):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(epoch))
+
+
+def mmss(seconds):
+    return f"{int(seconds) // 60}:{int(seconds) % 60:02d}"
+
+
+def path_length(points):
+    """Approximate length in meters of an (n, 2) array of (lat, lng)."""
+    d = np.diff(points, axis=0)
+    d[:, 1] *= np.cos(np.radians(points[:-1, 0]))
+    return float(np.sqrt((d ** 2).sum(axis=1)).sum() * METERS_PER_DEGREE)
+
+
+class Corpus:
+    """`activities` activities (ids 1..n, oldest first) over `segments` segments."""
+
+    def __init__(self, activities, segments=None, seed=0, athlete_id=1):
+        self.activities = activities
+        self.segments = segments or max(50, activities // 20)
+        self.seed = seed
+        self.athlete_id = athlete_id
+        self.spacing = SPAN // activities
+
+    # --- time line -------------------------------------------------------
+
+    def start_epoch(self, activity_id):
+        # Cheap deterministic jitter within the first half of each slot keeps
+        # start times strictly increasing with the id.
+        jitter = (activity_id * 2654435761) % 1000 * self.spacing // 2000
+        return EPOCH0 + (activity_id - 1) * self.spacing + jitter
+
+    def ids_after(self, after):
+        """First id that started strictly after `after` (epoch seconds)."""
+        lo, hi = 1, self.activities + 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.start_epoch(mid) > after:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def ids_between(self, after=None, before=None):
+        """Ascending range of ids that started in (after, before)."""
+        first = self.ids_after(after) if after is not None else 1
+        last = self.ids_after(before - 1) - 1 if before is not None else self.activities
+        return range(first, max(first, last + 1))
+
+    # --- segments --------------------------------------------------------
+
+    def _segment_points(self, segment_id):
+        rng = np.random.default_rng([self.seed, 1, segment_id])
+        city = np.array(CITIES[segment_id % len(CITIES)])
+        start = city + rng.uniform(-0.08, 0.08, size=2)
+        n = int(rng.integers(15, 60))
+        heading = rng.uniform(0, 2 * np.pi) + np.cumsum(rng.normal(0, 0.15, size=n - 1))
+        steps = STEP * np.stack([np.sin(heading), np.cos(heading)], axis=1)
+        points = np.vstack([start, start + np.cumsum(steps, axis=0)])
+        return points, rng
+
+    def segment(self, segment_id):
+        """Detailed segment, as GET /segments/{id} returns it."""
+        points, rng = self._segment_points(segment_id)
+        distance = path_length(points)
+        grade = float(rng.normal(2, 3))
+        kom = distance / rng.uniform(9, 13)
+        return {
+            "id": segment_id,
+            "name": f"Synthetic Segment {segment_id}",
+            "activity_type": "Ride",
+            "distance": round(distance, 1),
+            "average_grade": round(grade, 1),
+            "maximum_grade": round(abs(grade) * 2 + 1, 1),
+            "elevation_low": 20.0,
+            "elevation_high": round(20.0 + max(0.0, grade) * distance / 100, 1),
+            "start_latlng": [round(float(v), 6) for v in points[0]],
+            "end_latlng": [round(float(v), 6) for v in points[-1]],
+            "xoms": {"kom": mmss(kom), "qom": mmss(kom * 1.2)},
+            "map": {"polyline": encode_batch(points, [0, len(points)])[0]},
+        }
+
+    def segments_batch(self, segment_ids):
+        return [self.segment(s) for s in segment_ids]
+
+    # --- activities ------------------------------------------------------
+
+    def _activity(self, activity_id):
+        """Route points and a detail payload without its polyline yet."""
+        rng = np.random.default_rng([self.seed, 0, activity_id])
+        city_index = int(rng.integers(len(CITIES)))
+        per_city = max(1, self.segments // len(CITIES))
+        chosen = {
+            city_index + len(CITIES) * int(k)
+            for k in rng.integers(0, per_city, size=min(int(rng.poisson(3)), 8))
+        }
+        chosen = sorted(s for s in chosen if 1 <= s <= self.segments)
+
+        is_ride = rng.random() < 0.7
+        speed = rng.uniform(6, 9) if is_ride else rng.uniform(2.5, 3.8)
+        start = self.start_epoch(activity_id)
+        home = np.array(CITIES[city_index]) + rng.normal(0, 0.01, size=2)
+
+        # Ride from home through every chosen segment and back.
+        pieces, efforts, position = [home[None]], [], home
+        elapsed = 0.0
+        for segment_id in chosen + [None]:
+            if segment_id is None:
+                target, segment_points = home, None
+            else:
+                segment_points, _ = self._segment_points(segment_id)
+                target = segment_points[0]
+            n_link = int(np.clip(np.abs(target - position).max() / STEP, 2, 200))
+            link = np.linspace(position, target, n_link)[1:]
+            link += rng.normal(0, 2e-5, size=link.shape)
+            pieces.append(link)
+            elapsed += path_length(np.vstack([position, link])) / speed
+            if segment_points is None:
+                break
+            noisy = segment_points + rng.normal(0, 1e-5, size=segment_points.shape)
+            pieces.append(noisy)
+            effort_time = path_length(segment_points) / (speed * rng.lognormal(0, 0.1))
+            efforts.append({
+                "id": activity_id * 10 + len(efforts),
+                "elapsed_time": int(effort_time),
+                "start_date": iso(start + int(elapsed)),
+                "pr_rank": int(rng.integers(1, 4)) if rng.random() < 0.2 else None,
+                "segment": {
+                    "id": segment_id,
+                    "name": f"Synthetic Segment {segment_id}",
+                    "activity_type": "Ride",
+                    "distance": round(path_length(segment_points), 1),
+                    "average_grade": 1.0,
+                    "start_latlng": [round(float(v), 6) for v in segment_points[0]],
+                    "end_latlng": [round(float(v), 6) for v in segment_points[-1]],
+                },
+            })
+            elapsed += effort_time
+            position = segment_points[-1]
+
+        points = np.vstack(pieces)
+        distance = path_length(points)
+        moving = int(distance / speed)
+        detail = {
+            "id": activity_id,
+            "name": f"{'Ride' if is_ride else 'Run'} {activity_id}",
+            "type": "Ride" if is_ride else "Run",
+            "distance": round(distance, 1),
+            "moving_time": moving,
+            "elapsed_time": int(moving * rng.uniform(1.0, 1.3)),
+            "total_elevation_gain": round(float(rng.uniform(0, 15)) * distance / 1000, 1),
+            "start_date": iso(start),
+            "start_date_local": iso(start),
+            "average_speed": round(speed, 2),
+            "max_speed": round(speed * rng.uniform(1.3, 2.0), 2),
+            "average_heartrate": round(float(rng.uniform(120, 165)), 1),
+            "athlete": {"id": self.athlete_id},
+            "segment_efforts": efforts,
+        }
+        return points, detail
+
+    def details(self, activity_ids):
+        """Detailed activities (with `segment_efforts`), as GET /activities/{id} returns them."""
+        built = [self._activity(i) for i in activity_ids]
+        offsets = np.cumsum([0] + [len(points) for points, _ in built])
+        coords = np.vstack([points for points, _ in built]) if built else np.empty((0, 2))
+        polylines = encode_batch(coords, offsets)
+        for (_, detail), encoded in zip(built, polylines):
+            detail["map"] = {"summary_polyline": encoded}
+        return [detail for _, detail in built]
+
+    def streams(self, activity_id):
+        """1 Hz streams keyed by type, as GET /activities/{id}/streams?key_by_type=true returns them."""
+        points, detail = self._activity(activity_id)
+        rng = np.random.default_rng([self.seed, 2, activity_id])
+        d = np.diff(points, axis=0)
+        d[:, 1] *= np.cos(np.radians(points[:-1, 0]))
+        along = np.concatenate([[0.0], np.cumsum(np.sqrt((d ** 2).sum(axis=1)) * METERS_PER_DEGREE)])
+        n = int(along[-1] / detail["average_speed"]) + 1
+        speed = detail["average_speed"] * np.clip(1 + np.cumsum(rng.normal(0, 0.01, size=n)), 0.5, 1.5)
+        distance = np.cumsum(speed) - speed[0]
+        distance *= along[-1] / distance[-1]
+        latlng = np.stack([np.interp(distance, along, points[:, i]) for i in (0, 1)], axis=1)
+        out = {
+            "time": np.arange(n),
+            "latlng": np.round(latlng, 7),
+            "distance": np.round(distance, 1),
+            "altitude": np.round(30 + np.cumsum(rng.normal(0, 0.05, size=n)), 1),
+            "velocity_smooth": np.round(speed, 3),
+            "heartrate": np.clip(np.rint(detail["average_heartrate"] + np.cumsum(rng.normal(0, 0.3, size=n))), 60, 200),
+        }
+        if detail["type"] == "Ride":
+            out["watts"] = np.clip(np.rint(180 + rng.normal(0, 40, size=n)), 0, None)
+            out["cadence"] = np.clip(np.rint(85 + rng.normal(0, 3, size=n)), 0, None)
+        return {
+            kind: {"data": values.tolist(), "series_type": "distance", "original_size": n, "resolution": "high"}
+            for kind, values in out.items()
+        }
+
+    def summaries(self, activity_ids):
+        """Activity summaries, as GET /athlete/activities lists them."""
+        out = []
+        for detail in self.details(activity_ids):
+            detail.pop("segment_efforts")
+            out.append(detail)
+        return out
+
+
+def parse_size(value):
+    return SIZES[value] if value in SIZES else int(value)
+
+
+def populate(session, corpus, activity_ids, batch_size=1000):
+    """Ingest `activity_ids` of `corpus` straight into the database, then every segment's details."""
+    from ingest import ingest_activities, segment_row, upsert_segment_details
+
+    started = time.perf_counter()
+    activity_ids = list(activity_ids)
+    for i in range(0, len(activity_ids), batch_size):
+        details = corpus.details(activity_ids[i:i + batch_size])
+        ingest_activities(session, [(d, d) for d in details])
+        session.commit()
+        done = min(i + batch_size, len(activity_ids))
+        print(f"  {done}/{len(activity_ids)} activities ({done / (time.perf_counter() - started):.0f}/s)",
+              end="\r", flush=True)
+    print()
+    segment_ids = list(range(1, corpus.segments + 1))
+    for i in range(0, len(segment_ids), batch_size):
+        upsert_segment_details(session, [segment_row(s) for s in corpus.segments_batch(segment_ids[i:i + batch_size])])
+        session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill a database with synthetic Strava data")
+    parser.add_argument("--activities", default="1k", help="count, or one of " + ", ".join(SIZES))
+    parser.add_argument("--segments", type=int, help="default: activities / 20")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", required=True, help="SQLite file to create or extend")
+    args = parser.parse_args()
+
+    # db.py reads its URL at import time.
+    os.environ["STRAVA_DATABASE_URL"] = f"sqlite:///{args.db}"
+    from db import SessionLocal, init_db
+
+    init_db()
+    corpus = Corpus(parse_size(args.activities), args.segments, args.seed)
+    session = SessionLocal()
+    try:
+        populate(session, corpus, range(1, corpus.activities + 1))
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# cache.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+from compression import compress, pick_encoding, variant_etag
+from metrics import CACHE_REQUESTS, SERIALIZE_DURATION
+
+try:
+    import orjson
+except ImportError:  # optional: same output, only slower
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional: clients asking for MessagePack get JSON
+    msgpack = None
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 1024
+
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+class CacheEntry:
+    __slots__ = ("body", "etag", "media_type", "generation", "encoded")
+
+    def __init__(self, body, media_type, generation):
+        self.body = body
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.media_type = media_type
+        self.generation = generation
+        # Compressed copies of `body` by content coding, made on first request.
+        # They are a fraction of the body's size and not counted against max_bytes.
+        self.encoded = {}
+
+    def variant(self, encoding):
+        if encoding is None:
+            return self.body
+        body = self.encoded.get(encoding)
+        if body is None:
+            # Two requests racing here compress twice and store the same bytes.
+            body = self.encoded[encoding] = compress(self.body, encoding)
+        return body
+
+
+class ResponseCache:
+    """Bounded LRU of serialized responses, tagged with a data generation.
+
+    The stored data only changes when a sync writes to it, so every entry is
+    valid until the generation is bumped. Entries are evicted least recently
+    used first once either `max_entries` or `max_bytes` is exceeded.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_entries=DEFAULT_MAX_ENTRIES, name="responses"):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.generation = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bump_generation(self):
+        """Invalidate everything cached so far; call after the data changed."""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.size = 0
+            return self.generation
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.generation != self.generation:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, media_type, generation):
+        entry = CacheEntry(body, media_type, generation)
+        with self._lock:
+            # Computed against data that has since changed: hand it out once
+            # but don't keep it.
+            if generation != self.generation or len(body) > self.max_bytes:
+                return entry
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old.body)
+            self._entries[key] = entry
+            self.size += len(body)
+            while self._entries and (self.size > self.max_bytes or len(self._entries) > self.max_entries):
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted.body)
+        return entry
+
+
+response_cache = ResponseCache()
+
+
+def cache_key(request, media_type=None):
+    return (request.url.path, tuple(sorted(request.query_params.multi_items())), media_type)
+
+
+def _respond(request, entry, vary):
+    encoding = pick_encoding(request, len(entry.body), entry.media_type)
+    etag = variant_etag(entry.etag, encoding)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": vary}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(content=entry.variant(encoding), media_type=entry.media_type, headers=headers)
+
+
+def cached_bytes(request, compute, media_type, cache=response_cache, vary="Accept-Encoding"):
+    """Serve the bytes returned by `compute()` through `cache`.
+
+    A hit is answered without calling `compute`, and a matching
+    If-None-Match gets a 304 without a body. Compressible bodies go out
+    brotli- or gzip-encoded when the client accepts it, compressed once
+    per cache entry.
+    """
+    key = cache_key(request, media_type)
+    entry = cache.get(key)
+    if entry is None:
+        CACHE_REQUESTS.labels(cache.name, "miss").inc()
+        generation = cache.generation
+        entry = cache.put(key, compute(), media_type, generation)
+    else:
+        CACHE_REQUESTS.labels(cache.name, "hit").inc()
+    return _respond(request, entry, vary)
+
+
+def dumps_json(data):
+    """`data` as compact JSON, the same bytes FastAPI's JSONResponse would send."""
+    if orjson is not None:
+        return orjson.dumps(data, default=jsonable_encoder,
+                            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return JSONResponse(content=jsonable_encoder(data)).body
+
+
+def _msgpack_default(obj):
+    # Dates and the like, encoded the way the JSON responses encode them.
+    return jsonable_encoder(obj)
+
+
+def dumps_msgpack(data):
+    return msgpack.packb(data, default=_msgpack_default, use_bin_type=True)
+
+
+def wants_msgpack(request):
+    if msgpack is None:
+        return False
+    accept = request.headers.get("accept", "")
+    return any(media_type in accept for media_type in MSGPACK_TYPES)
+
+
+def cached_json(request, compute, cache=response_cache):
+    """Serve `compute()` as JSON through the response cache.
+
+    Clients sending `Accept: application/msgpack` get the same data as
+    MessagePack instead when msgpack is installed.
+    """
+    if wants_msgpack(request):
+        media_type, dumps = "application/msgpack", dumps_msgpack
+    else:
+        media_type, dumps = "application/json", dumps_json
+
+    def serialize():
+        data = compute()
+        started = time.perf_counter()
+        body = dumps(data)
+        SERIALIZE_DURATION.observe(time.perf_counter() - started)
+        return body
+
+    return cached_bytes(request, serialize, media_type, cache, vary="Accept, Accept-Encoding")
@@ -0,0 +1,117 @@
+# compression.py
+import gzip
+import hashlib
+import os
+import threading
+from email.utils import formatdate
+
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Bodies smaller than this go out as they are.
+MIN_SIZE = 1000
+# Levels for responses compressed on the fly (once per cache generation) and
+# for static assets (once per process).
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+STATIC_GZIP_LEVEL = 9
+STATIC_BROTLI_QUALITY = 11
+# Seconds browsers may reuse a static asset without asking again.
+STATIC_MAX_AGE = int(os.environ.get("STRAVA_STATIC_MAX_AGE", "300"))
+COMPRESSIBLE_TYPES = ("application/json", "application/msgpack", "text/")
+
+
+def accepted_encodings(request):
+    """{content coding: q} from Accept-Encoding, codings lower-cased."""
+    accepted = {}
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip()
+        try:
+            weight = float(q[2:]) if q.startswith("q=") else 1.0
+        except ValueError:
+            weight = 0.0
+        if coding.strip():
+            accepted[coding.strip().lower()] = weight
+    return accepted
+
+
+def _acceptable(accepted, coding):
+    return accepted.get(coding, accepted.get("*", 0.0)) > 0
+
+
+def pick_encoding(request, size, media_type):
+    """"br", "gzip" or None for a body of `size` bytes of `media_type`.
+
+    Responses are only ever encoded here (and by StaticAsset), so the ETag
+    built from the choice always names the bytes actually sent.
+    """
+    if size < MIN_SIZE or not media_type.startswith(COMPRESSIBLE_TYPES):
+        return None
+    accepted = accepted_encodings(request)
+    if brotli is not None and _acceptable(accepted, "br"):
+        return "br"
+    if _acceptable(accepted, "gzip"):
+        return "gzip"
+    return None
+
+
+def compress(body, encoding, static=False):
+    if encoding == "br":
+        return brotli.compress(body, quality=STATIC_BROTLI_QUALITY if static else BROTLI_QUALITY)
+    # mtime=0 keeps the output (and its ETag) the same for the same body.
+    return gzip.compress(body, compresslevel=STATIC_GZIP_LEVEL if static else GZIP_LEVEL, mtime=0)
+
+
+def variant_etag(etag, encoding):
+    """Strong ETag of one encoding of a body whose identity ETag is `etag`."""
+    return etag if encoding is None else f'{etag[:-1]}-{encoding}"'
+
+
+class StaticAsset:
+    """A file served from memory, compressed ahead of time in every supported encoding.
+
+    Read on first use and then never again, so requests don't touch the
+    disk. Clients get an ETag, Last-Modified and a short max-age, and
+    revalidate with a 304.
+    """
+
+    def __init__(self, path, media_type, max_age=STATIC_MAX_AGE):
+        self.path = path
+        self.media_type = media_type
+        self.max_age = max_age
+        self._variants = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._variants is None:
+                with open(self.path, "rb") as f:
+                    body = f.read()
+                self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                self.last_modified = formatdate(os.path.getmtime(self.path), usegmt=True)
+                variants = {None: body, "gzip": compress(body, "gzip", static=True)}
+                if brotli is not None:
+                    variants["br"] = compress(body, "br", static=True)
+                self._variants = variants
+        return self._variants
+
+    def respond(self, request):
+        variants = self.load()
+        encoding = pick_encoding(request, len(variants[None]), self.media_type)
+        etag = variant_etag(self.etag, encoding)
+        headers = {
+            "ETag": etag,
+            "Last-Modified": self.last_modified,
+            "Cache-Control": f"public, max-age={self.max_age}",
+            "Vary": "Accept-Encoding",
+        }
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        return Response(content=variants[encoding], media_type=self.media_type, headers=headers)
@@ -0,0 +1,29 @@
+# conftest.py
+import os
+import tempfile
+
+# Keep the modules' default database, raw store and tiles away from the working tree.
+_scratch = tempfile.mkdtemp(prefix="strava-tests-")
+os.environ.setdefault("STRAVA_DATABASE_URL", f"sqlite:///{_scratch}/strava.db")
+os.environ.setdefault("STRAVA_RAW_STORE", os.path.join(_scratch, "raw_store"))
+os.environ.setdefault("STRAVA_HEATMAP_DIR", os.path.join(_scratch, "heatmap"))
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from db import init_db, make_engine
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    init_db(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session(engine):
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
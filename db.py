@@ -1,4 +1,6 @@
-from sqlalchemy import create_engine, Column, Integer, Float, String, DateTime, ForeignKey, Boolean
+import os
+
+from sqlalchemy import create_engine, event, Column, Integer, Float, String, Date, DateTime, ForeignKey, Boolean, Index, LargeBinary, table, column, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker, declarative_base
 
@@ -8,6 +10,7 @@ class Activity(Base):
     __tablename__ = "activities"
 
     id = Column(Integer, primary_key=True, index=True)
+    athlete_id = Column(Integer)
     name = Column(String)
     type = Column(String)
     distance = Column(Float)
@@ -19,9 +22,19 @@ class Activity(Base):
     max_speed = Column(Float)
     average_heartrate = Column(Float)
     polyline = Column(String)
+    # Set once streams.py has asked Strava for the streams, even if there were none.
+    streams_fetched_at = Column(DateTime)
 
     # ✅ define relationship after all columns
     segments = relationship("SegmentEffort", back_populates="activity", cascade="all, delete-orphan")
+    streams = relationship("ActivityStream", cascade="all, delete-orphan")
+
+    __table_args__ = (
+        # keyset pagination of /activities, newest first
+        Index("ix_activities_start_date_id", "start_date", "id"),
+        Index("ix_activities_type_start_date", "type", "start_date"),
+        Index("ix_activities_athlete_start_date", "athlete_id", "start_date"),
+    )
 
 class SegmentEffort(Base):
     __tablename__ = "segment_efforts"
@@ -36,17 +49,272 @@ class SegmentEffort(Base):
     start_date = Column(DateTime)
     pr_rank = Column(Integer)
     is_pr = Column(Boolean, default=False)
-    segment_polyline = Column(String)
+    # Copied from the activity so per-athlete summaries don't need a join.
+    athlete_id = Column(Integer)
 
     activity_id = Column(Integer, ForeignKey("activities.id"))
     activity = relationship("Activity", back_populates="segments")
+    segment = relationship(
+        "Segment",
+        primaryjoin="foreign(SegmentEffort.segment_id) == Segment.segment_id",
+        viewonly=True,
+    )
+
+    __table_args__ = (
+        # /segment/{id}/progress and the per-segment summary refresh
+        Index("ix_segment_efforts_segment_date", "segment_id", "start_date"),
+        # PR listings
+        Index("ix_segment_efforts_pr_segment", "is_pr", "segment_id"),
+        # one athlete's efforts on a segment
+        Index("ix_segment_efforts_athlete_segment_date", "athlete_id", "segment_id", "start_date"),
+    )
+
+class Segment(Base):
+    """One row per Strava segment, shared by all efforts on it."""
+    __tablename__ = "segments"
+
+    segment_id = Column(Integer, primary_key=True)
+    name = Column(String)
+    activity_type = Column(String)
+    distance = Column(Float)
+    average_grade = Column(Float)
+    maximum_grade = Column(Float)
+    elevation_high = Column(Float)
+    elevation_low = Column(Float)
+    start_lat = Column(Float)
+    start_lng = Column(Float)
+    end_lat = Column(Float)
+    end_lng = Column(Float)
+    kom_time = Column(Integer)  # seconds
+    qom_time = Column(Integer)  # seconds
+    polyline = Column(String)
+    # Set once the full segment details have been fetched from Strava.
+    fetched_at = Column(DateTime)
+
+class SegmentBest(Base):
+    """Per-athlete, per-segment summary of efforts, refreshed whenever efforts are ingested."""
+    __tablename__ = "segment_bests"
+
+    # 0 for efforts stored before athlete ids were recorded.
+    athlete_id = Column(Integer, primary_key=True)
+    segment_id = Column(Integer, primary_key=True)
+    best_time = Column(Integer)
+    best_effort_id = Column(Integer)
+    attempt_count = Column(Integer)
+    pr_count = Column(Integer)
+    last_attempt_date = Column(DateTime)
+    last_pr_date = Column(DateTime)
+
+    __table_args__ = (
+        # refreshing every athlete's row of a segment
+        Index("ix_segment_bests_segment", "segment_id"),
+    )
+
+class ActivityStream(Base):
+    """One Strava stream of an activity, encoded by streams.py."""
+    __tablename__ = "activity_streams"
+
+    activity_id = Column(Integer, ForeignKey("activities.id"), primary_key=True)
+    # time, latlng, distance, altitude, heartrate, watts, ...
+    type = Column(String, primary_key=True)
+    # Samples (latlng counts pairs).
+    length = Column(Integer, nullable=False)
+    # Values were multiplied by this and rounded before delta encoding.
+    scale = Column(Float, nullable=False)
+    # zlib-compressed little-endian int32 deltas
+    data = Column(LargeBinary, nullable=False)
+
+class ActivityRollup(Base):
+    """Totals of one athlete's activities of one type over a week or month, kept current by ingest."""
+    __tablename__ = "activity_rollups"
+
+    # 0 for activities stored before athlete ids were recorded.
+    athlete_id = Column(Integer, primary_key=True)
+    type = Column(String, primary_key=True)
+    # week (starting Monday) or month
+    period = Column(String, primary_key=True)
+    period_start = Column(Date, primary_key=True)
+    count = Column(Integer, nullable=False)
+    distance = Column(Float)  # meters
+    moving_time = Column(Integer)  # seconds
+    elapsed_time = Column(Integer)  # seconds
+    elevation_gain = Column(Float)  # meters
+
+class Athlete(Base):
+    """An athlete who authorized the app, with the tokens to act for them."""
+    __tablename__ = "athletes"
+
+    id = Column(Integer, primary_key=True)  # Strava athlete id
+    username = Column(String)
+    firstname = Column(String)
+    lastname = Column(String)
+    refresh_token = Column(String, nullable=False)
+    access_token = Column(String)
+    # Epoch seconds the access token stops working.
+    expires_at = Column(Integer)
+    scope = Column(String)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    # Set when the athlete revokes access; their data stays until deleted.
+    revoked_at = Column(DateTime)
+
+class SyncState(Base):
+    """Per-athlete high-water mark for incremental sync."""
+    __tablename__ = "sync_state"
+
+    athlete_id = Column(Integer, primary_key=True)
+    # Epoch seconds of the newest activity start fully ingested; the next
+    # sync asks Strava only for activities `after` this.
+    watermark = Column(Integer)
+    last_synced_at = Column(DateTime)
+    # Set on the athlete the default (env) credentials last synced as, so
+    # read endpoints can pick the default athlete without asking Strava.
+    default_credentials = Column(Boolean, default=False)
+
+class RawResponse(Base):
+    """Where the last raw Strava payload of an object lives in the raw store."""
+    __tablename__ = "raw_responses"
+
+    # "activity" or "segment"
+    kind = Column(String, primary_key=True)
+    object_id = Column(Integer, primary_key=True)
+    # sha256 of the canonical JSON; names the compressed blob on disk
+    digest = Column(String, nullable=False)
+    size = Column(Integer)
+    fetched_at = Column(DateTime, nullable=False)
+
+class SyncJob(Base):
+    """A background sync run; its counters and checkpoint are committed per page."""
+    __tablename__ = "sync_jobs"
+
+    id = Column(Integer, primary_key=True)
+    # queued, running, waiting (for the rate limit), done or failed
+    status = Column(String, nullable=False, index=True)
+    # Whose activities; NULL syncs the default credentials in strava_api.py.
+    athlete_id = Column(Integer, index=True)
+    limit = Column(Integer)
+    full = Column(Boolean, default=False)
+    refresh = Column(Boolean, default=False)
+    workers = Column(Integer)
+    listed = Column(Integer, default=0)
+    inserted_activities = Column(Integer, default=0)
+    inserted_segments = Column(Integer, default=0)
+    failed_activities = Column(Integer, default=0)
+    # Epoch seconds of the newest activity this job has fully ingested in
+    # listing order; a resumed job lists activities `after` it.
+    checkpoint = Column(Integer)
+    error = Column(String)
+    created_at = Column(DateTime)
+    started_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+class WebhookEvent(Base):
+    """A Strava push event, kept from receipt until the webhook worker has applied it."""
+    __tablename__ = "webhook_events"
+
+    id = Column(Integer, primary_key=True)
+    # activity or athlete
+    object_type = Column(String, nullable=False)
+    object_id = Column(Integer, nullable=False)
+    # create, update or delete
+    aspect_type = Column(String, nullable=False)
+    owner_id = Column(Integer)
+    subscription_id = Column(Integer)
+    event_time = Column(Integer)
+    # JSON of the changed fields, e.g. {"title": "...", "private": "true"}
+    updates = Column(String)
+    received_at = Column(DateTime, nullable=False)
+    # NULL while the event is pending.
+    processed_at = Column(DateTime)
+    attempts = Column(Integer, default=0)
+    error = Column(String)
+
+    __table_args__ = (
+        # the worker's pending scan
+        Index("ix_webhook_events_pending", "processed_at", "id"),
+    )
+
+# SQLite R*Tree indexes of route/segment bounding boxes. Virtual tables
+# aren't ORM models; these lightweight handles are enough to query them.
+RTREE_COLUMNS = ("id", "min_lat", "max_lat", "min_lng", "max_lng")
+activity_rtree = table("activity_rtree", *(column(c) for c in RTREE_COLUMNS))
+segment_rtree = table("segment_rtree", *(column(c) for c in RTREE_COLUMNS))
+
+def create_spatial_index(bind):
+    with bind.begin() as conn:
+        for name in ("activity_rtree", "segment_rtree"):
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING rtree({', '.join(RTREE_COLUMNS)})"
+            ))
+
+# Database settings; override with environment variables.
+DATABASE_URL = os.environ.get("STRAVA_DATABASE_URL", "sqlite:///strava.db")
+# Read connections pooled for the API; writers are the sync jobs, the webhook
+# worker and raw store bookkeeping, each holding a connection only per commit.
+READ_POOL_SIZE = int(os.environ.get("STRAVA_DB_READ_POOL", "8"))
+WRITE_POOL_SIZE = int(os.environ.get("STRAVA_DB_WRITE_POOL", "2"))
+# Seconds a connection waits for a lock before "database is locked".
+BUSY_TIMEOUT = float(os.environ.get("STRAVA_DB_BUSY_TIMEOUT", "30"))
+SQLITE_PRAGMAS = {
+    # NORMAL is durable across app crashes in WAL mode and avoids an fsync per commit.
+    "synchronous": os.environ.get("STRAVA_DB_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.environ.get("STRAVA_DB_MMAP_SIZE", str(256 * 1024 * 1024))),
+    # Negative means KiB: 64 MB of page cache per connection.
+    "cache_size": -int(os.environ.get("STRAVA_DB_CACHE_KB", "65536")),
+    "temp_store": "MEMORY",
+}
+
+
+def _set_pragmas(dbapi_connection, read_only):
+    cursor = dbapi_connection.cursor()
+    if not read_only:
+        # WAL lets readers keep going while a sync writes; it is stored in the
+        # database file, so the writer setting it once covers every connection.
+        cursor.execute("PRAGMA journal_mode=WAL")
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+def make_engine(url, read_only=False, pool_size=5):
+    engine = create_engine(
+        url,
+        pool_size=pool_size,
+        max_overflow=pool_size,
+        connect_args={"timeout": BUSY_TIMEOUT} if url.startswith("sqlite") else {},
+    )
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", lambda conn, record: _set_pragmas(conn, read_only))
+    return engine
+
+
+write_engine = make_engine(DATABASE_URL, pool_size=WRITE_POOL_SIZE)
+read_engine = make_engine(DATABASE_URL, read_only=True, pool_size=READ_POOL_SIZE)
+engine = write_engine
+SessionLocal = sessionmaker(bind=write_engine)
+ReadSessionLocal = sessionmaker(bind=read_engine)
+
+
+def init_db(bind=write_engine):
+    """Create missing tables and the spatial index (migrations handle changes)."""
+    Base.metadata.create_all(bind=bind)
+    create_spatial_index(bind)
 
-# ✅ Initialize DB AFTER classes are defined
-engine = create_engine("sqlite:///strava.db")
-SessionLocal = sessionmaker(bind=engine)
-Base.metadata.create_all(bind=engine)
 
 def get_db():
+    """Read-only session for request handlers; closed once the response is sent."""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_write_db():
+    """Session on the write engine for handlers that change data."""
     db = SessionLocal()
     try:
         yield db
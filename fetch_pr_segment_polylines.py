@@ -1,34 +1,79 @@
-from db import SessionLocal, SegmentEffort
-from strava_api import get_segment_polyline
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, CancelledError
 
-session = SessionLocal()
+from sqlalchemy import or_
 
-# Only fetch PRs with missing polylines
-prs = session.query(SegmentEffort).filter(
-    SegmentEffort.is_pr == True,
-    SegmentEffort.segment_polyline == None
-).all()
+from cache import response_cache
+from db import SessionLocal, SegmentEffort, Segment, init_db
+from ingest import segment_row, upsert_segment_details
+from raw_store import get_segment_details
+from strava_api import RateLimitExceeded
 
-print(f"Found {len(prs)} PR segments missing polylines.")
+WORKERS = 8
+# Fetched segments buffered before one upsert and commit.
+FLUSH_EVERY = 50
 
-for seg in prs:
-    seg_id = seg.segment_id
-    print(f"Fetching segment {seg_id} ({seg.segment_name}) ...")
 
-    poly = None
-    try:
-        poly = get_segment_polyline(seg_id)
-    except Exception as e:
-        print(f"⚠️ Error fetching {seg_id}: {e}")
-        continue
+def missing_segment_ids(session, pr_only=True):
+    """Distinct segments with efforts whose details have not been fetched yet."""
+    query = (
+        session.query(SegmentEffort.segment_id)
+        .outerjoin(Segment, Segment.segment_id == SegmentEffort.segment_id)
+        .filter(or_(Segment.segment_id == None, Segment.fetched_at == None))
+    )
+    if pr_only:
+        query = query.filter(SegmentEffort.is_pr == True)
+    return [row.segment_id for row in query.distinct()]
+
+
+def fetch_segments(session, segment_ids, workers=WORKERS):
+    """Fetch each segment's details once, concurrently, and store them.
+
+    Stops submitting work when Strava's rate limit is hit and keeps whatever
+    was fetched up to then. Returns the number of segments stored.
+    """
+    stored = 0
+    rows = []
 
-    if poly:
-        seg.segment_polyline = poly
+    def flush():
+        nonlocal stored
+        upsert_segment_details(session, rows)
         session.commit()
-        print(f"✅ Saved polyline for {seg.segment_name}")
-    else:
-        print(f"❌ No polyline for {seg.segment_name}")
+        stored += len(rows)
+        rows.clear()
 
-session.close()
-print("🎯 Done fetching missing PR polylines.")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(get_segment_details, seg_id): seg_id for seg_id in segment_ids}
+        for future in as_completed(futures):
+            seg_id = futures[future]
+            try:
+                rows.append(segment_row(future.result()))
+            except CancelledError:
+                continue
+            except RateLimitExceeded as e:
+                print(f"⏳ {e}; stopping early.")
+                for pending in futures:
+                    pending.cancel()
+                continue
+            except Exception as e:
+                print(f"⚠️ Error fetching {seg_id}: {e}")
+                continue
+            if len(rows) >= FLUSH_EVERY:
+                flush()
+    if rows:
+        flush()
+    if stored:
+        response_cache.bump_generation()
+    return stored
+
+
+if __name__ == "__main__":
+    init_db()
+    session = SessionLocal()
+    try:
+        # Only fetch segments with PRs that are missing details
+        seg_ids = missing_segment_ids(session)
+        print(f"Found {len(seg_ids)} PR segments missing polylines.")
+        stored = fetch_segments(session, seg_ids)
+        print(f"🎯 Done: saved {stored} of {len(seg_ids)} segments.")
+    finally:
+        session.close()
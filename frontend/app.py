@@ -2,11 +2,30 @@
 import streamlit as st
 import requests
 import folium
-import pandas as pd
 from streamlit_folium import st_folium
 
 # ---- Configuration ----
 BACKEND_URL = "http://127.0.0.1:8000"
+# Seconds behind the KOM that still count as close.
+CLOSE_GAP = 30
+
+
+@st.cache_data(ttl=30)
+def load_segments(athlete_id):
+    """Segments as a GeoJSON FeatureCollection; the backend never waits on Strava for it."""
+    params = {"format": "geojson"}
+    if athlete_id is not None:
+        params["athlete_id"] = athlete_id
+    response = requests.get(f"{BACKEND_URL}/segments", params=params, timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+
+def gap_style(feature):
+    gap = feature["properties"]["difference"]
+    color = "green" if gap is not None and gap < CLOSE_GAP else "orange"
+    return {"color": color, "fillColor": color, "fillOpacity": 0.8, "weight": 1}
+
 
 st.set_page_config(page_title="Strava Segment Tracker", layout="wide")
 st.title("🚴 My Strava Segment Tracker")
@@ -16,25 +35,26 @@ st.caption("Visualize your best PRs and all segment attempts from Strava data")
 with st.sidebar:
     st.header("⚙️ Options")
     data_type = st.radio("Show data:", ["My Best PRs", "All Attempts"])
+    try:
+        athletes = requests.get(f"{BACKEND_URL}/athletes", timeout=10).json()
+    except Exception:
+        athletes = []
+    athlete_id = None
+    if athletes:
+        names = {a["id"]: f"{a['firstname'] or ''} {a['lastname'] or ''}".strip() or str(a["id"]) for a in athletes}
+        athlete_id = st.selectbox("Athlete", [None, *names], format_func=lambda i: names.get(i, "Default athlete"))
     if st.button("🔁 Update segments from Strava"):
-        with st.spinner("Fetching data from Strava..."):
-            resp = requests.post(f"{BACKEND_URL}/update_segments", params={"limit": 2})
-            if resp.status_code == 200:
-                st.success(resp.json().get("message"))
-            else:
-                st.error("Failed to update from backend.")
+        resp = requests.post(f"{BACKEND_URL}/update_segments", timeout=30)
+        if resp.status_code == 200:
+            st.success(resp.json().get("message"))
+            load_segments.clear()
+        else:
+            st.error("Failed to update from backend.")
 
 # ---- Fetch data ----
-if data_type == "My Best PRs":
-    endpoint = f"{BACKEND_URL}/segments"
-else:
-    endpoint = f"{BACKEND_URL}/debug/db"  # for all attempts we’ll extend below
-
 try:
     if data_type == "My Best PRs":
-        response = requests.get(f"{BACKEND_URL}/segments")
-        data = response.json()
-        df = pd.DataFrame(data)
+        segments = load_segments(athlete_id)
     else:
         # temporary route to get attempts
         response = requests.get(f"{BACKEND_URL}/debug/db")
@@ -45,31 +65,35 @@ except Exception as e:
     st.error(f"Error loading data: {e}")
     st.stop()
 
-if len(df) == 0:
+features = segments["features"]
+if not features:
     st.warning("No records found yet. Run an update first!")
     st.stop()
+stale = sum(1 for f in features if f["properties"]["stale"])
+if stale:
+    st.caption(f"KOM/QOM times of {stale} segments are being refreshed in the background.")
+# Segments only seen in efforts have no start point until their details arrive.
+located = [f for f in features if f["geometry"] is not None]
+if not located:
+    st.warning("No segment locations yet; they are being fetched in the background.")
+    st.stop()
 
-# ---- Compute map center ----
-avg_lat = df["start_lat"].mean()
-avg_lng = df["start_lng"].mean()
-
-m = folium.Map(location=[avg_lat, avg_lng], zoom_start=12, tiles="OpenStreetMap")
+m = folium.Map(tiles="OpenStreetMap")
 
 # ---- Add Markers ----
-for _, row in df.iterrows():
-    popup_html = f"""
-    <b>{row['name']}</b><br>
-    Distance: {row['distance']:.0f} m<br>
-    Your PR: {row['pr_time']:.1f} s<br>
-    KOM: {row['kom_time'] if row['kom_time'] else 'N/A'} s<br>
-    Gap: {row['difference'] if row['difference'] else 'N/A'} s
-    """
-    color = "green" if row["difference"] and row["difference"] < 30 else "orange"
-    folium.Marker(
-        location=[row["start_lat"], row["start_lng"]],
-        popup=popup_html,
-        icon=folium.Icon(color=color, icon="bicycle", prefix="fa")
-    ).add_to(m)
+# One GeoJSON layer for every segment: a single element on the page instead
+# of one Marker (and one popup) per row.
+fields = ["name", "distance", "pr_time", "kom_time", "qom_time", "difference"]
+aliases = ["Segment", "Distance (m)", "Your PR (s)", "KOM (s)", "QOM (s)", "Gap (s)"]
+layer = folium.GeoJson(
+    {"type": "FeatureCollection", "features": located},
+    name="Segments",
+    marker=folium.CircleMarker(radius=7),
+    style_function=gap_style,
+    tooltip=folium.GeoJsonTooltip(fields=["name", "difference"], aliases=["Segment", "Gap (s)"]),
+    popup=folium.GeoJsonPopup(fields=fields, aliases=aliases),
+).add_to(m)
+m.fit_bounds(layer.get_bounds())
 
 # ---- Display map ----
 st_folium(m, width=1200, height=700)
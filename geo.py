@@ -0,0 +1,245 @@
+# geo.py
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy import select
+
+from polyline_codec import decode, decode_batch
+
+# Simplify to within this many screen pixels at the requested zoom.
+PIXEL_TOLERANCE = 1.0
+MAX_ZOOM = 22
+# Decimal places kept in emitted coordinates (~10 cm at 6).
+COORD_PRECISION = 6
+# Simplified coordinates kept in memory, counted in points rather than lines.
+SIMPLIFIED_CACHE_POINTS = 500_000
+
+
+def zoom_tolerance(zoom, pixels=PIXEL_TOLERANCE):
+    """Degrees covered by `pixels` screen pixels on a 256px-tile map at `zoom`."""
+    zoom = max(0, min(int(zoom), MAX_ZOOM))
+    return pixels * 360.0 / (256 * 2 ** zoom)
+
+
+def douglas_peucker(coords, tolerance):
+    """Simplify an `(n, 2)` array of (lat, lng) points, keeping both end points.
+
+    Iterative Douglas–Peucker; each span's distances are computed in one
+    vectorized step. Perpendicular distance is measured in degrees, which is
+    fine for the short spans a screen pixel covers.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    n = len(coords)
+    if n < 3 or tolerance <= 0:
+        return coords
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    tol2 = tolerance * tolerance
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        p1, p2 = coords[first], coords[last]
+        inner = coords[first + 1:last]
+        d = p2 - p1
+        seg_len2 = d @ d
+        if seg_len2 == 0:
+            d2 = ((inner - p1) ** 2).sum(axis=1)
+        else:
+            cross = d[1] * (inner[:, 0] - p1[0]) - d[0] * (inner[:, 1] - p1[1])
+            d2 = cross * cross / seg_len2
+        i = int(np.argmax(d2))
+        if d2[i] > tol2:
+            index = first + 1 + i
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return coords[keep]
+
+
+class SimplifiedLines:
+    """LRU of simplified coordinates keyed on (row key, tolerance level), bounded by total points.
+
+    Entries remember a hash of the polyline they were made from, so a row
+    whose polyline changed is simplified again instead of served stale.
+    """
+
+    def __init__(self, max_points=SIMPLIFIED_CACHE_POINTS):
+        self.max_points = max_points
+        self.points = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, encoded, tolerance):
+        """GeoJSON [lng, lat] coordinates of `encoded` at `tolerance`; `key` identifies the row."""
+        digest = hash(encoded)
+        with self._lock:
+            entry = self._entries.get((key, tolerance))
+            if entry is not None and entry[0] == digest:
+                self._entries.move_to_end((key, tolerance))
+                return entry[1]
+        coords = np.round(douglas_peucker(decode(encoded), tolerance), COORD_PRECISION)
+        line = tuple(map(tuple, coords[:, ::-1].tolist()))
+        if len(line) > self.max_points:
+            return line
+        with self._lock:
+            old = self._entries.pop((key, tolerance), None)
+            if old is not None:
+                self.points -= len(old[1])
+            self._entries[(key, tolerance)] = (digest, line)
+            self.points += len(line)
+            while self.points > self.max_points:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.points -= len(evicted)
+        return line
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.points = 0
+
+
+simplified_lines = SimplifiedLines()
+
+
+def simplified_line(key, encoded, tolerance):
+    """GeoJSON [lng, lat] coordinates of an encoded polyline at `tolerance`, cached per row and level."""
+    return simplified_lines.get(key, encoded, tolerance)
+
+
+def snap_tolerance(tolerance):
+    """The coarsest zoom level's tolerance that is at most `tolerance` (0 below the finest).
+
+    Keeps the simplification cache to MAX_ZOOM + 2 levels per line whatever
+    tolerances clients ask for.
+    """
+    if tolerance <= 0:
+        return 0.0
+    for zoom in range(MAX_ZOOM + 1):
+        level = zoom_tolerance(zoom)
+        if level <= tolerance:
+            return level
+    return 0.0
+
+
+def resolve_tolerance(zoom=None, tolerance=None):
+    """Tolerance in degrees from an explicit value (snapped to a zoom level) or a map zoom; 0 keeps every point."""
+    if tolerance is not None:
+        return snap_tolerance(tolerance)
+    if zoom is not None:
+        return zoom_tolerance(zoom)
+    return 0.0
+
+
+def line_feature(key, encoded, tolerance, properties):
+    """GeoJSON LineString feature, or None if the polyline is empty or invalid.
+
+    `key` identifies the row the polyline belongs to, e.g. ("segment", id).
+    """
+    if not encoded:
+        return None
+    try:
+        coords = simplified_line(key, encoded, tolerance)
+    except Exception:
+        return None
+    if len(coords) < 2:
+        return None
+    return {
+        "type": "Feature",
+        "geometry": {"type": "LineString", "coordinates": coords},
+        "properties": properties,
+    }
+
+
+def feature_collection(features):
+    return {"type": "FeatureCollection", "features": [f for f in features if f]}
+
+
+def parse_bbox(value):
+    """(min_lng, min_lat, max_lng, max_lat) from a "min_lng,min_lat,max_lng,max_lat" string."""
+    try:
+        parts = tuple(float(v) for v in value.split(","))
+    except ValueError:
+        parts = ()
+    if len(parts) != 4 or parts[0] > parts[2] or parts[1] > parts[3]:
+        raise ValueError("bbox must be min_lng,min_lat,max_lng,max_lat")
+    return parts
+
+
+def rtree_overlapping(rtree, bbox):
+    """SELECT of the ids whose R*Tree box overlaps `bbox`."""
+    min_lng, min_lat, max_lng, max_lat = bbox
+    return select(rtree.c.id).where(
+        rtree.c.max_lat >= min_lat, rtree.c.min_lat <= max_lat,
+        rtree.c.max_lng >= min_lng, rtree.c.min_lng <= max_lng,
+    )
+
+
+def line_intersects_bbox(coords, bbox):
+    """True if the (lat, lng) polyline has a point in, or a segment crossing, `bbox`."""
+    if len(coords) == 0:
+        return False
+    min_lng, min_lat, max_lng, max_lat = bbox
+    lat, lng = coords[:, 0], coords[:, 1]
+    inside = (lat >= min_lat) & (lat <= max_lat) & (lng >= min_lng) & (lng <= max_lng)
+    if inside.any():
+        return True
+    if len(coords) < 2:
+        return False
+
+    # Liang–Barsky clipping of every segment against the box at once.
+    x0, y0 = lng[:-1], lat[:-1]
+    dx, dy = np.diff(lng), np.diff(lat)
+    t0 = np.zeros(len(dx))
+    t1 = np.ones(len(dx))
+    hit = np.ones(len(dx), dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in ((-dx, x0 - min_lng), (dx, max_lng - x0), (-dy, y0 - min_lat), (dy, max_lat - y0)):
+            hit &= ~((p == 0) & (q < 0))
+            r = q / p
+            t0 = np.where(p < 0, np.maximum(t0, r), t0)
+            t1 = np.where(p > 0, np.minimum(t1, r), t1)
+    return bool(np.any(hit & (t0 <= t1)))
+
+
+def decode_many(polylines):
+    """`decode_batch`, falling back to one at a time so a bad polyline decodes empty."""
+    try:
+        return decode_batch(polylines)
+    except ValueError:
+        pass
+    coords, offsets = [], [0]
+    for encoded in polylines:
+        try:
+            points = decode(encoded)
+        except ValueError:
+            points = np.empty((0, 2))
+        coords.append(points)
+        offsets.append(offsets[-1] + len(points))
+    return np.concatenate(coords), np.array(offsets)
+
+
+def filter_in_bbox(rows, bbox, attr="polyline", chunk_size=500):
+    """Yield the rows whose polyline (`attr`) really passes through `bbox`.
+
+    Meant for R*Tree candidates: boxes overlap, the geometry may not.
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield from _filter_chunk(chunk, bbox, attr)
+            chunk = []
+    if chunk:
+        yield from _filter_chunk(chunk, bbox, attr)
+
+
+def _filter_chunk(rows, bbox, attr):
+    coords, offsets = decode_many([getattr(row, attr) for row in rows])
+    for i, row in enumerate(rows):
+        if line_intersects_bbox(coords[offsets[i]:offsets[i + 1]], bbox):
+            yield row
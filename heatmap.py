@@ -0,0 +1,378 @@
+# heatmap.py
+import glob
+import os
+import struct
+import threading
+import zlib
+
+import numpy as np
+from sqlalchemy import func, select
+
+from cache import ResponseCache
+from db import Activity
+from geo import decode_many
+
+HEATMAP_DIR = os.environ.get("STRAVA_HEATMAP_DIR", "heatmap")
+TILE_SIZE = 256
+# Routes are rasterized once at this zoom (~7 m pixels at mid latitudes);
+# other zooms are resampled from it.
+BASE_ZOOM = 14
+MAX_LAT = 85.05112878
+# A GPS glitch can jump across the world; don't draw more than this per segment.
+MAX_STEPS = 4096
+# Routes rasterized per batch when building.
+ROUTE_BATCH = 1000
+# Rendered PNG tiles kept in memory.
+TILE_CACHE_BYTES = 32 * 1024 * 1024
+TILE_CACHE_ENTRIES = 4096
+# Grid of activities stored without an owner, as in rollups.py.
+UNKNOWN_ATHLETE = 0
+
+
+def project(coords, zoom=BASE_ZOOM):
+    """Web Mercator global pixel coordinates (x, y) of (lat, lng) points at `zoom`."""
+    world = TILE_SIZE * 2 ** zoom
+    lat = np.radians(np.clip(coords[:, 0], -MAX_LAT, MAX_LAT))
+    x = (coords[:, 1] + 180.0) / 360.0 * world
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0 * world
+    return np.clip(np.stack([x, y], axis=1), 0, world - 1)
+
+
+def pack(gx, gy, zoom=BASE_ZOOM):
+    """Pixel key ordered so every base tile is one contiguous key range."""
+    tile = ((gx >> 8) << zoom) | (gy >> 8)
+    return (tile << 16) | ((gy & 0xFF) << 8) | (gx & 0xFF)
+
+
+def unpack(keys, zoom=BASE_ZOOM):
+    tile = keys >> 16
+    gx = ((tile >> zoom) << 8) | (keys & 0xFF)
+    gy = ((tile & ((1 << zoom) - 1)) << 8) | ((keys >> 8) & 0xFF)
+    return gx, gy
+
+
+def rasterize(polylines):
+    """Pixel keys and hit counts for a batch of encoded routes.
+
+    Each route counts at most once per pixel, so the heat reflects how many
+    times we went somewhere, not how slowly.
+    """
+    coords, offsets = decode_many(polylines)
+    if len(coords) == 0:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    px = project(coords)
+    route = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+    # Sample every segment at (at most) one-pixel steps.
+    same = route[:-1] == route[1:]
+    a, b = px[:-1][same], px[1:][same]
+    steps = np.clip(np.ceil(np.abs(b - a).max(axis=1)).astype(np.int64), 1, MAX_STEPS)
+    seg = np.repeat(np.arange(len(a)), steps)
+    t = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / steps[seg]
+    samples = np.concatenate([a[seg] + (b - a)[seg] * t[:, None], px])
+    sample_route = np.concatenate([route[:-1][same][seg], route])
+
+    gx, gy = samples[:, 0].astype(np.int64), samples[:, 1].astype(np.int64)
+    keys = pack(gx, gy)
+    per_route = np.unique((sample_route << 44) | keys)
+    return np.unique(per_route & ((1 << 44) - 1), return_counts=True)
+
+
+class Heatmap:
+    """One athlete's sparse per-pixel visit counts at BASE_ZOOM, persisted to one .npz file.
+
+    `keys` is sorted, so the pixels of any tile are found with searchsorted.
+    `activity_ids` records which activities are already drawn, so updates
+    only rasterize new routes.
+    """
+
+    def __init__(self, directory=HEATMAP_DIR, athlete_id=UNKNOWN_ATHLETE):
+        self.athlete_id = athlete_id
+        self.path = os.path.join(directory, f"grid-{athlete_id}.npz")
+        self.keys = np.empty(0, np.int64)
+        self.counts = np.empty(0, np.int64)
+        self.activity_ids = np.empty(0, np.int64)
+        self.version = 0
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+        self._loaded = False
+
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            if os.path.exists(self.path):
+                with np.load(self.path) as data:
+                    self.keys, self.counts = data["keys"], data["counts"]
+                    self.activity_ids = data["activity_ids"]
+                    self.version = int(data["version"])
+            self._loaded = True
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp.npz"
+        np.savez_compressed(tmp, keys=self.keys, counts=self.counts,
+                            activity_ids=self.activity_ids, version=self.version)
+        os.replace(tmp, self.path)
+
+    def add(self, activity_ids, polylines, save=True):
+        """Draw routes not drawn yet. Returns how many were added.
+
+        With `save=False` the grid is only written by a later `save()`.
+        """
+        self.load()
+        with self._update_lock:
+            return self._add(activity_ids, polylines, save)
+
+    def _add(self, activity_ids, polylines, save):
+        ids = np.asarray(activity_ids, dtype=np.int64)
+        new = ~np.isin(ids, self.activity_ids)
+        if not new.any():
+            return 0
+        polylines = [p for p, n in zip(polylines, new) if n]
+
+        keys, counts = [self.keys], [self.counts]
+        for i in range(0, len(polylines), ROUTE_BATCH):
+            k, c = rasterize(polylines[i:i + ROUTE_BATCH])
+            keys.append(k)
+            counts.append(c)
+        keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate(counts)).astype(np.int64)
+
+        with self._lock:
+            self.keys, self.counts = keys, counts
+            self.activity_ids = np.union1d(self.activity_ids, ids[new])
+            self.version += 1
+            if save:
+                self.save()
+        tile_cache.bump_generation()
+        return int(new.sum())
+
+    def remove(self, activity_ids, polylines, save=True):
+        """Take drawn routes out again (deleted activities). Returns how many were removed."""
+        self.load()
+        with self._update_lock:
+            ids = np.asarray(activity_ids, dtype=np.int64)
+            drawn = np.isin(ids, self.activity_ids)
+            if not drawn.any():
+                return 0
+            k, c = rasterize([p for p, d in zip(polylines, drawn) if d])
+            keys, inverse = np.unique(np.concatenate([self.keys, k]), return_inverse=True)
+            counts = np.bincount(inverse, weights=np.concatenate([self.counts, -c])).astype(np.int64)
+            keep = counts > 0
+            with self._lock:
+                self.keys, self.counts = keys[keep], counts[keep]
+                self.activity_ids = np.setdiff1d(self.activity_ids, ids[drawn])
+                self.version += 1
+                if save:
+                    self.save()
+        tile_cache.bump_generation()
+        return int(drawn.sum())
+
+    def clear(self):
+        self.load()
+        with self._update_lock, self._lock:
+            self.keys = np.empty(0, np.int64)
+            self.counts = np.empty(0, np.int64)
+            self.activity_ids = np.empty(0, np.int64)
+            self.version += 1
+            self.save()
+        tile_cache.bump_generation()
+
+    def tile_counts(self, z, x, y):
+        """256x256 array of visit counts for web-map tile (z, x, y)."""
+        self.load()
+        keys, counts = self.keys, self.counts
+        if z >= BASE_ZOOM:
+            # One base tile covers this tile; blow up the part of it we need.
+            shift = z - BASE_ZOOM
+            scale = 2 ** shift
+            tx, ty = x >> shift, y >> shift
+            k, c = self._tile_range(keys, counts, tx, ty)
+            gx, gy = unpack(k)
+            local = (gy & 0xFF) * TILE_SIZE + (gx & 0xFF)
+            dense = np.bincount(local, weights=c, minlength=TILE_SIZE * TILE_SIZE)
+            dense = dense.reshape(TILE_SIZE, TILE_SIZE)
+            block = max(1, TILE_SIZE // scale)
+            ox = (x - tx * scale) * TILE_SIZE // scale
+            oy = (y - ty * scale) * TILE_SIZE // scale
+            part = dense[oy:oy + block, ox:ox + block]
+            repeat = TILE_SIZE // block
+            return np.repeat(np.repeat(part, repeat, axis=0), repeat, axis=1)
+
+        # Many base tiles fall into this tile. Keys are ordered by tile column
+        # first, so its columns are one contiguous range; rows are masked.
+        shift = BASE_ZOOM - z
+        span = 2 ** shift
+        lo = ((x * span) << BASE_ZOOM) << 16
+        hi = (((x + 1) * span) << BASE_ZOOM) << 16
+        i, j = np.searchsorted(keys, [lo, hi])
+        gx, gy = unpack(keys[i:j])
+        lx = (gx >> shift) - x * TILE_SIZE
+        ly = (gy >> shift) - y * TILE_SIZE
+        inside = (ly >= 0) & (ly < TILE_SIZE)
+        grid = np.bincount(ly[inside] * TILE_SIZE + lx[inside], weights=counts[i:j][inside],
+                           minlength=TILE_SIZE * TILE_SIZE)
+        return grid.reshape(TILE_SIZE, TILE_SIZE)
+
+    @staticmethod
+    def _tile_range(keys, counts, tx, ty):
+        """Pixels of base tile (tx, ty): one contiguous key range."""
+        lo = ((tx << BASE_ZOOM) | ty) << 16
+        i, j = np.searchsorted(keys, [lo, lo + (1 << 16)])
+        return keys[i:j], counts[i:j]
+
+
+def colorize(counts, reference):
+    """RGBA image: transparent where nothing, orange to white with log intensity.
+
+    `reference` is the count drawn at full intensity; using the same one for
+    every tile of a zoom level avoids seams between tiles.
+    """
+    heat = np.clip(np.log1p(counts) / np.log1p(max(reference, 1)), 0, 1)
+    rgba = np.zeros(counts.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = 255
+    rgba[..., 1] = (85 + 170 * heat).astype(np.uint8)
+    rgba[..., 2] = (255 * heat ** 2).astype(np.uint8)
+    rgba[..., 3] = np.where(counts > 0, 120 + 135 * heat, 0).astype(np.uint8)
+    return rgba
+
+
+def encode_png(rgba):
+    """Minimal PNG encoder for an (h, w, 4) uint8 array."""
+    h, w, _ = rgba.shape
+    raw = np.zeros((h, w * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(h, w * 4)  # filter byte 0 per row
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+_heatmaps = {}
+_heatmaps_lock = threading.Lock()
+
+
+def heatmap_for(athlete_id):
+    """The athlete's heatmap; None means activities stored without an owner."""
+    athlete_id = athlete_id or UNKNOWN_ATHLETE
+    with _heatmaps_lock:
+        if athlete_id not in _heatmaps:
+            _heatmaps[athlete_id] = Heatmap(HEATMAP_DIR, athlete_id)
+        return _heatmaps[athlete_id]
+
+
+def stored_heatmaps():
+    """Heatmaps of every athlete with a grid on disk."""
+    ids = set()
+    for path in glob.glob(os.path.join(HEATMAP_DIR, "grid-*.npz")):
+        name = os.path.basename(path)[len("grid-"):-len(".npz")]
+        if name.lstrip("-").isdigit():
+            ids.add(int(name))
+    return [heatmap_for(i) for i in sorted(ids | set(_heatmaps))]
+
+
+def reload():
+    """Forget the grids held in memory, so tiles read what another process saved since."""
+    with _heatmaps_lock:
+        _heatmaps.clear()
+    tile_cache.bump_generation()
+
+
+def render_tile(z, x, y, athlete_id=None):
+    heatmap = heatmap_for(athlete_id)
+    heatmap.load()
+    peak = int(heatmap.counts.max()) if len(heatmap.counts) else 1
+    # Coarser pixels sum the routes of 2**shift base pixels along a line.
+    reference = peak * 2 ** max(0, BASE_ZOOM - z)
+    return encode_png(colorize(heatmap.tile_counts(z, x, y), reference))
+
+
+def remove(activity_ids, polylines, athlete_ids):
+    """Take deleted activities out of their owners' heatmaps. Returns how many were removed."""
+    removed = 0
+    for owner in set(athlete_ids):
+        picked = [(i, p) for i, p, a in zip(activity_ids, polylines, athlete_ids) if a == owner]
+        removed += heatmap_for(owner).remove([i for i, _ in picked], [p for _, p in picked])
+    return removed
+
+
+def _polylines(session, ids, batch_size):
+    for i in range(0, len(ids), batch_size):
+        yield session.execute(
+            select(Activity.id, Activity.polyline).where(Activity.id.in_(ids[i:i + batch_size]))
+        ).all()
+
+
+def _owners(session, activity_ids, batch_size):
+    owner = func.coalesce(Activity.athlete_id, UNKNOWN_ATHLETE)
+    if activity_ids is None:
+        return session.execute(select(Activity.id, owner)).all()
+    ids = list(activity_ids)
+    rows = []
+    for i in range(0, len(ids), batch_size):
+        rows.extend(session.execute(select(Activity.id, owner).where(Activity.id.in_(ids[i:i + batch_size]))))
+    return rows
+
+
+def update_from_db(session, activity_ids=None, batch_size=ROUTE_BATCH):
+    """Draw stored activities into their owners' heatmaps if they aren't there yet.
+
+    `activity_ids` are the activities just ingested; without them every
+    stored activity is checked (after a rebuild or a replay). Only ids are
+    scanned, polylines are loaded for the new routes, and each changed grid
+    is written once. Routes drawn for another athlete than the one now
+    owning them (claimed legacy rows) are taken out there. Returns how
+    many routes were added.
+    """
+    rows = _owners(session, activity_ids, batch_size)
+    ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    owners = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+    added = 0
+    changed = []
+    for owner in np.unique(owners).tolist():
+        heatmap = heatmap_for(owner)
+        heatmap.load()
+        mine = ids[owners == owner]
+        missing = mine[~np.isin(mine, heatmap.activity_ids)].tolist()
+        for batch in _polylines(session, missing, batch_size):
+            added += heatmap.add([r.id for r in batch], [r.polyline for r in batch], save=False)
+        if missing:
+            changed.append(heatmap)
+    for heatmap in stored_heatmaps():
+        heatmap.load()
+        moved = ids[np.isin(ids, heatmap.activity_ids) & (owners != heatmap.athlete_id)].tolist()
+        for batch in _polylines(session, moved, batch_size):
+            heatmap.remove([r.id for r in batch], [r.polyline for r in batch], save=False)
+        if moved and heatmap not in changed:
+            changed.append(heatmap)
+    for heatmap in changed:
+        with heatmap._lock:
+            heatmap.save()
+    return added
+
+
+# Tiles only change when routes are added, so they have their own cache
+# instead of being flushed with the JSON responses on every sync.
+tile_cache = ResponseCache(max_bytes=TILE_CACHE_BYTES, max_entries=TILE_CACHE_ENTRIES, name="tiles")
+
+
+if __name__ == "__main__":
+    import sys
+    from db import SessionLocal, init_db
+
+    init_db()
+    session = SessionLocal()
+    try:
+        if "--rebuild" in sys.argv:
+            for heatmap in stored_heatmaps():
+                heatmap.clear()
+        print(f"🔥 Added {update_from_db(session)} routes to the heatmap.")
+    finally:
+        session.close()
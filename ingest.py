@@ -0,0 +1,361 @@
+# ingest.py
+from datetime import datetime, timezone
+
+import numpy as np
+from sqlalchemy import func, select, case, delete, true, update
+from sqlalchemy import insert as plain_insert
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import aliased
+
+from db import Activity, ActivityStream, SegmentEffort, Segment, SegmentBest, activity_rtree, segment_rtree
+from geo import decode_many
+from polyline_codec import bounds_batch
+from rollups import refresh_rollups
+
+# Rows per INSERT statement; keeps each statement well under SQLite's
+# bound-parameter limit.
+BATCH_SIZE = 500
+
+# Columns Strava can change after the fact; everything else is immutable once
+# an activity or effort exists.
+ACTIVITY_UPDATE_COLUMNS = (
+    "athlete_id", "name", "type", "distance", "moving_time", "elapsed_time",
+    "total_elevation_gain", "average_speed", "max_speed",
+    "average_heartrate", "polyline",
+)
+EFFORT_UPDATE_COLUMNS = (
+    "segment_name", "elapsed_time", "pr_rank", "is_pr", "activity_id", "athlete_id",
+)
+# The segment summary embedded in an effort carries these; the polyline and
+# KOM/QOM times only come with the full segment details.
+SEGMENT_SUMMARY_COLUMNS = (
+    "name", "activity_type", "distance", "average_grade", "maximum_grade",
+    "elevation_high", "elevation_low", "start_lat", "start_lng", "end_lat", "end_lng",
+)
+SEGMENT_DETAIL_COLUMNS = SEGMENT_SUMMARY_COLUMNS + (
+    "kom_time", "qom_time", "polyline", "fetched_at",
+)
+
+
+def parse_date(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def activity_row(act):
+    """Map a Strava activity summary (or detail) to an `activities` row."""
+    return {
+        "id": act["id"],
+        "athlete_id": (act.get("athlete") or {}).get("id"),
+        "name": act.get("name"),
+        "type": act.get("type"),
+        "distance": act.get("distance"),
+        "moving_time": act.get("moving_time"),
+        "elapsed_time": act.get("elapsed_time"),
+        "total_elevation_gain": act.get("total_elevation_gain"),
+        "start_date": parse_date(act["start_date"]),
+        "average_speed": act.get("average_speed"),
+        "max_speed": act.get("max_speed"),
+        "average_heartrate": act.get("average_heartrate"),
+        "polyline": (act.get("map") or {}).get("summary_polyline"),
+    }
+
+
+def effort_row(effort, activity_id, athlete_id=None):
+    """Map one entry of a detailed activity's `segment_efforts` to a row."""
+    seg = effort["segment"]
+    pr_rank = effort.get("pr_rank")
+    return {
+        "effort_id": effort["id"],
+        "segment_id": seg["id"],
+        "segment_name": seg["name"],
+        "distance": seg.get("distance"),
+        "average_grade": seg.get("average_grade"),
+        "elapsed_time": effort.get("elapsed_time"),
+        "start_date": parse_date(effort["start_date"]),
+        "pr_rank": pr_rank,
+        "is_pr": pr_rank == 1,
+        "activity_id": activity_id,
+        "athlete_id": athlete_id,
+    }
+
+
+def parse_duration(value):
+    """Seconds from a Strava KOM/QOM string such as "45s", "5:23" or "1:02:03"."""
+    if not value:
+        return None
+    value = str(value).strip().rstrip("s")
+    try:
+        seconds = 0
+        for part in value.split(":"):
+            seconds = seconds * 60 + int(part)
+        return seconds
+    except ValueError:
+        return None
+
+
+def _latlng(value):
+    return tuple(value) if value and len(value) == 2 else (None, None)
+
+
+def segment_row(seg, fetched_at=None):
+    """Map a Strava segment (summary or detailed) to a `segments` row.
+
+    `fetched_at` is when Strava sent the details; now unless given.
+    """
+    start_lat, start_lng = _latlng(seg.get("start_latlng"))
+    end_lat, end_lng = _latlng(seg.get("end_latlng"))
+    row = {
+        "segment_id": seg["id"],
+        "name": seg.get("name"),
+        "activity_type": seg.get("activity_type"),
+        "distance": seg.get("distance"),
+        "average_grade": seg.get("average_grade"),
+        "maximum_grade": seg.get("maximum_grade"),
+        "elevation_high": seg.get("elevation_high"),
+        "elevation_low": seg.get("elevation_low"),
+        "start_lat": start_lat,
+        "start_lng": start_lng,
+        "end_lat": end_lat,
+        "end_lng": end_lng,
+    }
+    if "map" in seg or "xoms" in seg:
+        xoms = seg.get("xoms") or {}
+        row.update({
+            "kom_time": parse_duration(xoms.get("kom")),
+            "qom_time": parse_duration(xoms.get("qom")),
+            "polyline": (seg.get("map") or {}).get("polyline"),
+            "fetched_at": fetched_at or datetime.now(timezone.utc),
+        })
+    return row
+
+
+def _chunks(rows, size):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def _upsert(session, table, rows, key, update_columns, batch_size, keep_existing=False):
+    """Batched INSERT ... ON CONFLICT(key) DO UPDATE of `update_columns`.
+
+    With `keep_existing`, NULLs in the new rows do not overwrite stored values.
+    """
+    if not rows:
+        return 0
+    stmt = insert(table)
+    if keep_existing:
+        updates = {col: func.coalesce(stmt.excluded[col], table.c[col]) for col in update_columns}
+    else:
+        updates = {col: stmt.excluded[col] for col in update_columns}
+    stmt = stmt.on_conflict_do_update(index_elements=[key], set_=updates)
+    for chunk in _chunks(rows, batch_size):
+        session.execute(stmt, chunk)
+    return len(rows)
+
+
+def upsert_activities(session, rows, batch_size=BATCH_SIZE):
+    """Insert or update activity rows keyed on `Activity.id`."""
+    return _upsert(session, Activity.__table__, rows, "id", ACTIVITY_UPDATE_COLUMNS, batch_size)
+
+
+def upsert_segment_efforts(session, rows, batch_size=BATCH_SIZE):
+    """Insert or update effort rows keyed on `SegmentEffort.effort_id`.
+
+    Re-ingesting an effort refreshes `pr_rank`/`is_pr`, so a re-ranked PR
+    is picked up instead of failing on the unique constraint.
+    """
+    return _upsert(session, SegmentEffort.__table__, rows, "effort_id", EFFORT_UPDATE_COLUMNS, batch_size)
+
+
+def upsert_segments(session, rows, batch_size=BATCH_SIZE):
+    """Insert or update segment summary rows without touching fetched details."""
+    return _upsert(session, Segment.__table__, rows, "segment_id", SEGMENT_SUMMARY_COLUMNS, batch_size,
+                   keep_existing=True)
+
+
+def upsert_segment_details(session, rows, batch_size=BATCH_SIZE):
+    """Insert or update rows built from full segment details, and index their bounds."""
+    count = _upsert(session, Segment.__table__, rows, "segment_id", SEGMENT_DETAIL_COLUMNS, batch_size)
+    index_segment_bounds(session, rows)
+    return count
+
+
+def index_bounds(conn, rtree, ids, polylines, batch_size=BATCH_SIZE):
+    """Store the bounding box of each polyline in `rtree`, keyed by id.
+
+    Ids whose polyline is missing or empty are removed from the index.
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    coords, offsets = decode_many(list(polylines))
+    bounds = bounds_batch(coords, offsets)
+    present = ~np.isnan(bounds[:, 0])
+    rows = [
+        {"id": ids[i], "min_lat": b[0], "max_lat": b[2], "min_lng": b[1], "max_lng": b[3]}
+        for i, b in enumerate(bounds.tolist()) if present[i]
+    ]
+    missing = [ids[i] for i in np.flatnonzero(~present)]
+    for chunk in _chunks(rows, batch_size):
+        conn.execute(plain_insert(rtree).prefix_with("OR REPLACE"), chunk)
+    for chunk in _chunks(missing, batch_size):
+        conn.execute(delete(rtree).where(rtree.c.id.in_(chunk)))
+    return len(rows)
+
+
+def index_activity_bounds(conn, rows):
+    return index_bounds(conn, activity_rtree, [r["id"] for r in rows], [r["polyline"] for r in rows])
+
+
+def index_segment_bounds(conn, rows):
+    return index_bounds(conn, segment_rtree, [r["segment_id"] for r in rows], [r["polyline"] for r in rows])
+
+
+def segment_bests_select(segment_ids=None):
+    """SELECT producing `segment_bests` rows, one per athlete and segment, optionally for some segments only.
+
+    Only efforts from Strava count; matcher.py's locally matched efforts
+    (no effort_id, estimated time) are left out.
+    """
+    athlete = func.coalesce(SegmentEffort.athlete_id, 0)
+    best = aliased(SegmentEffort)
+    # The fastest effort, earliest effort_id on a tie. A bare column next to
+    # several aggregates would come from an arbitrary row.
+    best_effort_id = (
+        select(best.effort_id)
+        .where(best.segment_id == SegmentEffort.segment_id,
+               func.coalesce(best.athlete_id, 0) == athlete,
+               best.effort_id.isnot(None),
+               best.elapsed_time.isnot(None))
+        .order_by(best.elapsed_time, best.effort_id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    query = (
+        select(
+            athlete,
+            SegmentEffort.segment_id,
+            func.min(SegmentEffort.elapsed_time),
+            best_effort_id,
+            func.count(),
+            func.sum(case((SegmentEffort.is_pr == True, 1), else_=0)),
+            func.max(SegmentEffort.start_date),
+            func.max(case((SegmentEffort.is_pr == True, SegmentEffort.start_date))),
+        )
+        .where(SegmentEffort.segment_id.in_(segment_ids) if segment_ids is not None else true(),
+               SegmentEffort.effort_id.isnot(None))
+        .group_by(athlete, SegmentEffort.segment_id)
+    )
+    return query
+
+
+def refresh_segment_bests(session, segment_ids, batch_size=BATCH_SIZE):
+    """Recompute every athlete's summary rows of `segment_ids` from their efforts.
+
+    Uses the (segment_id, start_date) index, so the cost depends on the
+    efforts of the touched segments, not on the size of the table.
+    """
+    segment_ids = list(segment_ids)
+    columns = [
+        "athlete_id", "segment_id", "best_time", "best_effort_id", "attempt_count",
+        "pr_count", "last_attempt_date", "last_pr_date",
+    ]
+    for chunk in _chunks(segment_ids, batch_size):
+        session.execute(delete(SegmentBest).where(SegmentBest.segment_id.in_(chunk)))
+        session.execute(
+            insert(SegmentBest).from_select(columns, segment_bests_select(chunk))
+        )
+    return len(segment_ids)
+
+
+def legacy_rows_exist(session):
+    """Whether any activity was stored before owners were recorded (athlete_id NULL)."""
+    return session.execute(select(Activity.id).where(Activity.athlete_id.is_(None)).limit(1)).first() is not None
+
+
+def claim_legacy_rows(session, athlete_id, batch_size=BATCH_SIZE):
+    """Give activities and efforts stored without an owner to `athlete_id`.
+
+    They were synced with the default credentials before athletes were
+    tracked, and sync skips activities it already has, so nothing else
+    would ever fill the owner in. Summaries of the touched segments and
+    the rollups kept under UNKNOWN_ATHLETE are rebuilt under the athlete.
+    The caller commits. Returns how many activities were claimed.
+    """
+    start_dates = session.execute(
+        select(Activity.start_date).where(Activity.athlete_id.is_(None))
+    ).scalars().all()
+    segment_ids = session.execute(
+        select(SegmentEffort.segment_id).where(SegmentEffort.athlete_id.is_(None)).distinct()
+    ).scalars().all()
+    claimed = session.execute(
+        update(Activity).where(Activity.athlete_id.is_(None)).values(athlete_id=athlete_id)
+    ).rowcount
+    session.execute(
+        update(SegmentEffort).where(SegmentEffort.athlete_id.is_(None)).values(athlete_id=athlete_id)
+    )
+    refresh_segment_bests(session, segment_ids, batch_size)
+    refresh_rollups(session, {(owner, start) for start in start_dates for owner in (None, athlete_id)})
+    return claimed
+
+
+def rollup_keys(session, activity_ids, batch_size=BATCH_SIZE):
+    """(athlete_id, start_date) of stored activities, for refresh_rollups."""
+    keys = set()
+    for chunk in _chunks(list(activity_ids), batch_size):
+        keys.update(session.execute(
+            select(Activity.athlete_id, Activity.start_date).where(Activity.id.in_(chunk))
+        ).all())
+    return keys
+
+
+def ingest_activities(session, activities):
+    """Upsert detailed activities and their segment efforts.
+
+    `activities` is a list of (summary, details) pairs; either may carry the
+    summary fields, the efforts come from `details`. The caller commits.
+    Returns (activities written, efforts written).
+    """
+    activity_rows = []
+    effort_rows = []
+    segment_rows = {}
+    for summary, details in activities:
+        row = activity_row(summary)
+        activity_rows.append(row)
+        for effort in details.get("segment_efforts", []):
+            effort_rows.append(effort_row(effort, summary["id"], row["athlete_id"]))
+            segment_rows[effort["segment"]["id"]] = segment_row(effort["segment"])
+
+    # An update can move an activity to another week or athlete; refresh the old buckets too.
+    touched = rollup_keys(session, [r["id"] for r in activity_rows])
+    touched.update((r["athlete_id"], r["start_date"]) for r in activity_rows)
+    upsert_activities(session, activity_rows)
+    refresh_rollups(session, touched)
+    index_activity_bounds(session, activity_rows)
+    upsert_segments(session, list(segment_rows.values()))
+    upsert_segment_efforts(session, effort_rows)
+    refresh_segment_bests(session, segment_rows.keys())
+    return len(activity_rows), len(effort_rows)
+
+
+def delete_activities(session, activity_ids, batch_size=BATCH_SIZE):
+    """Remove activities with their efforts, streams and bounding boxes.
+
+    Summaries of the segments they had efforts on, and the rollups of their
+    weeks and months, are recomputed. The
+    caller commits. Returns how many activities were deleted.
+    """
+    activity_ids = list(activity_ids)
+    deleted = 0
+    touched = set()
+    periods = rollup_keys(session, activity_ids, batch_size)
+    for chunk in _chunks(activity_ids, batch_size):
+        touched.update(session.execute(
+            select(SegmentEffort.segment_id).where(SegmentEffort.activity_id.in_(chunk)).distinct()
+        ).scalars())
+        session.execute(delete(SegmentEffort).where(SegmentEffort.activity_id.in_(chunk)))
+        session.execute(delete(ActivityStream).where(ActivityStream.activity_id.in_(chunk)))
+        session.execute(delete(activity_rtree).where(activity_rtree.c.id.in_(chunk)))
+        deleted += session.execute(delete(Activity).where(Activity.id.in_(chunk))).rowcount
+    refresh_segment_bests(session, touched)
+    refresh_rollups(session, periods)
+    return deleted
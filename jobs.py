@@ -0,0 +1,262 @@
+# jobs.py
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from athletes import UnknownAthlete, active_athletes, client_for
+from db import SessionLocal, SyncJob
+from strava_api import RateLimitExceeded, rate_limiter
+from sync import sync_activities, DEFAULT_WORKERS
+
+ACTIVE = ("queued", "running", "waiting")
+# Attempts in a row that ingest nothing new before a job is marked failed.
+MAX_IDLE_ATTEMPTS = 3
+# Jobs of different athletes run at once. They share one rate budget, which
+# the limiter hands out in turn, so this bounds threads and connections, not
+# API usage.
+MAX_PARALLEL = int(os.environ.get("STRAVA_SYNC_PARALLEL", "4"))
+
+
+class JobStopped(Exception):
+    """The runner is shutting down; the job stays resumable."""
+
+
+def submit_sync(session, limit=None, full=False, refresh=False, workers=DEFAULT_WORKERS, athlete_id=None):
+    """Queue a sync job for `athlete_id` (None: the default credentials) and return it.
+
+    An identical job that is still queued or running is returned instead of
+    a new one, and the latest identical job that failed is queued again, so
+    it carries on from its checkpoint rather than starting over.
+    """
+    job = (
+        session.query(SyncJob)
+        .filter(SyncJob.athlete_id.is_(athlete_id) if athlete_id is None else SyncJob.athlete_id == athlete_id,
+                SyncJob.limit == limit, SyncJob.full == full, SyncJob.refresh == refresh)
+        .order_by(SyncJob.id.desc())
+        .first()
+    )
+    now = datetime.now(timezone.utc)
+    if job is not None and job.status in ACTIVE:
+        return job
+    if job is not None and job.status == "failed":
+        job.status = "queued"
+        job.error = None
+        job.finished_at = None
+        job.workers = workers
+    else:
+        job = SyncJob(status="queued", athlete_id=athlete_id, limit=limit, full=full, refresh=refresh, workers=workers,
+                      listed=0, inserted_activities=0, inserted_segments=0, failed_activities=0,
+                      created_at=now)
+        session.add(job)
+    job.updated_at = now
+    session.commit()
+    runner.notify()
+    return job
+
+
+def submit_all(session, limit=None, full=False, refresh=False, workers=DEFAULT_WORKERS):
+    """Queue a sync job for every connected athlete; returns the jobs."""
+    return [submit_sync(session, limit, full, refresh, workers, athlete_id)
+            for athlete_id in active_athletes(session)]
+
+
+def job_progress(job):
+    """JSON-friendly progress of a job, with the API budget left and an ETA if the job has a limit."""
+    eta = None
+    if job.status in ACTIVE and job.limit is not None and job.started_at and job.inserted_activities:
+        started = job.started_at.replace(tzinfo=timezone.utc).timestamp()
+        elapsed = (job.updated_at or job.started_at).replace(tzinfo=timezone.utc).timestamp() - started
+        remaining = max(0, job.limit - job.inserted_activities)
+        if elapsed > 0:
+            eta = round(remaining * elapsed / job.inserted_activities)
+    return {
+        "id": job.id,
+        "status": job.status,
+        "athlete_id": job.athlete_id,
+        "params": {"limit": job.limit, "full": job.full, "refresh": job.refresh, "workers": job.workers},
+        "listed_activities": job.listed,
+        "inserted_activities": job.inserted_activities,
+        "inserted_segments": job.inserted_segments,
+        "failed_activities": job.failed_activities,
+        "checkpoint": datetime.fromtimestamp(job.checkpoint, timezone.utc).isoformat() if job.checkpoint else None,
+        "rate_budget_remaining": rate_limiter.remaining(),
+        "eta_seconds": eta,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "updated_at": job.updated_at,
+        "finished_at": job.finished_at,
+    }
+
+
+class JobRunner:
+    """Runs queued sync jobs on background threads, up to `max_parallel` at once.
+
+    At most one job per athlete runs at a time, and jobs are started oldest
+    first among athletes that have none running. All of them draw on the
+    one Strava rate budget, shared in turn between athletes, so a long
+    backfill slows down when others are waiting instead of starving them.
+    Progress is committed with every page; a job that was running when the
+    process stopped is picked up again on the next start.
+    """
+
+    def __init__(self, session_factory=SessionLocal, max_parallel=MAX_PARALLEL):
+        self.session_factory = session_factory
+        self.max_parallel = max_parallel
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        # job id -> (athlete id, thread)
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        session = self.session_factory()
+        try:
+            interrupted = session.query(SyncJob).filter(SyncJob.status.in_(("running", "waiting"))).all()
+            for job in interrupted:
+                job.status = "queued"
+            session.commit()
+            if interrupted:
+                print(f"🔁 Resuming {len(interrupted)} interrupted sync job(s).")
+        finally:
+            session.close()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="sync-jobs", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._lock:
+            threads = [thread for _, thread in self._running.values()]
+        for thread in threads:
+            thread.join(timeout)
+
+    def notify(self):
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            for job_id, athlete_id in self._next_jobs():
+                thread = threading.Thread(target=self._run_job, args=(job_id,), name=f"sync-job-{job_id}",
+                                          daemon=True)
+                with self._lock:
+                    self._running[job_id] = (athlete_id, thread)
+                thread.start()
+            self._wake.wait()
+
+    def _run_job(self, job_id):
+        try:
+            self.run(job_id)
+        except JobStopped:
+            pass
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+            self._wake.set()
+
+    def _next_jobs(self):
+        """(job id, athlete id) of queued jobs to start now, oldest first, one per idle athlete."""
+        with self._lock:
+            busy = {athlete_id for athlete_id, _ in self._running.values()}
+            running = set(self._running)
+            free = self.max_parallel - len(self._running)
+        if free <= 0:
+            return []
+        session = self.session_factory()
+        try:
+            picked = []
+            for job in session.query(SyncJob).filter(SyncJob.status == "queued").order_by(SyncJob.id):
+                if len(picked) >= free:
+                    break
+                if job.id in running or job.athlete_id in busy:
+                    continue
+                busy.add(job.athlete_id)
+                picked.append((job.id, job.athlete_id))
+            return picked
+        finally:
+            session.close()
+
+    def _sleep_until(self, until):
+        if self._stop.wait(max(0.0, until - time.time())):
+            raise JobStopped()
+
+    def run(self, job_id):
+        session = self.session_factory()
+        job = session.get(SyncJob, job_id)
+        job.status = "running"
+        job.started_at = job.started_at or datetime.now(timezone.utc)
+        session.commit()
+        idle = 0
+        try:
+            while True:
+                if self._stop.is_set():
+                    raise JobStopped()
+                remaining = None if job.limit is None else job.limit - job.inserted_activities
+                if remaining is not None and remaining <= 0:
+                    break
+                base = (job.listed, job.inserted_activities, job.inserted_segments, job.failed_activities)
+
+                def on_page(progress):
+                    job.listed = base[0] + progress["listed_activities"]
+                    job.inserted_activities = base[1] + progress["inserted_activities"]
+                    job.inserted_segments = base[2] + progress["inserted_segments"]
+                    job.failed_activities = base[3] + progress["failed_activities"]
+                    job.checkpoint = progress["checkpoint"]
+                    job.updated_at = datetime.now(timezone.utc)
+
+                try:
+                    result = sync_activities(session, limit=remaining, full=job.full, refresh=job.refresh,
+                                             workers=job.workers, after=job.checkpoint, on_page=on_page,
+                                             client=client_for(job.athlete_id))
+                except RateLimitExceeded as e:
+                    session.rollback()
+                    job.status = "waiting"
+                    job.updated_at = datetime.now(timezone.utc)
+                    session.commit()
+                    print(f"⏳ Sync job {job.id} waiting for the rate limit until {time.ctime(e.retry_at)}.")
+                    self._sleep_until(e.retry_at)
+                    job.status = "running"
+                    session.commit()
+                    continue
+
+                if not result["failed_activities"]:
+                    break
+                # Some details failed; the checkpoint stops before them, so
+                # another pass retries just those.
+                idle = 0 if result["inserted_activities"] else idle + 1
+                if idle >= MAX_IDLE_ATTEMPTS:
+                    raise RuntimeError(f"{result['failed_activities']} activities keep failing")
+            job.status = "done"
+            job.finished_at = datetime.now(timezone.utc)
+        except JobStopped:
+            session.rollback()
+            raise
+        except UnknownAthlete as e:
+            # Never sync with someone else's tokens; the job fails instead.
+            print(f"⚠️ Sync job {job.id} skipped: {e}.")
+            session.rollback()
+            job.status = "failed"
+            job.error = str(e)
+            job.finished_at = datetime.now(timezone.utc)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            session.rollback()
+            job.status = "failed"
+            job.error = str(e)
+            job.finished_at = datetime.now(timezone.utc)
+        finally:
+            job.updated_at = datetime.now(timezone.utc)
+            session.commit()
+            session.close()
+
+
+runner = JobRunner()
@@ -1,105 +1,252 @@
-from fastapi import FastAPI, Depends
-from db import SessionLocal, Activity, SegmentEffort, get_db
-from strava_api import get_all_activities, get_activity_details
-from datetime import datetime
-import time
-from polyline import decode
-from fastapi.responses import JSONResponse, HTMLResponse
-from sqlalchemy import func
+import base64
+import json
+from contextlib import asynccontextmanager
+from itertools import islice
+from typing import Optional
+
+from fastapi import FastAPI, Body, Depends, Request
+from fastapi.encoders import jsonable_encoder
+from db import Activity, Athlete, SegmentEffort, Segment, SegmentBest, SyncJob, get_db, get_write_db, init_db, activity_rtree, segment_rtree, read_engine, write_engine
+from sync import DEFAULT_WORKERS
+from jobs import submit_all, submit_sync, job_progress, runner as job_runner
+import athletes
+import strava_api
+from cache import cached_json, cached_bytes, response_cache
+from compression import StaticAsset
+import metrics
+from metrics import MetricsMiddleware, ProfiledRoute, instrument_engine
+from heatmap import reload as reload_heatmaps, render_tile, tile_cache
+from geo import MAX_ZOOM
+from progress import MAX_SEGMENTS, parse_ids, segments_progress
+from streams import load_streams
+from matcher import match_activity
+from rollups import PERIODS, query_rollups, rollup_dict, year_over_year
+from segment_gaps import point_features, refresher as segment_refresher, segment_gaps, stale_segment_ids
+import webhooks
+from datetime import date, datetime
+from geo import resolve_tolerance, line_feature, feature_collection, parse_bbox, rtree_overlapping, filter_in_bbox
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse, RedirectResponse, StreamingResponse
+from sqlalchemy import select, tuple_
 from sqlalchemy.orm import Session
 
 
 
-app = FastAPI(title="Strava Database API")
+@asynccontextmanager
+async def lifespan(app):
+    init_db()
+    # Picks up queued jobs, including ones interrupted by a restart.
+    job_runner.start()
+    webhooks.worker.start()
+    segment_refresher.start()
+    yield
+    segment_refresher.stop(timeout=5)
+    webhooks.worker.stop(timeout=5)
+    job_runner.stop(timeout=5)
+
+
+app = FastAPI(title="Strava Database API", lifespan=lifespan)
+# Profiles endpoints slower than STRAVA_PROFILE_SLOW_MS; a plain APIRoute when that is unset.
+app.router.route_class = ProfiledRoute
+app.add_middleware(MetricsMiddleware)
+instrument_engine(read_engine, "read")
+instrument_engine(write_engine, "write")
+
+index_page = StaticAsset("templates/index.html", "text/html; charset=utf-8")
 
 @app.get("/", response_class=HTMLResponse)
-def root():
-    with open("templates/index.html", encoding="utf-8") as f:
-        return f.read()
+def root(request: Request):
+    return index_page.respond(request)
 
 @app.api_route("/sync", methods=["GET", "POST"])
-def sync_activities(limit: int = 100):
-    session = SessionLocal()
-    inserted_activities = 0
-    inserted_segments = 0
+def sync_activities(limit: Optional[int] = 100, full: bool = False, refresh: bool = False,
+                    workers: int = DEFAULT_WORKERS, athlete_id: Optional[int] = None,
+                    db: Session = Depends(get_write_db)):
+    """Queue a background sync and return its job; poll /sync/jobs/{id} for progress.
 
-    try:
-        activities = get_all_activities(limit=limit)
-        print(f"Fetched {len(activities)} activities")
-
-        for act in activities:
-            if session.query(Activity).filter(Activity.id == act["id"]).first():
-                continue  # skip existing activities
-
-            # Create new activity
-            new_act = Activity(
-                id=act["id"],
-                name=act.get("name"),
-                type=act.get("type"),
-                distance=act.get("distance"),
-                moving_time=act.get("moving_time"),
-                elapsed_time=act.get("elapsed_time"),
-                total_elevation_gain=act.get("total_elevation_gain"),
-                start_date=datetime.fromisoformat(act["start_date"].replace("Z", "+00:00")),
-                average_speed=act.get("average_speed"),
-                max_speed=act.get("max_speed"),
-                average_heartrate=act.get("average_heartrate"),
-                polyline=act.get("map", {}).get("summary_polyline"),
-            )
-            session.add(new_act)
-            inserted_activities += 1
-
-            # Get detailed activity to extract segments
-            details = get_activity_details(act["id"])
-            time.sleep(1.5)  # to avoid rate limit
-
-            for effort in details.get("segment_efforts", []):
-                seg = effort["segment"]
-                seg_id = seg["id"]
-                seg_name = seg["name"]
-                pr_rank = effort.get("pr_rank")
-
-                segment_effort = SegmentEffort(
-                    effort_id=effort["id"],
-                    segment_id=seg_id,
-                    segment_name=seg_name,
-                    distance=seg.get("distance"),
-                    average_grade=seg.get("average_grade"),
-                    elapsed_time=effort.get("elapsed_time"),
-                    start_date=datetime.fromisoformat(effort["start_date"].replace("Z", "+00:00")),
-                    pr_rank=pr_rank,
-                    is_pr=(pr_rank == 1),
-                    activity=new_act,
-                )
-                session.add(segment_effort)
-                inserted_segments += 1
-
-        session.commit()
-        return {
-            "inserted_activities": inserted_activities,
-            "inserted_segments": inserted_segments,
-        }
+    `athlete_id` syncs a connected athlete; without it the default credentials are used.
+    """
+    job = submit_sync(db, limit=limit, full=full, refresh=refresh, workers=workers, athlete_id=athlete_id)
+    return JSONResponse(status_code=202, content=jsonable_encoder(job_progress(job)))
+
+@app.api_route("/sync/all", methods=["GET", "POST"])
+def sync_all_athletes(limit: Optional[int] = 100, full: bool = False, refresh: bool = False,
+                      workers: int = DEFAULT_WORKERS, db: Session = Depends(get_write_db)):
+    """Queue a sync job for every connected athlete; they run in parallel and share the rate budget."""
+    jobs = submit_all(db, limit=limit, full=full, refresh=refresh, workers=workers)
+    return JSONResponse(status_code=202, content=jsonable_encoder([job_progress(job) for job in jobs]))
+
+@app.get("/sync/jobs")
+def list_sync_jobs(limit: int = 20, athlete_id: Optional[int] = None, db: Session = Depends(get_db)):
+    query = db.query(SyncJob)
+    if athlete_id is not None:
+        query = query.filter(SyncJob.athlete_id == athlete_id)
+    jobs = query.order_by(SyncJob.id.desc()).limit(min(limit, 100)).all()
+    return [job_progress(job) for job in jobs]
+
+@app.get("/sync/jobs/{job_id}")
+def get_sync_job(job_id: int, db: Session = Depends(get_db)):
+    job = db.get(SyncJob, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"no sync job {job_id}"})
+    return job_progress(job)
+
+@app.get("/auth/strava")
+def connect_strava(request: Request):
+    """Send an athlete to Strava to authorize the app; Strava returns them to /auth/strava/callback."""
+    return RedirectResponse(strava_api.authorize_url(str(request.url_for("strava_callback"))))
 
+@app.get("/auth/strava/callback")
+def strava_callback(code: Optional[str] = None, error: Optional[str] = None, scope: Optional[str] = None,
+                    db: Session = Depends(get_write_db)):
+    """Store the athlete's tokens and queue their first sync."""
+    if error or not code:
+        return JSONResponse(status_code=400, content={"error": error or "missing code"})
+    try:
+        data = strava_api.exchange_code(code)
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return {"error": str(e)}
-    finally:
-        session.close()
+        return JSONResponse(status_code=502, content={"error": f"token exchange failed: {e}"})
+    if scope is not None:
+        data["scope"] = scope
+    athlete = athletes.register(db, data)
+    db.commit()
+    job = submit_sync(db, limit=None, athlete_id=athlete.id)
+    return {"athlete": athletes.athlete_json(athlete), "sync_job": job_progress(job)}
+
+@app.post("/cache/invalidate")
+def invalidate_cache():
+    """Drop cached responses and reload heatmaps after another process changed the data,
+    e.g. `python raw_store.py replay`."""
+    reload_heatmaps()
+    return {"generation": response_cache.bump_generation()}
+
+@app.get("/athletes")
+def list_athletes(db: Session = Depends(get_db)):
+    return [athletes.athlete_json(a) for a in db.query(Athlete).order_by(Athlete.id)]
+
+@app.get("/webhook")
+def validate_webhook(request: Request):
+    """Strava's subscription check: echo `hub.challenge` if the verify token matches."""
+    params = request.query_params
+    if not webhooks.VERIFY_TOKEN or params.get("hub.verify_token") != webhooks.VERIFY_TOKEN:
+        return JSONResponse(status_code=403, content={"error": "verify token does not match"})
+    return {"hub.challenge": params.get("hub.challenge")}
+
+@app.post("/webhook")
+def receive_webhook(payload: dict = Body(...), db: Session = Depends(get_write_db)):
+    """Store a push event for the webhook worker; Strava wants a 200 within two seconds."""
+    try:
+        event = webhooks.enqueue(db, payload)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    return {"queued": event.id}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Request, Strava API, SQL and cache metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+ACTIVITY_PAGE_MAX = 1000
+
+
+def encode_cursor(start_date, activity_id):
+    raw = f"{start_date.isoformat()}|{activity_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    start_date, activity_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(start_date), int(activity_id)
+
+
+def activities_query(type=None, after=None, before=None, cursor=None, bbox=None, athlete_id=None):
+    """Column-only SELECT of activities, newest first, keyset-paginated on (start_date, id).
+
+    With `bbox` only R*Tree candidates are selected (plus their polyline);
+    callers still have to run `filter_in_bbox` on the rows.
+    """
+    query = select(
+        Activity.id, Activity.name, Activity.type, Activity.distance, Activity.start_date,
+    ).order_by(Activity.start_date.desc(), Activity.id.desc())
+    if bbox:
+        query = query.add_columns(Activity.polyline).where(
+            Activity.id.in_(rtree_overlapping(activity_rtree, bbox))
+        )
+    if type:
+        query = query.where(Activity.type == type)
+    if athlete_id is not None:
+        query = query.where(Activity.athlete_id == athlete_id)
+    if after:
+        query = query.where(Activity.start_date >= after)
+    if before:
+        query = query.where(Activity.start_date < before)
+    if cursor:
+        query = query.where(tuple_(Activity.start_date, Activity.id) < tuple_(*cursor))
+    return query
+
+
+def owner_of(db, athlete_id):
+    """`athlete_id`, or the default athlete for a request that names none."""
+    return athlete_id if athlete_id is not None else athletes.default_athlete(db)
+
+
+def activity_json(row):
+    return {
+        "id": row.id,
+        "name": row.name,
+        "type": row.type,
+        "distance_km": round(row.distance / 1000, 2) if row.distance is not None else None,
+        "start_date": row.start_date,
+    }
+
 
 @app.get("/activities")
-def list_activities():
-    session = SessionLocal()
-    acts = session.query(Activity).order_by(Activity.start_date.desc()).all()
-    return [
-        {
-            "id": a.id,
-            "name": a.name,
-            "distance_km": round(a.distance / 1000, 2),
-            "start_date": a.start_date,
-        }
-        for a in acts
-    ]
+def list_activities(request: Request, limit: int = 100, cursor: Optional[str] = None,
+                    type: Optional[str] = None, after: Optional[datetime] = None,
+                    before: Optional[datetime] = None, bbox: Optional[str] = None,
+                    athlete_id: Optional[int] = None, format: str = "json", db: Session = Depends(get_db)):
+    """
+    List stored activities of `athlete_id` (else the default athlete), newest first.
+    Pass the returned `next_cursor` back as `cursor` for the next page.
+    `bbox=min_lng,min_lat,max_lng,max_lat` keeps routes passing through that box.
+    `format=ndjson` streams every matching activity, one JSON object per line.
+    """
+    try:
+        position = decode_cursor(cursor) if cursor else None
+    except (ValueError, UnicodeDecodeError):
+        return JSONResponse(status_code=400, content={"error": "invalid cursor"})
+    try:
+        box = parse_bbox(bbox) if bbox else None
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    def query():
+        return activities_query(type=type, after=after, before=before, cursor=position, bbox=box,
+                                athlete_id=owner_of(db, athlete_id))
+
+    def matching():
+        rows = db.execute(query().execution_options(yield_per=1000))
+        return filter_in_bbox(rows, box) if box else rows
+
+    if format == "ndjson":
+        # The session stays open until the response has been sent.
+        def stream():
+            for row in matching():
+                yield json.dumps(jsonable_encoder(activity_json(row))) + "\n"
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    limit = max(1, min(limit, ACTIVITY_PAGE_MAX))
+
+    def build():
+        if box:
+            rows = list(islice(matching(), limit + 1))
+        else:
+            rows = db.execute(query().limit(limit + 1)).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].start_date, rows[-1].id)
+        return {"data": [activity_json(r) for r in rows], "next_cursor": next_cursor}
+    return cached_json(request, build)
 
 @app.get("/latest")
 def get_latest_activity():
@@ -132,106 +279,285 @@ def get_latest_activity():
         return {"error": str(e)}
     
 @app.get("/prs")
-def get_all_prs():
-    session = SessionLocal()
-    prs = session.query(SegmentEffort).filter(SegmentEffort.is_pr == True).all()
-
-    results = []
-    for pr in prs:
-        results.append({
-            "segment_name": pr.segment_name,
-            "distance_km": round(pr.distance / 1000, 2) if pr.distance else None,
-            "elapsed_time_s": pr.elapsed_time,
-            "activity_id": pr.activity_id,
-            "start_date": pr.start_date,
-        })
-
-    session.close()
-    return results
-
-# @app.get("/prs_geojson")
-# def get_all_pr_segments():
-#     """
-#     Returns all PR segment polylines (is_pr == True) as a GeoJSON FeatureCollection.
-#     """
-#     session = SessionLocal()
-
-#     prs = (
-#         session.query(SegmentEffort)
-#         .filter(SegmentEffort.is_pr == True, SegmentEffort.segment_polyline != None)
-#         .all()
-#     )
-
-#     features = []
-#     for seg in prs:
-#         try:
-#             coords = decode(seg.segment_polyline)
-#         except Exception:
-#             continue
-
-#         features.append({
-#             "type": "Feature",
-#             "geometry": {
-#                 "type": "LineString",
-#                 "coordinates": [[lon, lat] for lat, lon in coords],
-#             },
-#             "properties": {
-#                 "segment_name": seg.segment_name,
-#                 "distance_km": round(seg.distance / 1000, 2) if seg.distance else None,
-#                 "avg_grade": seg.average_grade,
-#                 "elapsed_time_s": seg.elapsed_time,
-#                 "start_date": str(seg.start_date),
-#             },
-#         })
-
-#     session.close()
-#     return JSONResponse(content={"type": "FeatureCollection", "features": features})
+def get_all_prs(request: Request, athlete_id: Optional[int] = None, db: Session = Depends(get_db)):
+    def build():
+        owner = owner_of(db, athlete_id)
+        query = db.query(SegmentEffort).filter(SegmentEffort.is_pr == True)
+        if owner is not None:
+            query = query.filter(SegmentEffort.athlete_id == owner)
+        prs = query.all()
+
+        results = []
+        for pr in prs:
+            results.append({
+                "segment_name": pr.segment_name,
+                "distance_km": round(pr.distance / 1000, 2) if pr.distance else None,
+                "elapsed_time_s": pr.elapsed_time,
+                "activity_id": pr.activity_id,
+                "athlete_id": pr.athlete_id,
+                "start_date": pr.start_date,
+            })
+        return results
+    return cached_json(request, build)
+
+@app.get("/prs_geojson")
+def get_all_pr_segments(request: Request, zoom: Optional[int] = None, tolerance: Optional[float] = None,
+                        athlete_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    Returns all PR segment polylines as a GeoJSON FeatureCollection.
+    Geometries are simplified for `zoom` (or `tolerance` in degrees).
+    Without `athlete_id` the default athlete's PR segments are returned.
+    """
+    tol = resolve_tolerance(zoom, tolerance)
+
+    def build():
+        owner = owner_of(db, athlete_id)
+        query = (
+            db.query(
+                Segment.segment_id, Segment.name, Segment.distance, Segment.average_grade,
+                Segment.polyline, SegmentBest.athlete_id, SegmentBest.best_time, SegmentBest.last_pr_date,
+            )
+            .join(SegmentBest, SegmentBest.segment_id == Segment.segment_id)
+            .filter(SegmentBest.pr_count > 0, Segment.polyline != None)
+        )
+        if owner is not None:
+            query = query.filter(SegmentBest.athlete_id == owner)
+        rows = query.all()
+        return feature_collection(
+            line_feature(("segment", row.segment_id), row.polyline, tol, {
+                "segment_id": row.segment_id,
+                "segment_name": row.name,
+                "distance_km": round(row.distance / 1000, 2) if row.distance else None,
+                "avg_grade": row.average_grade,
+                "athlete_id": row.athlete_id,
+                "best_time": row.best_time,
+                "last_date": row.last_pr_date,
+            })
+            for row in rows
+        )
+    return cached_json(request, build)
+
+@app.get("/activities_geojson")
+def get_activity_routes(request: Request, zoom: Optional[int] = None, tolerance: Optional[float] = None,
+                        type: Optional[str] = None, after: Optional[datetime] = None,
+                        before: Optional[datetime] = None, limit: int = ACTIVITY_PAGE_MAX,
+                        athlete_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    Returns activity routes as a GeoJSON FeatureCollection, newest first,
+    of `athlete_id` or else the default athlete.
+    Geometries are simplified for `zoom` (or `tolerance` in degrees).
+    """
+    tol = resolve_tolerance(zoom, tolerance)
+
+    def build():
+        query = (
+            activities_query(type=type, after=after, before=before, athlete_id=owner_of(db, athlete_id))
+            .add_columns(Activity.polyline)
+            .where(Activity.polyline != None)
+            .limit(max(1, min(limit, ACTIVITY_PAGE_MAX)))
+        )
+        rows = db.execute(query).all()
+        return feature_collection(
+            line_feature(("activity", row.id), row.polyline, tol, activity_json(row)) for row in rows
+        )
+    return cached_json(request, build)
 
 @app.get("/prs_table")
-def prs_table():
-    session = SessionLocal()
-    best_prs = (
-        session.query(
-            SegmentEffort.segment_id,
-            SegmentEffort.segment_name,
-            func.min(SegmentEffort.elapsed_time).label("best_time"),
-            func.max(SegmentEffort.start_date).label("last_date"),
-            SegmentEffort.segment_polyline,
+def prs_table(request: Request, bbox: Optional[str] = None, athlete_id: Optional[int] = None,
+              db: Session = Depends(get_db)):
+    """
+    Best time per PR segment, of `athlete_id` or else the default athlete.
+    `bbox=min_lng,min_lat,max_lng,max_lat` keeps segments passing through that box.
+    Geometries come from /prs_geojson; the polyline is only read for `bbox`.
+    """
+    try:
+        box = parse_bbox(bbox) if bbox else None
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    def build():
+        owner = owner_of(db, athlete_id)
+        query = (
+            db.query(
+                SegmentBest.segment_id,
+                SegmentBest.athlete_id,
+                Segment.name.label("segment_name"),
+                SegmentBest.best_time,
+                SegmentBest.last_pr_date.label("last_date"),
+                SegmentBest.attempt_count,
+            )
+            .join(Segment, Segment.segment_id == SegmentBest.segment_id)
+            .filter(SegmentBest.pr_count > 0, Segment.polyline != None)
         )
-        .filter(SegmentEffort.is_pr == True, SegmentEffort.segment_polyline != None)
-        .group_by(SegmentEffort.segment_id, SegmentEffort.segment_name, SegmentEffort.segment_polyline)
-        .all()
-    )
-    session.close()
-    return [dict(row._mapping) for row in best_prs]
+        if owner is not None:
+            query = query.filter(SegmentBest.athlete_id == owner)
+        if box:
+            query = (query.add_columns(Segment.polyline.label("segment_polyline"))
+                     .filter(Segment.segment_id.in_(rtree_overlapping(segment_rtree, box))))
+        best_prs = query.all()
+        if box:
+            best_prs = filter_in_bbox(best_prs, box, attr="segment_polyline")
+        return [{k: v for k, v in row._mapping.items() if k != "segment_polyline"} for row in best_prs]
+    return cached_json(request, build)
+
+@app.get("/heatmap/{z}/{x}/{y}.png")
+def heatmap_tile(z: int, x: int, y: int, request: Request, athlete_id: Optional[int] = None,
+                 db: Session = Depends(get_db)):
+    """Personal heatmap of `athlete_id` (else the default athlete) as 256px web-map tiles."""
+    if not 0 <= z <= MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return JSONResponse(status_code=404, content={"error": "tile out of range"})
+
+    def render():
+        owner = owner_of(db, athlete_id)
+        return render_tile(z, x, y, owner)
+    return cached_bytes(request, render, "image/png", tile_cache)
+
+@app.get("/activities/{activity_id}/streams")
+def get_activity_streams(activity_id: int, request: Request, types: Optional[str] = None,
+                         db: Session = Depends(get_db)):
+    """Stored streams of one activity as arrays keyed by type; `?types=time,heartrate` to pick some.
+
+    Empty until streams.py has fetched them.
+    """
+    kinds = [t for t in types.split(",") if t] if types else None
+
+    def build():
+        loaded = load_streams(db, activity_id, kinds)
+        return {"activity_id": activity_id, "streams": {k: v.tolist() for k, v in loaded.items()}}
+    return cached_json(request, build)
+
+@app.get("/activities/{activity_id}/matches")
+def get_activity_matches(activity_id: int, request: Request, db: Session = Depends(get_db)):
+    """Known segments the activity's route crosses, matched locally without calling Strava."""
+    def build():
+        activity = db.get(Activity, activity_id)
+        if activity is None:
+            raise LookupError(activity_id)
+        return {"activity_id": activity_id, "matches": match_activity(db, activity)}
+    try:
+        return cached_json(request, build)
+    except LookupError:
+        # Raised before anything is cached, so the id is looked up again once it exists.
+        return JSONResponse(status_code=404, content={"error": f"no activity {activity_id}"})
+
+@app.get("/stats")
+def get_stats(request: Request, period: str = "week", type: Optional[str] = None,
+              start: Optional[date] = None, end: Optional[date] = None,
+              athlete_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    Weekly or monthly training totals per activity type, oldest first,
+    of `athlete_id` or else the default athlete.
+    `type=Run,Ride` picks types; `start`/`end` (YYYY-MM-DD) bound the periods returned.
+    Read from the rollups kept by ingest, so the cost doesn't grow with the history.
+    """
+    if period not in PERIODS:
+        return JSONResponse(status_code=400, content={"error": f"period must be one of {', '.join(PERIODS)}"})
+    types = [t for t in type.split(",") if t] if type else None
+
+    def build():
+        rows = query_rollups(db, period, types, start, end, owner_of(db, athlete_id))
+        return {"period": period, "data": [rollup_dict(r) for r in rows]}
+    return cached_json(request, build)
+
+@app.get("/stats/year_over_year")
+def get_stats_year_over_year(request: Request, period: str = "month", type: Optional[str] = None,
+                             athlete_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    Totals per year as 12 monthly (or 53 ISO-week) slots per type, for comparing years side by side.
+    Empty slots are null. Of `athlete_id`, or else the default athlete.
+    """
+    if period not in PERIODS:
+        return JSONResponse(status_code=400, content={"error": f"period must be one of {', '.join(PERIODS)}"})
+    types = [t for t in type.split(",") if t] if type else None
+
+    def build():
+        series = year_over_year(query_rollups(db, period, types, athlete_id=owner_of(db, athlete_id)))
+        return {"period": period, "years": {str(y): v for y, v in sorted(series.items())}}
+    return cached_json(request, build)
+
+@app.get("/segments")
+def get_segments(request: Request, athlete_id: Optional[int] = None, pr_only: bool = False,
+                 bbox: Optional[str] = None, format: str = "json", db: Session = Depends(get_db)):
+    """
+    Best effort per segment next to its KOM/QOM: `pr_time`, `kom_time`, `qom_time`,
+    `difference` (seconds behind the KOM), closest first.
+    Of `athlete_id`, or else the default athlete.
+    Served from the database only; segments whose KOM/QOM is missing or old are
+    refreshed in the background and show up on a later call.
+    `format=geojson` returns the same rows as Point features at each segment's start
+    (null geometry until the start is known).
+    `bbox=min_lng,min_lat,max_lng,max_lat` keeps segments starting in that box.
+    """
+    try:
+        box = parse_bbox(bbox) if bbox else None
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    def build():
+        rows = segment_gaps(db, owner_of(db, athlete_id), pr_only, box)
+        segment_refresher.request({r["segment_id"] for r in rows if r["stale"]})
+        if format == "geojson":
+            return feature_collection(point_features(rows))
+        return rows
+    return cached_json(request, build)
+
+@app.post("/update_segments")
+def update_segments(limit: Optional[int] = None, db: Session = Depends(get_db)):
+    """Queue a background refresh of stale segment details (at most `limit`); returns right away."""
+    queued = segment_refresher.request(stale_segment_ids(db, limit), force=True)
+    return {"message": f"Refreshing {queued} segments in the background ({segment_refresher.pending()} queued).",
+            "queued": queued}
+
+@app.get("/segments/progress")
+def get_segments_progress(request: Request, athlete_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    Progress of many segments in one call: `?ids=1,2,3`, of `athlete_id` or else the default athlete.
+    Each segment has parallel `dates` / `elapsed_time` / `rolling_best`
+    arrays plus summary stats.
+    """
+    try:
+        ids = parse_ids(request.query_params.getlist("ids"))
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "ids must be integers"})
+    if len(ids) > MAX_SEGMENTS:
+        return JSONResponse(status_code=400, content={"error": f"at most {MAX_SEGMENTS} ids per request"})
+
+    def build():
+        series = segments_progress(db, ids, owner_of(db, athlete_id)) if ids else {}
+        return {"segments": {str(k): v for k, v in series.items()}}
+    return cached_json(request, build)
 
 @app.get("/segment/{segment_id}/progress")
-def get_segment_progress(segment_id: int, db: Session = Depends(get_db)):
+def get_segment_progress(segment_id: int, request: Request, athlete_id: Optional[int] = None,
+                         db: Session = Depends(get_db)):
     """
-    Return all efforts for a given segment, sorted by date.
+    Return all efforts for a given segment, sorted by date, of `athlete_id` or else the default athlete.
     Each entry includes date, elapsed_time, and average_speed (if available).
+    Locally matched efforts (estimated times, no Strava effort id) are left out.
     """
-    efforts = (
-        db.query(SegmentEffort)
-        .filter(SegmentEffort.segment_id == segment_id)
-        .order_by(SegmentEffort.start_date)
-        .all()
-    )
+    def build():
+        query = db.query(SegmentEffort).filter(SegmentEffort.segment_id == segment_id,
+                                               SegmentEffort.effort_id.isnot(None))
+        owner = owner_of(db, athlete_id)
+        if owner is not None:
+            query = query.filter(SegmentEffort.athlete_id == owner)
+        efforts = query.order_by(SegmentEffort.start_date).all()
 
-    if not efforts:
-        return {"message": f"No efforts found for segment {segment_id}", "data": []}
+        if not efforts:
+            return {"message": f"No efforts found for segment {segment_id}", "data": []}
 
-    return {
-        "segment_id": segment_id,
-        "segment_name": efforts[0].segment_name if efforts[0].segment_name else None,
-        "data": [
-            {
-                "date": e.start_date.isoformat() if isinstance(e.start_date, datetime) else e.start_date,
-                "elapsed_time": e.elapsed_time,
-                # "distance": e.distance,
-                # "average_speed": (e.distance / e.elapsed_time) if e.elapsed_time and e.distance else None,
-                # "is_pr": e.is_pr,
-            }
-            for e in efforts
-        ],
-    }
\ No newline at end of file
+        return {
+            "segment_id": segment_id,
+            "segment_name": efforts[0].segment_name if efforts[0].segment_name else None,
+            "data": [
+                {
+                    "date": e.start_date.isoformat() if isinstance(e.start_date, datetime) else e.start_date,
+                    "elapsed_time": e.elapsed_time,
+                    # "distance": e.distance,
+                    # "average_speed": (e.distance / e.elapsed_time) if e.elapsed_time and e.distance else None,
+                    # "is_pr": e.is_pr,
+                }
+                for e in efforts
+            ],
+        }
+    return cached_json(request, build)
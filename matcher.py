@@ -0,0 +1,258 @@
+# matcher.py
+from datetime import timedelta
+
+import numpy as np
+from sqlalchemy import delete, exists, select
+
+from db import Activity, Segment, SegmentEffort, segment_rtree
+from geo import decode_many
+from polyline_codec import decode
+from streams import load_streams
+
+METERS_PER_DEGREE = 111_320.0
+# How close the track has to pass to a segment's start and end point.
+ENDPOINT_RADIUS = 30.0
+# How close every sampled point of the segment has to be to the track between them.
+FOLLOW_RADIUS = 40.0
+# Points of the segment checked against the track.
+FOLLOW_SAMPLES = 20
+# Track length between start and end, relative to the segment's length.
+LENGTH_RATIO = (0.8, 1.6)
+# Padding of the track's box when prefiltering, in degrees (~100 m).
+BOX_MARGIN = 0.001
+# Sync only skips an activity's details if no segment's start and end are
+# both this close to its route; looser than matching, since a wrong skip
+# loses efforts.
+NEAR_RADIUS = 100.0
+
+
+def local_xy(coords, origin):
+    """(n, 2) meters east/north of `origin` for (lat, lng) points; fine over a ride's extent."""
+    coords = np.asarray(coords, dtype=np.float64)
+    scale = np.array([np.cos(np.radians(origin[0])), 1.0]) * METERS_PER_DEGREE
+    return (coords[:, ::-1] - np.asarray(origin)[::-1]) * scale
+
+
+def distance_to_path(points, path):
+    """Distance of each of `points` to each edge of `path`, and where along the edge it is closest.
+
+    Returns (k, n-1) arrays of distances and of the edge parameter t in [0, 1].
+    """
+    a, b = path[:-1], path[1:]
+    d = b - a
+    length2 = (d ** 2).sum(axis=1)
+    rel = points[:, None, :] - a[None, :, :]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.clip(np.where(length2 > 0, (rel * d).sum(axis=2) / length2, 0.0), 0.0, 1.0)
+    nearest = a[None] + t[..., None] * d[None]
+    return np.sqrt(((points[:, None, :] - nearest) ** 2).sum(axis=2)), t
+
+
+def passes(distances, params, radius):
+    """Fractional track positions where the track passes within `radius`, one per pass."""
+    close = distances <= radius
+    if not close.any():
+        return []
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], close.astype(np.int8), [0]])))
+    out = []
+    for first, last in zip(edges[::2], edges[1::2]):
+        i = first + int(np.argmin(distances[first:last]))
+        out.append(i + float(params[i]))
+    return out
+
+
+def at(values, position):
+    """`values` interpolated at a fractional index."""
+    return float(np.interp(position, np.arange(len(values)), values))
+
+
+class Track:
+    """An activity's route in local meters, with the time at every point."""
+
+    def __init__(self, coords, times):
+        self.coords = np.asarray(coords, dtype=np.float64)
+        self.origin = self.coords[0]
+        self.xy = local_xy(self.coords, self.origin)
+        self.along = np.concatenate([[0.0], np.cumsum(np.sqrt((np.diff(self.xy, axis=0) ** 2).sum(axis=1)))])
+        self.times = np.asarray(times, dtype=np.float64)
+
+    @classmethod
+    def from_polyline(cls, coords, moving_time):
+        """Track from a summary polyline; times assume a steady pace over `moving_time`."""
+        track = cls(coords, np.zeros(len(coords)))
+        total = track.along[-1]
+        track.times = track.along / total * (moving_time or 0) if total else track.along
+        return track
+
+    def bounds(self, margin=BOX_MARGIN):
+        lo, hi = self.coords.min(axis=0), self.coords.max(axis=0)
+        return lo[0] - margin, lo[1] - margin, hi[0] + margin, hi[1] + margin
+
+
+def candidate_segments(session, track):
+    """Segments whose R*Tree box lies inside the track's padded box, with their geometry."""
+    min_lat, min_lng, max_lat, max_lng = track.bounds()
+    inside = select(segment_rtree.c.id).where(
+        segment_rtree.c.min_lat >= min_lat, segment_rtree.c.max_lat <= max_lat,
+        segment_rtree.c.min_lng >= min_lng, segment_rtree.c.max_lng <= max_lng,
+    )
+    return session.execute(
+        select(Segment.segment_id, Segment.name, Segment.distance, Segment.polyline)
+        .where(Segment.segment_id.in_(inside), Segment.polyline.isnot(None))
+    ).all()
+
+
+def match_segment(track, segment_coords, segment_distance=None):
+    """Every traversal of the segment by the track, as (start, end) fractional indices.
+
+    A traversal passes the segment's start, then its end (so direction
+    matters), stays within FOLLOW_RADIUS of the segment's course in between,
+    and has a plausible length.
+    """
+    if len(track.xy) < 2 or len(segment_coords) < 2:
+        return []
+    seg = local_xy(segment_coords, track.origin)
+    seg_length = segment_distance or float(np.sqrt((np.diff(seg, axis=0) ** 2).sum(axis=1)).sum())
+    distances, params = distance_to_path(seg[[0, -1]], track.xy)
+    starts = passes(distances[0], params[0], ENDPOINT_RADIUS)
+    ends = passes(distances[1], params[1], ENDPOINT_RADIUS)
+    samples = seg[np.linspace(0, len(seg) - 1, min(FOLLOW_SAMPLES, len(seg))).round().astype(int)]
+
+    matches = []
+    for start in starts:
+        if matches and start < matches[-1][1]:
+            continue
+        end = next((e for e in ends if e > start), None)
+        if end is None:
+            break
+        length = at(track.along, end) - at(track.along, start)
+        if not LENGTH_RATIO[0] * seg_length <= length <= LENGTH_RATIO[1] * seg_length:
+            continue
+        first, last = int(start), min(int(np.ceil(end)), len(track.xy) - 1)
+        follow, _ = distance_to_path(samples, track.xy[first:last + 1])
+        if follow.min(axis=1).max() <= FOLLOW_RADIUS:
+            matches.append((start, end))
+    return matches
+
+
+def match_track(session, track, start_date=None):
+    """Efforts (as dicts) on known segments found along `track`, in track order."""
+    efforts = []
+    for row in candidate_segments(session, track):
+        try:
+            segment_coords = decode(row.polyline)
+        except ValueError:
+            continue
+        for start, end in match_segment(track, segment_coords, row.distance):
+            offset = at(track.times, start)
+            efforts.append({
+                "segment_id": row.segment_id,
+                "segment_name": row.name,
+                "distance": row.distance,
+                "elapsed_time": int(round(at(track.times, end) - offset)),
+                "start_date": start_date + timedelta(seconds=offset) if start_date else None,
+                "start_index": start,
+            })
+    efforts.sort(key=lambda e: e["start_index"])
+    return efforts
+
+
+def activity_track(session, activity):
+    """Track of a stored activity: its latlng/time streams if fetched, else its summary polyline."""
+    loaded = load_streams(session, activity.id, ["latlng", "time"])
+    if "latlng" in loaded and "time" in loaded and len(loaded["latlng"]) >= 2:
+        return Track(loaded["latlng"], loaded["time"])
+    if activity.polyline:
+        coords = decode(activity.polyline)
+        if len(coords) >= 2:
+            return Track.from_polyline(coords, activity.moving_time)
+    return None
+
+
+def match_activity(session, activity):
+    track = activity_track(session, activity)
+    return match_track(session, track, activity.start_date) if track is not None else []
+
+
+def touches_segments(session, summaries):
+    """Ids of activity summaries whose route may cross a known segment.
+
+    Summaries without a polyline count as touching, since nothing can be
+    ruled out for them.
+    """
+    ids = [act["id"] for act in summaries]
+    # With no segment geometry yet there is nothing to match against.
+    if session.execute(select(segment_rtree.c.id).limit(1)).first() is None:
+        return set(ids)
+    polylines = [(act.get("map") or {}).get("summary_polyline") or "" for act in summaries]
+    coords, offsets = decode_many(polylines)
+    touching = set()
+    for i, activity_id in enumerate(ids):
+        points = coords[offsets[i]:offsets[i + 1]]
+        if len(points) < 2:
+            touching.add(activity_id)
+            continue
+        track = Track.from_polyline(points, summaries[i].get("moving_time"))
+        for row in candidate_segments(session, track):
+            try:
+                ends = local_xy(decode(row.polyline)[[0, -1]], track.origin)
+            except (ValueError, IndexError):
+                continue
+            if distance_to_path(ends, track.xy)[0].min(axis=1).max() <= NEAR_RADIUS:
+                touching.add(activity_id)
+                break
+    return touching
+
+
+def rematch(session, activity_ids=None):
+    """Store matched efforts for activities that have no efforts from Strava.
+
+    Locally matched efforts have no Strava `effort_id` and don't count
+    towards `segment_bests` or the progress series; earlier matches of the
+    same activities are replaced. Returns (activities, efforts).
+    """
+    from ingest import refresh_segment_bests
+
+    from_strava = exists().where(SegmentEffort.activity_id == Activity.id, SegmentEffort.effort_id.isnot(None))
+    query = select(Activity).where(~from_strava)
+    if activity_ids is not None:
+        query = query.where(Activity.id.in_(activity_ids))
+    activities = session.execute(query).scalars().all()
+
+    touched, rows = set(), []
+    for activity in activities:
+        for effort in match_activity(session, activity):
+            rows.append({
+                "segment_id": effort["segment_id"], "segment_name": effort["segment_name"],
+                "distance": effort["distance"], "elapsed_time": effort["elapsed_time"],
+                "start_date": effort["start_date"], "activity_id": activity.id, "is_pr": False,
+                "athlete_id": activity.athlete_id,
+            })
+            touched.add(effort["segment_id"])
+    ids = [a.id for a in activities]
+    for i in range(0, len(ids), 500):
+        local = (SegmentEffort.activity_id.in_(ids[i:i + 500]), SegmentEffort.effort_id.is_(None))
+        touched.update(session.execute(select(SegmentEffort.segment_id).where(*local)).scalars())
+        session.execute(delete(SegmentEffort).where(*local))
+    if rows:
+        session.execute(SegmentEffort.__table__.insert(), rows)
+    refresh_segment_bests(session, touched)
+    return len(activities), len(rows)
+
+
+if __name__ == "__main__":
+    import argparse
+    from db import SessionLocal, init_db
+
+    parser = argparse.ArgumentParser(description="Match activities against the local segment library")
+    parser.add_argument("activity_ids", type=int, nargs="*", help="default: every activity without Strava efforts")
+    args = parser.parse_args()
+
+    init_db()
+    session = SessionLocal()
+    try:
+        activities, efforts = rematch(session, args.activity_ids or None)
+        session.commit()
+    finally:
+        session.close()
+    print(f"🧭 Matched {efforts} efforts on {activities} activities without API calls.")
@@ -0,0 +1,281 @@
+# metrics.py
+import asyncio
+import cProfile
+import functools
+import io
+import os
+import pstats
+import re
+import threading
+import time
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+# Seconds; Prometheus' default buckets.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Profile every request and report the ones slower than this many ms.
+# Unset (the default) leaves the endpoints unwrapped.
+PROFILE_SLOW_MS = float(os.environ["STRAVA_PROFILE_SLOW_MS"]) if os.environ.get("STRAVA_PROFILE_SLOW_MS") else None
+# Where slow-request .prof files go; unset to only print the summary.
+PROFILE_DIR = os.environ.get("STRAVA_PROFILE_DIR")
+PROFILE_TOP = 15
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """One metric family; children are keyed by label values."""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for key, child in sorted(self._children.items()):
+            yield f"{self.name}_total{_labels(self.labelnames, key)} {child.value}"
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum", "lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        for key, child in sorted(self._children.items()):
+            with child.lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, [('le', le)])} {cumulative}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {total}"
+
+
+class Gauge(Metric):
+    """Read at scrape time from `callback`, which returns {label values: value} or a number."""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        self.callback = callback
+        super().__init__(name, documentation, labelnames)
+
+    def samples(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {value}"
+
+
+registry = []
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+HTTP_DURATION = Histogram("http_request_duration_seconds", "Time to answer an HTTP request, by route template.",
+                          ("method", "route", "status"))
+STRAVA_REQUESTS = Counter("strava_api_requests", "Calls made to the Strava API.", ("endpoint", "status"))
+STRAVA_DURATION = Histogram("strava_api_request_duration_seconds", "Latency of Strava API calls.", ("endpoint",))
+SQL_DURATION = Histogram("sql_query_duration_seconds", "Time spent executing SQL statements.",
+                         ("engine", "statement"),
+                         buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+SERIALIZE_DURATION = Histogram("response_serialize_seconds", "Time spent encoding response bodies.",
+                               buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+CACHE_REQUESTS = Counter("response_cache_requests", "Response cache lookups.", ("cache", "result"))
+SLOW_REQUESTS = Counter("profiled_slow_requests", "Requests slower than STRAVA_PROFILE_SLOW_MS.", ("route",))
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+_SQL_VERB = re.compile(r"\s*(\w+)")
+
+
+def strava_endpoint(path):
+    """Label for a Strava API path: ids replaced so /activities/123 and /activities/456 share one."""
+    return _ID_SEGMENT.sub("/{id}", path)
+
+
+def observe_strava_call(path, status, seconds):
+    endpoint = strava_endpoint(path)
+    STRAVA_REQUESTS.labels(endpoint, status).inc()
+    STRAVA_DURATION.labels(endpoint).observe(seconds)
+
+
+def instrument_engine(engine, name):
+    """Time every statement run on `engine`."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_start"].pop()
+        match = _SQL_VERB.match(statement)
+        verb = match.group(1).upper() if match else "OTHER"
+        SQL_DURATION.labels(name, verb).observe(time.perf_counter() - started)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency by route template.
+
+    Plain ASGI rather than BaseHTTPMiddleware: it adds only a timer and a
+    histogram update per request, and it times streamed responses until
+    their last chunk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_DURATION.labels(scope["method"], route, status[0]).observe(time.perf_counter() - started)
+
+
+def report_profile(profiler, route, seconds):
+    SLOW_REQUESTS.labels(route).inc()
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+    print(f"🐢 {route} took {seconds * 1000:.0f} ms\n{out.getvalue()}")
+    if PROFILE_DIR:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        profiler.dump_stats(os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}.prof"))
+
+
+def profiled(endpoint, route, threshold_ms):
+    """Wrap `endpoint` so calls slower than `threshold_ms` get their profile reported.
+
+    The wrapper runs in the thread that executes the endpoint (FastAPI's
+    threadpool for plain `def` endpoints), which is what cProfile sees.
+    """
+    def finish(profiler, started):
+        profiler.disable()
+        elapsed = time.perf_counter() - started
+        if elapsed * 1000 >= threshold_ms:
+            report_profile(profiler, route, elapsed)
+
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            profiler, started = cProfile.Profile(), time.perf_counter()
+            profiler.enable()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                finish(profiler, started)
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        profiler, started = cProfile.Profile(), time.perf_counter()
+        profiler.enable()
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            finish(profiler, started)
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """APIRoute that profiles its endpoint when STRAVA_PROFILE_SLOW_MS is set, and is a plain route otherwise."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        if PROFILE_SLOW_MS is not None:
+            endpoint = profiled(endpoint, path, PROFILE_SLOW_MS)
+        super().__init__(path, endpoint, **kwargs)
@@ -0,0 +1,126 @@
+# polyline_codec.py
+#
+# Batch encoder/decoder for Google encoded polylines on NumPy arrays.
+# A batch is one flat (N, 2) float64 array of (lat, lng) points plus an
+# `offsets` array of length n + 1: polyline i is coords[offsets[i]:offsets[i + 1]].
+import numpy as np
+
+PRECISION = 5
+# 5-bit chunks needed for the largest value we support (well beyond +-180 deg).
+_MAX_CHUNKS = 13
+
+
+def _as_bytes(encoded):
+    if encoded is None:
+        return b""
+    return encoded.encode("ascii") if isinstance(encoded, str) else bytes(encoded)
+
+
+def decode_batch(polylines, precision=PRECISION):
+    """Decode many encoded polylines at once.
+
+    `None` or empty strings decode to zero points. Returns `(coords, offsets)`.
+    Raises ValueError on a truncated or malformed polyline.
+    """
+    raw = [_as_bytes(p) for p in polylines]
+    lengths = np.fromiter((len(b) for b in raw), dtype=np.int64, count=len(raw))
+    offsets = np.zeros(len(raw) + 1, dtype=np.int64)
+    if not lengths.sum():
+        return np.empty((0, 2), dtype=np.float64), offsets
+
+    chunks = np.frombuffer(b"".join(raw), dtype=np.uint8).astype(np.int64) - 63
+    if chunks.min() < 0 or chunks.max() > 63:
+        raise ValueError("invalid character in encoded polyline")
+
+    # A chunk without the continuation bit (0x20) ends a value.
+    ends = np.flatnonzero((chunks & 0x20) == 0)
+    byte_ends = np.cumsum(lengths)
+    if len(ends) == 0 or np.any(np.isin(byte_ends[lengths > 0] - 1, ends, invert=True)):
+        raise ValueError("truncated encoded polyline")
+
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    position = np.arange(len(chunks)) - np.repeat(starts, ends - starts + 1)
+    if position.max() >= _MAX_CHUNKS:
+        raise ValueError("encoded value too large")
+    values = np.add.reduceat((chunks & 0x1F) << (5 * position), starts)
+    values = np.where(values & 1, ~(values >> 1), values >> 1)
+
+    # Values per polyline, then points (lat/lng pairs) per polyline.
+    string_of_value = np.searchsorted(byte_ends, ends, side="right")
+    counts = np.bincount(string_of_value, minlength=len(raw))
+    if np.any(counts % 2):
+        raise ValueError("encoded polyline has an odd number of values")
+    np.cumsum(counts // 2, out=offsets[1:])
+
+    # Points are deltas from the previous point of the same polyline.
+    deltas = values.reshape(-1, 2)
+    totals = np.cumsum(deltas, axis=0)
+    first = offsets[:-1][counts > 0]
+    base = np.zeros_like(totals)
+    if len(first):
+        before = np.where(first > 0, first - 1, 0)
+        carry = np.where((first > 0)[:, None], totals[before], 0)
+        sizes = np.diff(offsets)[counts > 0]
+        base = np.repeat(carry, sizes, axis=0)
+    return (totals - base) / 10.0 ** precision, offsets
+
+
+def decode(encoded, precision=PRECISION):
+    """Decode one polyline to an `(n, 2)` array of (lat, lng)."""
+    coords, _ = decode_batch([encoded], precision)
+    return coords
+
+
+def encode_batch(coords, offsets, precision=PRECISION):
+    """Encode the polylines described by `(coords, offsets)` into strings."""
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n = len(offsets) - 1
+    if len(coords) == 0:
+        return [""] * n
+
+    ints = np.round(coords * 10.0 ** precision).astype(np.int64)
+    deltas = ints.copy()
+    deltas[1:] -= ints[:-1]
+    firsts = offsets[:-1][np.diff(offsets) > 0]
+    deltas[firsts] = ints[firsts]
+
+    values = deltas.ravel()
+    values = np.where(values < 0, ~(values << 1), values << 1)
+
+    nchunks = np.ones(len(values), dtype=np.int64)
+    for k in range(1, _MAX_CHUNKS):
+        nchunks += values >= (1 << (5 * k))
+    chunk_starts = np.cumsum(nchunks) - nchunks
+    value_index = np.repeat(np.arange(len(values)), nchunks)
+    position = np.arange(nchunks.sum()) - np.repeat(chunk_starts, nchunks)
+    chunks = (values[value_index] >> (5 * position)) & 0x1F
+    chunks |= np.where(position < nchunks[value_index] - 1, 0x20, 0)
+    data = (chunks + 63).astype(np.uint8).tobytes()
+
+    # Byte boundaries of each polyline: two values per point.
+    value_bytes = np.concatenate(([0], np.cumsum(nchunks)))
+    bounds = value_bytes[offsets * 2]
+    return [data[bounds[i]:bounds[i + 1]].decode("ascii") for i in range(n)]
+
+
+def encode(coords, precision=PRECISION):
+    """Encode one `(n, 2)` array of (lat, lng) points."""
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    return encode_batch(coords, [0, len(coords)], precision)[0]
+
+
+def bounds_batch(coords, offsets):
+    """Per-polyline (min_lat, min_lng, max_lat, max_lng); NaN for empty ones."""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n = len(offsets) - 1
+    out = np.full((n, 4), np.nan)
+    nonempty = np.diff(offsets) > 0
+    if not nonempty.any():
+        return out
+    starts = offsets[:-1][nonempty]
+    out[nonempty, 0:2] = np.minimum.reduceat(coords, starts, axis=0)
+    out[nonempty, 2:4] = np.maximum.reduceat(coords, starts, axis=0)
+    return out
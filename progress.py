@@ -0,0 +1,84 @@
+# progress.py
+import numpy as np
+from sqlalchemy import select
+
+from db import SegmentEffort
+
+# Segments accepted by one batch request.
+MAX_SEGMENTS = 500
+# Trend is reported in seconds gained (negative) or lost per this many days.
+TREND_DAYS = 30
+
+
+def parse_ids(values):
+    """Segment ids from "1,2,3" and/or repeated query values, in first-seen order."""
+    ids = []
+    for value in values:
+        for part in value.split(","):
+            part = part.strip()
+            if part:
+                ids.append(int(part))
+    return list(dict.fromkeys(ids))
+
+
+def effort_stats(days, times):
+    """Summary of one segment's efforts; `days` since the first effort, `times` in seconds."""
+    best = float(times.min())
+    stats = {
+        "attempts": len(times),
+        "best_time": best,
+        "first_time": float(times[0]),
+        "last_time": float(times[-1]),
+        "mean_time": round(float(times.mean()), 1),
+        "improvement": float(times[0]) - best,
+        "trend_per_30d": None,
+    }
+    # Least-squares slope of time against date; needs efforts on at least two days.
+    if len(times) > 1 and np.ptp(days) > 0:
+        slope = np.polyfit(days, times, 1)[0]
+        stats["trend_per_30d"] = round(float(slope) * TREND_DAYS, 2)
+    return stats
+
+
+def segment_series(rows):
+    """Columnar series for one segment's efforts (sorted by date)."""
+    dates = np.array([r.start_date for r in rows], dtype="datetime64[s]")
+    times = np.array([r.elapsed_time for r in rows], dtype=np.float64)
+    days = (dates - dates[0]).astype(np.float64) / 86400.0
+    return {
+        "segment_name": rows[0].segment_name,
+        "dates": [str(d) for d in dates],
+        "elapsed_time": times.tolist(),
+        "rolling_best": np.minimum.accumulate(times).tolist(),
+        "stats": effort_stats(days, times),
+    }
+
+
+def segments_progress(session, segment_ids, athlete_id=None):
+    """Progress of many segments from one query on (segment_id, start_date).
+
+    Only `athlete_id`'s efforts if given. Efforts matched locally by
+    matcher.py have estimated times and no `effort_id`; they are left out,
+    as they are from segment_bests. Returns {segment_id: series};
+    segments without efforts are left out.
+    """
+    query = (
+        select(SegmentEffort.segment_id, SegmentEffort.segment_name,
+               SegmentEffort.start_date, SegmentEffort.elapsed_time)
+        .where(SegmentEffort.segment_id.in_(segment_ids),
+               SegmentEffort.effort_id.isnot(None),
+               SegmentEffort.elapsed_time != None,
+               SegmentEffort.start_date != None)
+        .order_by(SegmentEffort.segment_id, SegmentEffort.start_date)
+    )
+    if athlete_id is not None:
+        query = query.where(SegmentEffort.athlete_id == athlete_id)
+    rows = session.execute(query).all()
+
+    result = {}
+    start = 0
+    for i in range(1, len(rows) + 1):
+        if i == len(rows) or rows[i].segment_id != rows[start].segment_id:
+            result[rows[start].segment_id] = segment_series(rows[start:i])
+            start = i
+    return result
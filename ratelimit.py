@@ -0,0 +1,154 @@
+# ratelimit.py
+import threading
+import time
+from collections import deque
+
+# Strava's default application limits, used until the first response tells us
+# the real ones.
+DEFAULT_SHORT_LIMIT = 100
+DEFAULT_DAILY_LIMIT = 1000
+
+SHORT_WINDOW = 15 * 60
+DAILY_WINDOW = 24 * 60 * 60
+
+
+def next_window_boundary(window, now=None):
+    """Epoch second at which the current fixed `window` (aligned to UTC) resets."""
+    now = time.time() if now is None else now
+    return (int(now) // window + 1) * window
+
+
+def parse_rate_headers(headers):
+    """Return ((short_limit, daily_limit), (short_usage, daily_usage)) or None.
+
+    Prefers the stricter read limits when Strava sends them.
+    """
+    for prefix in ("X-ReadRateLimit", "X-RateLimit"):
+        limit = headers.get(f"{prefix}-Limit")
+        usage = headers.get(f"{prefix}-Usage")
+        if limit and usage:
+            try:
+                limits = tuple(int(v) for v in limit.split(","))
+                usages = tuple(int(v) for v in usage.split(","))
+            except ValueError:
+                continue
+            if len(limits) == 2 and len(usages) == 2:
+                return limits, usages
+    return None
+
+
+class TokenBucket:
+    """Token bucket that is refilled in full at fixed window boundaries.
+
+    Strava counts requests in fixed 15-minute and daily windows, so the budget
+    left in a window can be spent as fast as we like and comes back all at once
+    when the window rolls over.
+    """
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.tokens = limit
+        self.reset_at = next_window_boundary(window)
+
+    def refill(self, now):
+        if now >= self.reset_at:
+            self.tokens = self.limit
+            self.reset_at = next_window_boundary(self.window, now)
+
+    def sync(self, limit, usage, pending):
+        """Align the local estimate with what the server reported."""
+        self.limit = limit
+        self.tokens = max(0, limit - usage - pending)
+
+
+class RateLimiter:
+    """Paces Strava API calls from the X-RateLimit-* response headers.
+
+    `acquire()` blocks until both the 15-minute and daily buckets have a token.
+    `update(headers)` must be called with the headers of every response so the
+    buckets track the budget Strava actually has left for us.
+
+    Strava's limits are per application, so every athlete draws on the same
+    buckets. Callers pass their athlete as `key`; while several keys are
+    waiting, tokens go to them in turn, one each, so a big backfill can't
+    starve an athlete with a handful of new activities.
+    """
+
+    def __init__(self, short_limit=DEFAULT_SHORT_LIMIT, daily_limit=DEFAULT_DAILY_LIMIT):
+        self.short = TokenBucket(short_limit, SHORT_WINDOW)
+        self.daily = TokenBucket(daily_limit, DAILY_WINDOW)
+        self._pending = 0
+        self._cond = threading.Condition()
+        # Keys with callers in acquire(), in the order they get their next token.
+        self._turns = deque()
+        self._waiting = {}
+
+    def acquire(self, key=None):
+        with self._cond:
+            self._waiting[key] = self._waiting.get(key, 0) + 1
+            if key not in self._turns:
+                self._turns.append(key)
+            try:
+                while True:
+                    now = time.time()
+                    self.short.refill(now)
+                    self.daily.refill(now)
+                    if self.short.tokens > 0 and self.daily.tokens > 0:
+                        if self._turns[0] == key:
+                            self.short.tokens -= 1
+                            self.daily.tokens -= 1
+                            self._pending += 1
+                            self._turns.rotate(-1)
+                            return
+                        # Another key's turn; it is woken below or already awake.
+                        self._cond.wait(timeout=0.1)
+                        continue
+                    empty = [b for b in (self.short, self.daily) if b.tokens <= 0]
+                    wait = max(b.reset_at for b in empty) - now
+                    if self._turns[0] == key:
+                        print(f"⏳ Rate budget exhausted, waiting {wait:.0f}s for the window to reset")
+                    self._cond.wait(timeout=max(wait, 0.1))
+            finally:
+                self._waiting[key] -= 1
+                if not self._waiting[key]:
+                    del self._waiting[key]
+                    self._turns.remove(key)
+                self._cond.notify_all()
+
+    def waiting(self):
+        """{key: callers blocked in acquire()}."""
+        with self._cond:
+            return dict(self._waiting)
+
+    def update(self, headers):
+        parsed = parse_rate_headers(headers)
+        with self._cond:
+            self._pending = max(0, self._pending - 1)
+            if parsed:
+                (short_limit, daily_limit), (short_usage, daily_usage) = parsed
+                self.short.sync(short_limit, short_usage, self._pending)
+                self.daily.sync(daily_limit, daily_usage, self._pending)
+            self._cond.notify_all()
+
+    def block_until(self, until):
+        """Treat the budget as spent until epoch second `until` (e.g. after a 429)."""
+        with self._cond:
+            self.short.tokens = 0
+            self.short.reset_at = until
+
+    def remaining(self):
+        """Requests left before we have to wait for a window to reset."""
+        with self._cond:
+            now = time.time()
+            self.short.refill(now)
+            self.daily.refill(now)
+            return min(self.short.tokens, self.daily.tokens)
+
+    def budget(self):
+        """Tokens left in the 15-minute and daily buckets, as {"short": n, "daily": n}."""
+        with self._cond:
+            now = time.time()
+            self.short.refill(now)
+            self.daily.refill(now)
+            return {"short": self.short.tokens, "daily": self.daily.tokens}
@@ -0,0 +1,221 @@
+# raw_store.py
+import hashlib
+import json
+import os
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.sqlite import insert
+
+import strava_api
+from db import SessionLocal, ReadSessionLocal, RawResponse
+from ingest import ingest_activities, segment_row, upsert_segment_details
+
+RAW_STORE_DIR = os.environ.get("STRAVA_RAW_STORE", "raw_store")
+# Activity payloads rarely change after upload; sync's refresh mode re-fetches them.
+ACTIVITY_MAX_AGE = None
+# Segment details carry KOM/QOM times, which do move.
+SEGMENT_MAX_AGE = timedelta(days=int(os.environ.get("STRAVA_SEGMENT_MAX_AGE_DAYS", "30")))
+COMPRESSION_LEVEL = 6
+# Payloads read per batch when replaying.
+REPLAY_BATCH = 500
+
+
+def canonical_json(payload):
+    return json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+class RawStore:
+    """Compressed, content-addressed store of raw Strava payloads.
+
+    Blobs are zlib-compressed canonical JSON named by their sha256, so a
+    payload that comes back unchanged takes no extra space. The
+    raw_responses table points each (kind, id) at its latest blob and
+    records when it was fetched.
+    """
+
+    def __init__(self, directory=RAW_STORE_DIR, session_factory=SessionLocal,
+                 read_session_factory=ReadSessionLocal):
+        self.directory = directory
+        self.session_factory = session_factory
+        self.read_session_factory = read_session_factory
+
+    def _path(self, digest):
+        return os.path.join(self.directory, "objects", digest[:2], digest[2:] + ".json.z")
+
+    def put_blob(self, payload):
+        """Store `payload` once; returns (digest, compressed size)."""
+        raw = canonical_json(payload)
+        digest = hashlib.sha256(raw).hexdigest()
+        path = self._path(digest)
+        if os.path.exists(path):
+            return digest, os.path.getsize(path)
+        data = zlib.compress(raw, COMPRESSION_LEVEL)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{id(data)}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return digest, len(data)
+
+    def read_blob(self, digest):
+        """The payload stored under `digest`, or None if the blob is missing."""
+        try:
+            with open(self._path(digest), "rb") as f:
+                return json.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return None
+
+    def put(self, kind, object_id, payload, fetched_at=None):
+        digest, size = self.put_blob(payload)
+        row = {
+            "kind": kind, "object_id": object_id, "digest": digest, "size": size,
+            "fetched_at": fetched_at or datetime.now(timezone.utc),
+        }
+        session = self.session_factory()
+        try:
+            stmt = insert(RawResponse).values(row)
+            session.execute(stmt.on_conflict_do_update(
+                index_elements=["kind", "object_id"],
+                set_={c: stmt.excluded[c] for c in ("digest", "size", "fetched_at")},
+            ))
+            session.commit()
+        finally:
+            session.close()
+        return digest
+
+    def get(self, kind, object_id, max_age=None):
+        """The stored payload, or None if there is none or it is older than `max_age`."""
+        session = self.read_session_factory()
+        try:
+            entry = session.get(RawResponse, (kind, object_id))
+        finally:
+            session.close()
+        if entry is None:
+            return None
+        if max_age is not None:
+            fetched_at = entry.fetched_at.replace(tzinfo=entry.fetched_at.tzinfo or timezone.utc)
+            if datetime.now(timezone.utc) - fetched_at > max_age:
+                return None
+        return self.read_blob(entry.digest)
+
+    def fetch(self, kind, object_id, fetch, max_age=None, refresh=False):
+        """Stored payload if fresh enough, else `fetch(object_id)`, which is then stored."""
+        if not refresh:
+            payload = self.get(kind, object_id, max_age)
+            if payload is not None:
+                return payload
+        payload = fetch(object_id)
+        self.put(kind, object_id, payload)
+        return payload
+
+    def forget(self, kind, object_ids):
+        """Drop the index rows of objects that no longer exist; `prune` deletes their blobs."""
+        session = self.session_factory()
+        try:
+            session.execute(delete(RawResponse).where(
+                RawResponse.kind == kind, RawResponse.object_id.in_(list(object_ids))
+            ))
+            session.commit()
+        finally:
+            session.close()
+
+    def iter_payloads(self, kind, batch_size=REPLAY_BATCH):
+        """Yield lists of (payload, fetched_at) of stored payloads of `kind`, in id order."""
+        session = self.read_session_factory()
+        try:
+            rows = session.execute(
+                select(RawResponse.digest, RawResponse.fetched_at)
+                .where(RawResponse.kind == kind).order_by(RawResponse.object_id)
+                .execution_options(yield_per=batch_size)
+            )
+            for chunk in rows.partitions(batch_size):
+                payloads = [(self.read_blob(row.digest), row.fetched_at) for row in chunk]
+                yield [(p, fetched_at) for p, fetched_at in payloads if p is not None]
+        finally:
+            session.close()
+
+    def prune(self):
+        """Delete blobs no index row points at any more. Returns how many."""
+        session = self.read_session_factory()
+        try:
+            live = set(session.execute(select(RawResponse.digest)).scalars())
+        finally:
+            session.close()
+        removed = 0
+        objects = os.path.join(self.directory, "objects")
+        for prefix in os.listdir(objects) if os.path.isdir(objects) else []:
+            for name in os.listdir(os.path.join(objects, prefix)):
+                if name.endswith(".json.z") and prefix + name[:-len(".json.z")] not in live:
+                    os.remove(os.path.join(objects, prefix, name))
+                    removed += 1
+        return removed
+
+
+raw_store = RawStore()
+
+
+def get_activity_details(activity_id, refresh=False, client=None):
+    """Detailed activity from the raw store, fetching it from Strava only if it isn't there.
+
+    `client` is the owner's StravaClient; the default credentials otherwise.
+    """
+    fetch = client.get_activity_details if client is not None else strava_api.get_activity_details
+    return raw_store.fetch("activity", activity_id, fetch, ACTIVITY_MAX_AGE, refresh)
+
+
+def get_segment_details(segment_id, refresh=False):
+    """Segment details from the raw store unless older than SEGMENT_MAX_AGE."""
+    return raw_store.fetch("segment", segment_id, strava_api.get_segment_details, SEGMENT_MAX_AGE, refresh)
+
+
+def replay(session, kinds=("segment", "activity"), store=raw_store):
+    """Re-ingest every stored payload without calling Strava.
+
+    Run after adding a column to the mapping in ingest.py to fill it for
+    the whole history. Segments keep the time their details actually came
+    from Strava, so replaying doesn't make old KOM/QOM times look fresh.
+    Returns {kind: payloads replayed}.
+    """
+    counts = {}
+    for kind in kinds:
+        counts[kind] = 0
+        for payloads in store.iter_payloads(kind):
+            if kind == "activity":
+                ingest_activities(session, [(p, p) for p, _ in payloads])
+            else:
+                upsert_segment_details(session, [segment_row(p, fetched_at) for p, fetched_at in payloads])
+            session.commit()
+            counts[kind] += len(payloads)
+    return counts
+
+
+if __name__ == "__main__":
+    import sys
+    from db import init_db
+
+    init_db()
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if command == "replay":
+        from heatmap import update_from_db
+
+        session = SessionLocal()
+        try:
+            counts = replay(session, kinds=sys.argv[2:] or ("segment", "activity"))
+            update_from_db(session)
+        finally:
+            session.close()
+        print(f"🔁 Replayed {counts} from {RAW_STORE_DIR} with 0 API calls.")
+        print("   A running server still serves cached responses; POST /cache/invalidate to refresh them.")
+    elif command == "prune":
+        print(f"🧹 Removed {raw_store.prune()} unreferenced blobs.")
+    else:
+        session = ReadSessionLocal()
+        try:
+            for kind, count, size in session.execute(
+                select(RawResponse.kind, func.count(), func.sum(RawResponse.size)).group_by(RawResponse.kind)
+            ):
+                print(f"{kind}: {count} payloads, {(size or 0) / 1e6:.1f} MB compressed")
+        finally:
+            session.close()
@@ -0,0 +1,161 @@
+# rollups.py
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import delete, func, literal, or_, select, tuple_
+from sqlalchemy.dialects.sqlite import insert
+
+from db import Activity, ActivityRollup
+
+PERIODS = ("week", "month")
+# Stands in for a missing athlete id or type in the rollup key.
+UNKNOWN_ATHLETE = 0
+UNKNOWN_TYPE = "Unknown"
+# Rollup keys recomputed per statement.
+BATCH_SIZE = 200
+
+ROLLUP_COLUMNS = [
+    "athlete_id", "type", "period", "period_start",
+    "count", "distance", "moving_time", "elapsed_time", "elevation_gain",
+]
+
+
+def period_start(day, period):
+    """First day of the week (Monday) or month containing `day`."""
+    if isinstance(day, datetime):
+        day = day.date()
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def period_end(start, period):
+    """First day after the period starting on `start`."""
+    if period == "week":
+        return start + timedelta(days=7)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def period_expr(period):
+    """SQLite expression for the period start of Activity.start_date, as 'YYYY-MM-DD'."""
+    if period == "week":
+        # Forward to Sunday (or stay on it), then back to that week's Monday.
+        return func.date(Activity.start_date, "weekday 0", "-6 days")
+    return func.date(Activity.start_date, "start of month")
+
+
+def rollup_select(period, where=None):
+    """SELECT producing `activity_rollups` rows for `period`, optionally for some activities only."""
+    athlete = func.coalesce(Activity.athlete_id, UNKNOWN_ATHLETE)
+    kind = func.coalesce(Activity.type, UNKNOWN_TYPE)
+    start = period_expr(period)
+    query = select(
+        athlete, kind, literal(period), start,
+        func.count(),
+        func.sum(Activity.distance),
+        func.sum(Activity.moving_time),
+        func.sum(Activity.elapsed_time),
+        func.sum(Activity.total_elevation_gain),
+    ).group_by(athlete, kind, start)
+    return query.where(where) if where is not None else query
+
+
+def refresh_rollups(session, keys, batch_size=BATCH_SIZE):
+    """Recompute every rollup covering `keys`, a set of (athlete_id, start_date) of changed activities.
+
+    Whole (athlete, period) buckets are recomputed from `activities`, so
+    updates and deletes are handled the same way as inserts: include the
+    old start date of a moved or deleted activity. The caller commits.
+    """
+    keys = {(athlete or UNKNOWN_ATHLETE, start) for athlete, start in keys if start is not None}
+    for period in PERIODS:
+        buckets = sorted({(athlete, period_start(start, period)) for athlete, start in keys})
+        for i in range(0, len(buckets), batch_size):
+            chunk = buckets[i:i + batch_size]
+            session.execute(delete(ActivityRollup).where(
+                ActivityRollup.period == period,
+                tuple_(ActivityRollup.athlete_id, ActivityRollup.period_start).in_(chunk),
+            ))
+            # Range conditions keep the scan on the start_date indexes.
+            in_buckets = or_(*(
+                (Activity.start_date >= datetime.combine(start, time()))
+                & (Activity.start_date < datetime.combine(period_end(start, period), time()))
+                & (func.coalesce(Activity.athlete_id, UNKNOWN_ATHLETE) == athlete)
+                for athlete, start in chunk
+            ))
+            session.execute(insert(ActivityRollup).from_select(ROLLUP_COLUMNS, rollup_select(period, in_buckets)))
+    return len(keys)
+
+
+def rebuild_rollups(session):
+    """Drop and recompute every rollup from `activities`. The caller commits."""
+    session.execute(delete(ActivityRollup))
+    for period in PERIODS:
+        session.execute(insert(ActivityRollup).from_select(ROLLUP_COLUMNS, rollup_select(period)))
+    return session.query(ActivityRollup).count()
+
+
+def rollup_dict(row):
+    return {
+        "athlete_id": row.athlete_id,
+        "type": row.type,
+        "period": row.period,
+        "period_start": row.period_start.isoformat(),
+        "count": row.count,
+        "distance": row.distance,
+        "moving_time": row.moving_time,
+        "elapsed_time": row.elapsed_time,
+        "elevation_gain": row.elevation_gain,
+    }
+
+
+def query_rollups(session, period, types=None, start=None, end=None, athlete_id=None):
+    """Rollup rows of `period` whose period starts in [start, end), oldest first."""
+    query = select(ActivityRollup).where(ActivityRollup.period == period)
+    if types:
+        query = query.where(ActivityRollup.type.in_(types))
+    if start is not None:
+        query = query.where(ActivityRollup.period_start >= period_start(start, period))
+    if end is not None:
+        query = query.where(ActivityRollup.period_start < end)
+    if athlete_id is not None:
+        query = query.where(ActivityRollup.athlete_id == athlete_id)
+    query = query.order_by(ActivityRollup.period_start, ActivityRollup.type)
+    return session.execute(query).scalars().all()
+
+
+def year_over_year(rows):
+    """{year: {type: [totals per month, or per ISO week]}} from rollup rows of one period.
+
+    Each slot holds {"count", "distance", "moving_time", "elevation_gain"};
+    the work depends on the number of rollups, not of activities.
+    """
+    out = {}
+    for row in rows:
+        if row.period == "month":
+            year, slot, slots = row.period_start.year, row.period_start.month - 1, 12
+        else:
+            year, week, _ = row.period_start.isocalendar()
+            slot, slots = week - 1, 53
+        series = out.setdefault(year, {}).setdefault(row.type, [None] * slots)
+        current = series[slot] or {"count": 0, "distance": 0.0, "moving_time": 0, "elevation_gain": 0.0}
+        # Several athletes can share a slot.
+        series[slot] = {
+            "count": current["count"] + row.count,
+            "distance": current["distance"] + (row.distance or 0.0),
+            "moving_time": current["moving_time"] + (row.moving_time or 0),
+            "elevation_gain": current["elevation_gain"] + (row.elevation_gain or 0.0),
+        }
+    return out
+
+
+if __name__ == "__main__":
+    from db import SessionLocal, init_db
+
+    init_db()
+    session = SessionLocal()
+    try:
+        count = rebuild_rollups(session)
+        session.commit()
+    finally:
+        session.close()
+    print(f"📊 Rebuilt {count} weekly and monthly rollups.")
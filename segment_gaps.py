@@ -0,0 +1,223 @@
+# segment_gaps.py
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import or_, select
+
+from db import SessionLocal, Segment, SegmentBest
+from fetch_pr_segment_polylines import fetch_segments
+from raw_store import SEGMENT_MAX_AGE
+from strava_api import rate_limiter
+
+# Segments fetched per background batch.
+REFRESH_BATCH = 50
+# Seconds between sweeps for stale segments when nobody asked for any.
+SWEEP_INTERVAL = 60 * 60
+# A segment that failed to refresh isn't asked for again for this many seconds.
+RETRY_AFTER = 10 * 60
+# Background refreshes pause while fewer API calls than this are left in
+# the window, so they never take the budget syncs are waiting for.
+RESERVED_CALLS = 20
+
+
+def stale_cutoff(now=None):
+    """Segments whose details were fetched before this need refreshing."""
+    return (now or datetime.now(timezone.utc)).replace(tzinfo=None) - SEGMENT_MAX_AGE
+
+
+def segment_gaps(session, athlete_id=None, pr_only=False, bbox=None):
+    """Each segment's best effort next to its KOM/QOM, closest to the KOM first.
+
+    Reads only what is stored; `stale` marks segments whose KOM/QOM is
+    missing or older than SEGMENT_MAX_AGE, which the caller can hand to
+    the refresher. Segments only known from effort payloads have no start
+    point until their details are fetched; `bbox` keeps segments starting
+    inside it and so leaves those out.
+    """
+    query = (
+        select(
+            SegmentBest.athlete_id, SegmentBest.segment_id, Segment.name, Segment.distance,
+            Segment.average_grade, Segment.start_lat, Segment.start_lng,
+            SegmentBest.best_time, SegmentBest.attempt_count, SegmentBest.last_attempt_date,
+            Segment.kom_time, Segment.qom_time, Segment.fetched_at,
+        )
+        .join(Segment, Segment.segment_id == SegmentBest.segment_id)
+    )
+    if bbox is not None:
+        min_lng, min_lat, max_lng, max_lat = bbox
+        query = query.where(Segment.start_lat.between(min_lat, max_lat),
+                            Segment.start_lng.between(min_lng, max_lng))
+    if athlete_id is not None:
+        query = query.where(SegmentBest.athlete_id == athlete_id)
+    if pr_only:
+        query = query.where(SegmentBest.pr_count > 0)
+    cutoff = stale_cutoff()
+    rows = []
+    for row in session.execute(query):
+        rows.append({
+            "athlete_id": row.athlete_id,
+            "segment_id": row.segment_id,
+            "name": row.name,
+            "distance": row.distance,
+            "average_grade": row.average_grade,
+            "start_lat": row.start_lat,
+            "start_lng": row.start_lng,
+            "pr_time": row.best_time,
+            "attempts": row.attempt_count,
+            "last_date": row.last_attempt_date,
+            "kom_time": row.kom_time,
+            "qom_time": row.qom_time,
+            # seconds slower than the KOM/QOM
+            "difference": row.best_time - row.kom_time if row.best_time is not None and row.kom_time else None,
+            "qom_difference": row.best_time - row.qom_time if row.best_time is not None and row.qom_time else None,
+            "details_fetched_at": row.fetched_at,
+            "stale": row.fetched_at is None or row.fetched_at < cutoff,
+        })
+    rows.sort(key=lambda r: (r["difference"] is None, r["difference"] or 0))
+    return rows
+
+
+def point_features(rows):
+    """GeoJSON Point features at each segment's start, with the row as properties.
+
+    Segments without a known start get a null geometry.
+    """
+    return [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [row["start_lng"], row["start_lat"]]}
+            if row["start_lat"] is not None and row["start_lng"] is not None else None,
+            "properties": {k: v for k, v in row.items() if k not in ("start_lat", "start_lng")},
+        }
+        for row in rows
+    ]
+
+
+def stale_segment_ids(session, limit=None):
+    """Segments with efforts whose details are missing or older than SEGMENT_MAX_AGE, oldest first."""
+    query = (
+        select(Segment.segment_id)
+        .where(Segment.segment_id.in_(select(SegmentBest.segment_id)),
+               or_(Segment.fetched_at.is_(None), Segment.fetched_at < stale_cutoff()))
+        .order_by(Segment.fetched_at.is_not(None), Segment.fetched_at)
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    return session.execute(query).scalars().all()
+
+
+class SegmentRefresher:
+    """Refreshes segment details (KOM/QOM, polyline) from Strava on a background thread.
+
+    Requests only queue segment ids, so callers never wait on Strava. The
+    queue is worked off in batches through the raw store, and the response
+    cache is bumped after each batch that stored something. Every
+    `sweep_interval` seconds it also sweeps for stale segments, however
+    often it was woken in between.
+    """
+
+    def __init__(self, session_factory=SessionLocal, batch_size=REFRESH_BATCH, sweep_interval=SWEEP_INTERVAL):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.sweep_interval = sweep_interval
+        self.last_sweep = time.monotonic()
+        # Insertion-ordered set of queued ids.
+        self._queue = {}
+        self._attempted = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self.last_sweep = time.monotonic()
+        self._thread = threading.Thread(target=self._loop, name="segment-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def request(self, segment_ids, force=False):
+        """Queue segments for a refresh; returns how many were newly queued.
+
+        Segments tried in the last RETRY_AFTER seconds are skipped unless `force`.
+        """
+        now = time.time()
+        added = 0
+        with self._lock:
+            for segment_id in segment_ids:
+                if segment_id in self._queue:
+                    continue
+                if not force and now - self._attempted.get(segment_id, 0) < RETRY_AFTER:
+                    continue
+                self._queue[segment_id] = None
+                added += 1
+        if added:
+            self._wake.set()
+        return added
+
+    def pending(self):
+        with self._lock:
+            return len(self._queue)
+
+    def _take(self):
+        now = time.time()
+        with self._lock:
+            batch = list(self._queue)[:self.batch_size]
+            for segment_id in batch:
+                del self._queue[segment_id]
+                self._attempted[segment_id] = now
+            # Forget old attempts so the dict doesn't grow without bound.
+            self._attempted = {k: t for k, t in self._attempted.items() if now - t < RETRY_AFTER}
+        return batch
+
+    def _sweep_due(self):
+        return time.monotonic() - self.last_sweep >= self.sweep_interval
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(max(0.0, self.last_sweep + self.sweep_interval - time.monotonic()))
+            self._wake.clear()
+            while not self._stop.is_set():
+                # Checked per batch, so a steady stream of requests can't starve it.
+                if self._sweep_due():
+                    self.sweep()
+                if rate_limiter.remaining() < RESERVED_CALLS:
+                    self._stop.wait(30)
+                    continue
+                batch = self._take()
+                if not batch:
+                    break
+                self.refresh(batch)
+
+    def sweep(self):
+        self.last_sweep = time.monotonic()
+        session = self.session_factory()
+        try:
+            ids = stale_segment_ids(session, limit=self.batch_size * 10)
+        finally:
+            session.close()
+        return self.request(ids)
+
+    def refresh(self, segment_ids):
+        """Fetch and store details of `segment_ids` now; returns how many were stored."""
+        session = self.session_factory()
+        try:
+            stored = fetch_segments(session, segment_ids)
+        except Exception as e:
+            print(f"⚠️ Segment refresh failed: {e}")
+            return 0
+        finally:
+            session.close()
+        print(f"🏁 Refreshed {stored} of {len(segment_ids)} segments ({self.pending()} queued).")
+        return stored
+
+
+refresher = SegmentRefresher()
@@ -1,68 +1,287 @@
 # strava_api.py
+import os
+import threading
 import requests, time
 import urllib3
+from requests.adapters import HTTPAdapter
+
+from metrics import Gauge, observe_strava_call
+from ratelimit import RateLimiter, SHORT_WINDOW, next_window_boundary
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-# ⚠️ Replace with your actual credentials
-CLIENT_ID = "178138"
-CLIENT_SECRET = "b097aea2c9f6a09098da713e54313262dd22e885"
-REFRESH_TOKEN = "f990297ce6df4e913f02b168f0b07a174492871b"
+# ⚠️ Replace with your actual credentials (or set STRAVA_CLIENT_ID etc.).
+# The refresh token is only used by the default client; athletes who connect
+# through /auth/strava have their own tokens in the athletes table.
+CLIENT_ID = os.environ.get("STRAVA_CLIENT_ID", "178138")
+CLIENT_SECRET = os.environ.get("STRAVA_CLIENT_SECRET", "b097aea2c9f6a09098da713e54313262dd22e885")
+REFRESH_TOKEN = os.environ.get("STRAVA_REFRESH_TOKEN", "f990297ce6df4e913f02b168f0b07a174492871b")
+
+# Overridable to point the client at a stand-in server (see benchmarks/fake_strava.py).
+AUTH_URL = os.environ.get("STRAVA_AUTH_URL", "https://www.strava.com/oauth/token")
+AUTHORIZE_URL = os.environ.get("STRAVA_AUTHORIZE_URL", "https://www.strava.com/oauth/authorize")
+BASE_URL = os.environ.get("STRAVA_BASE_URL", "https://www.strava.com/api/v3")
+
+# Refresh this many seconds before Strava says the token expires.
+TOKEN_EXPIRY_MARGIN = 60
+
+# Largest page Strava serves for /athlete/activities.
+MAX_PER_PAGE = 200
+
+
+class RateLimitExceeded(Exception):
+    """Strava returned 429 and the wait is longer than the caller allows."""
+
+    def __init__(self, retry_at):
+        self.retry_at = retry_at
+        super().__init__(f"Strava rate limit reached, retry after {time.ctime(retry_at)}")
+
+
+def retry_after(response, now=None):
+    """Seconds to wait after a 429: `Retry-After` if sent, else the window end."""
+    now = time.time() if now is None else now
+    header = response.headers.get("Retry-After")
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            pass
+    return next_window_boundary(SHORT_WINDOW, now) - now
+
+
+class StravaClient:
+    """Strava API client with a cached access token and a pooled session.
+
+    The token is refreshed only when it is about to expire, and all requests go
+    over one keep-alive connection pool, so concurrent sync workers share both.
+    Transient failures are retried with exponential backoff. A 429 is waited
+    out only if the wait is at most `max_wait` seconds; otherwise
+    `RateLimitExceeded` is raised so the caller can decide what to do.
+
+    One client acts for one athlete (`athlete_id`, None for the default
+    credentials). Clients of different athletes share the rate limiter and
+    can share `session`; `on_token(data)` is called with every token
+    response so rotated refresh tokens can be stored.
+    """
+
+    def __init__(self, client_id=CLIENT_ID, client_secret=CLIENT_SECRET,
+                 refresh_token=REFRESH_TOKEN, rate_limiter=None,
+                 max_retries=3, backoff=1.0, max_wait=60, pool_size=16, timeout=30,
+                 athlete_id=None, access_token=None, expires_at=0, on_token=None, session=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_token = refresh_token
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.athlete_id = athlete_id
+        self.on_token = on_token
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+
+        self._access_token = access_token
+        self._expires_at = expires_at or 0
+        self._token_lock = threading.Lock()
+
+    def get_access_token(self):
+        """Return a valid access token, refreshing it only when it has expired."""
+        with self._token_lock:
+            if self._access_token and time.time() < self._expires_at - TOKEN_EXPIRY_MARGIN:
+                return self._access_token
+            payload = {
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'refresh_token': self.refresh_token,
+                'grant_type': "refresh_token",
+            }
+            started = time.perf_counter()
+            try:
+                res = self.session.post(AUTH_URL, data=payload, verify=False, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                observe_strava_call("/oauth/token", "error", time.perf_counter() - started)
+                raise
+            observe_strava_call("/oauth/token", res.status_code, time.perf_counter() - started)
+            res.raise_for_status()
+            data = res.json()
+            self._access_token = data["access_token"]
+            self._expires_at = data.get("expires_at", time.time() + 3600)
+            # Strava may rotate the refresh token; the old one stops working.
+            self.refresh_token = data.get("refresh_token", self.refresh_token)
+            if self.on_token is not None:
+                self.on_token(data)
+            return self._access_token
+
+    def invalidate_token(self):
+        with self._token_lock:
+            self._access_token = None
+
+    def get(self, path, params=None):
+        """GET `path` (relative to BASE_URL) and return the decoded JSON."""
+        url = f"{BASE_URL}{path}"
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            headers = {'Authorization': f'Bearer {self.get_access_token()}'}
+
+            self.rate_limiter.acquire(self.athlete_id)
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, headers=headers, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                observe_strava_call(path, "error", time.perf_counter() - started)
+                self.rate_limiter.update({})
+                if last_attempt:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+                continue
+            observe_strava_call(path, response.status_code, time.perf_counter() - started)
+            self.rate_limiter.update(response.headers)
+
+            if response.status_code == 401 and not last_attempt:
+                self.invalidate_token()
+                continue
+
+            if response.status_code == 429:
+                wait = retry_after(response)
+                retry_at = time.time() + wait
+                self.rate_limiter.block_until(retry_at)
+                if wait > self.max_wait or last_attempt:
+                    raise RateLimitExceeded(retry_at)
+                continue  # acquire() waits until the window reopens
+
+            if response.status_code >= 500 and not last_attempt:
+                time.sleep(self.backoff * 2 ** attempt)
+                continue
+
+            response.raise_for_status()
+            return response.json()
+
+    def exchange_code(self, code):
+        """Trade an OAuth authorization code for the athlete's tokens.
 
-AUTH_URL = "https://www.strava.com/oauth/token"
-BASE_URL = "https://www.strava.com/api/v3"
+        Strava answers with the athlete's profile under "athlete" along with
+        the access and refresh tokens.
+        """
+        started = time.perf_counter()
+        res = self.session.post(AUTH_URL, data={
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'code': code,
+            'grant_type': "authorization_code",
+        }, verify=False, timeout=self.timeout)
+        observe_strava_call("/oauth/token", res.status_code, time.perf_counter() - started)
+        res.raise_for_status()
+        return res.json()
+
+    def get_athlete(self):
+        return self.get("/athlete")
+
+    def iter_activity_pages(self, after=None, before=None, per_page=MAX_PER_PAGE):
+        """Yield pages of activity summaries until Strava runs out.
+
+        With `after` (epoch seconds) Strava returns activities oldest first,
+        which is what incremental sync relies on to advance its watermark.
+        """
+        page = 1
+        while True:
+            params = {'per_page': per_page, 'page': page}
+            if after is not None:
+                params['after'] = int(after)
+            if before is not None:
+                params['before'] = int(before)
+            activities = self.get("/athlete/activities", params=params)
+            if activities:
+                yield activities
+            if len(activities) < per_page:
+                return
+            page += 1
+
+    def get_all_activities(self, limit=5):
+        activities = []
+        for page in self.iter_activity_pages(per_page=min(limit, MAX_PER_PAGE)):
+            activities.extend(page)
+            if len(activities) >= limit:
+                break
+        return activities[:limit]
+
+    def get_activity_details(self, activity_id):
+        return self.get(f"/activities/{activity_id}")
+
+    def get_activity_streams(self, activity_id, keys):
+        return self.get(f"/activities/{activity_id}/streams",
+                        params={'keys': ",".join(keys), 'key_by_type': "true"})
+
+    def get_segment_details(self, segment_id):
+        return self.get(f"/segments/{segment_id}")
+
+    def get_segment_polyline(self, segment_id):
+        data = self.get_segment_details(segment_id)
+        return data["map"]["polyline"] if "map" in data and data["map"].get("polyline") else None
+
+
+# Shared by every caller in the process so they draw on one token, one
+# connection pool and one rate budget.
+client = StravaClient()
+rate_limiter = client.rate_limiter
+Gauge("strava_rate_limit_remaining", "Strava API calls left in the current window.",
+      lambda: {(window,): tokens for window, tokens in rate_limiter.budget().items()}, ("window",))
+
+
+def authorize_url(redirect_uri, scope="read,activity:read_all", state=None):
+    """Strava page where an athlete grants us access; it redirects to `redirect_uri` with a code."""
+    params = {"client_id": CLIENT_ID, "response_type": "code", "redirect_uri": redirect_uri,
+              "approval_prompt": "auto", "scope": scope}
+    if state:
+        params["state"] = state
+    return requests.Request("GET", AUTHORIZE_URL, params=params).prepare().url
+
+
+def exchange_code(code):
+    """Tokens and profile of the athlete who just authorized us."""
+    return client.exchange_code(code)
 
 
 def get_access_token():
-    """Refresh and return a valid Strava access token."""
-    payload = {
-        'client_id': CLIENT_ID,
-        'client_secret': CLIENT_SECRET,
-        'refresh_token': REFRESH_TOKEN,
-        'grant_type': "refresh_token",
-    }
-    res = requests.post(AUTH_URL, data=payload, verify=False)
-    return res.json()["access_token"]
+    """Return a valid Strava access token (cached until it expires)."""
+    return client.get_access_token()
 
 
 def get_all_activities(limit=5):
     """Fetch your recent activities (for testing)."""
-    token = get_access_token()
-    headers = {'Authorization': f'Bearer {token}'}
-    params = {'per_page': limit, 'page': 1}
-    response = requests.get(f"{BASE_URL}/athlete/activities", headers=headers, params=params)
-    return response.json()
+    return client.get_all_activities(limit=limit)
+
+
+def get_athlete():
+    """Fetch the authenticated athlete's profile."""
+    return client.get_athlete()
+
+
+def iter_activity_pages(after=None, before=None, per_page=MAX_PER_PAGE):
+    """Yield pages of activity summaries, oldest first when `after` is given."""
+    return client.iter_activity_pages(after=after, before=before, per_page=per_page)
 
 
 def get_activity_details(activity_id):
     """Fetch detailed info about one activity (includes segment_efforts)."""
-    token = get_access_token()
-    headers = {'Authorization': f'Bearer {token}'}
-    url = f"{BASE_URL}/activities/{activity_id}"
-    return requests.get(url, headers=headers).json()
+    return client.get_activity_details(activity_id)
+
+
+def get_activity_streams(activity_id, keys):
+    """Fetch the `keys` streams (time, latlng, heartrate, ...) of one activity, keyed by type."""
+    return client.get_activity_streams(activity_id, keys)
 
 
 def get_segment_details(segment_id):
     """Fetch info about one segment (includes KOM/QOM times)."""
-    token = get_access_token()
-    headers = {'Authorization': f'Bearer {token}'}
-    url = f"{BASE_URL}/segments/{segment_id}"
-    return requests.get(url, headers=headers).json()
+    return client.get_segment_details(segment_id)
+
 
 def get_segment_polyline(segment_id):
     """Fetch the segment polyline from Strava API."""
-    token = get_access_token()
-    headers = {"Authorization": f"Bearer {token}"}
-    url = f"{BASE_URL}/segments/{segment_id}"
-    resp = requests.get(url, headers=headers)
-
-    # Handle rate limit (HTTP 429)
-    if resp.status_code == 429:
-        print("Rate limit reached, waiting 15 minutes...")
-        time.sleep(15 * 60)
-        return get_segment_polyline(segment_id)
-
-    resp.raise_for_status()
-    data = resp.json()
-
-    return data["map"]["polyline"] if "map" in data and data["map"].get("polyline") else None
\ No newline at end of file
+    return client.get_segment_polyline(segment_id)
@@ -0,0 +1,178 @@
+# streams.py
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import numpy as np
+import requests
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.sqlite import insert
+
+from athletes import client_for
+from db import Activity, ActivityStream
+
+# Streams fetched for every activity, with the factor each is multiplied by
+# before rounding to int32: 1e-7 degrees (~1 cm), 0.1 m, 0.001 m/s, 0.1 %.
+STREAM_SCALES = {
+    "time": 1,
+    "latlng": 1e7,
+    "distance": 10,
+    "altitude": 10,
+    "velocity_smooth": 1000,
+    "heartrate": 1,
+    "cadence": 1,
+    "watts": 1,
+    "temp": 1,
+    "grade_smooth": 10,
+    "moving": 1,
+}
+# Values per sample; everything else is one.
+STREAM_COLUMNS = {"latlng": 2}
+COMPRESSION_LEVEL = 6
+DEFAULT_WORKERS = 8
+# Activities whose streams are written per commit.
+FLUSH_EVERY = 25
+
+
+def encode_stream(kind, values):
+    """(length, scale, blob) for a list of stream values.
+
+    Samples are scaled to int32 and stored as the difference from the
+    previous sample, which is small and repetitive for anything recorded at a
+    steady rate, so zlib shrinks it to a byte or two per sample. Missing
+    values (null heart rate or power while paused) are stored as 0.
+    """
+    scale = STREAM_SCALES.get(kind, 1)
+    array = np.asarray(values, dtype=np.float64).reshape(len(values), STREAM_COLUMNS.get(kind, 1))
+    quantized = np.rint(np.nan_to_num(array) * scale).astype("<i4")
+    deltas = np.diff(quantized, axis=0, prepend=np.zeros((1, quantized.shape[1]), dtype="<i4"))
+    return len(values), float(scale), zlib.compress(deltas.tobytes(), COMPRESSION_LEVEL)
+
+
+def decode_stream(kind, length, scale, blob):
+    """The stream as a NumPy array: int32 for integer streams, float64 for scaled ones.
+
+    The int32 deltas are read in place from the decompressed buffer with
+    np.frombuffer; the running sum is the only pass over the data.
+    """
+    deltas = np.frombuffer(zlib.decompress(blob), dtype="<i4").reshape(length, STREAM_COLUMNS.get(kind, 1))
+    values = np.cumsum(deltas, axis=0, dtype=np.int32)
+    if kind not in STREAM_COLUMNS:
+        values = values.reshape(length)
+    return values if scale == 1 else values / scale
+
+
+def stream_rows(activity_id, payload):
+    """`activity_streams` rows from a streams response keyed by type."""
+    rows = []
+    for kind, stream in (payload or {}).items():
+        data = stream.get("data") if isinstance(stream, dict) else None
+        if not data:
+            continue
+        length, scale, blob = encode_stream(kind, data)
+        rows.append({"activity_id": activity_id, "type": kind, "length": length, "scale": scale, "data": blob})
+    return rows
+
+
+def store_streams(session, fetched):
+    """Replace the streams of every activity in `fetched` ({activity_id: payload or None})."""
+    if not fetched:
+        return 0
+    ids = list(fetched)
+    session.execute(delete(ActivityStream).where(ActivityStream.activity_id.in_(ids)))
+    rows = [row for activity_id, payload in fetched.items() for row in stream_rows(activity_id, payload)]
+    if rows:
+        session.execute(insert(ActivityStream), rows)
+    session.execute(
+        update(Activity).where(Activity.id.in_(ids)).values(streams_fetched_at=datetime.now(timezone.utc))
+    )
+    return len(rows)
+
+
+def fetch_activity_streams(activity_id, athlete_id=None):
+    """Streams payload for one activity, or None if Strava has none (e.g. a manual entry)."""
+    try:
+        return client_for(athlete_id).get_activity_streams(activity_id, list(STREAM_SCALES))
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return None
+        raise
+
+
+def sync_streams(session, limit=None, workers=DEFAULT_WORKERS, refresh=False, athlete_id=None):
+    """Fetch and store streams for activities that don't have them yet, newest first.
+
+    Every request counts against the same rate budget as sync, so `limit`
+    caps how many activities one run asks for. `refresh` re-fetches
+    activities whose streams were already stored. `athlete_id` limits the
+    run to one athlete; each activity is fetched with its owner's token.
+    Returns (activities fetched, streams stored, failed activity ids).
+    """
+    query = select(Activity.id, Activity.athlete_id).order_by(Activity.start_date.desc())
+    if not refresh:
+        query = query.where(Activity.streams_fetched_at.is_(None))
+    if athlete_id is not None:
+        query = query.where(Activity.athlete_id == athlete_id)
+    if limit is not None:
+        query = query.limit(limit)
+    owners = dict(session.execute(query).tuples().all())
+    session.commit()
+
+    fetched, failed = {}, []
+    done = stored = 0
+
+    def flush():
+        nonlocal done, stored
+        stored += store_streams(session, fetched)
+        session.commit()
+        done += len(fetched)
+        fetched.clear()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch_activity_streams, activity_id, owner): activity_id
+                   for activity_id, owner in owners.items()}
+        for future in as_completed(futures):
+            activity_id = futures[future]
+            try:
+                fetched[activity_id] = future.result()
+            except Exception as e:
+                print(f"⚠️ Error fetching streams for {activity_id}: {e}")
+                failed.append(activity_id)
+                continue
+            if len(fetched) >= FLUSH_EVERY:
+                flush()
+    flush()
+    return done, stored, failed
+
+
+def load_streams(session, activity_id, types=None):
+    """{type: array} of the stored streams of one activity, only `types` if given."""
+    query = select(ActivityStream.type, ActivityStream.length, ActivityStream.scale, ActivityStream.data).where(
+        ActivityStream.activity_id == activity_id
+    )
+    if types:
+        query = query.where(ActivityStream.type.in_(types))
+    return {
+        row.type: decode_stream(row.type, row.length, row.scale, row.data)
+        for row in session.execute(query)
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    from db import SessionLocal, init_db
+
+    parser = argparse.ArgumentParser(description="Fetch activity streams from Strava")
+    parser.add_argument("--limit", type=int, help="activities to fetch this run")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--refresh", action="store_true", help="re-fetch activities that already have streams")
+    parser.add_argument("--athlete", type=int, help="only this athlete's activities")
+    args = parser.parse_args()
+
+    init_db()
+    session = SessionLocal()
+    try:
+        done, stored, failed = sync_streams(session, args.limit, args.workers, args.refresh, args.athlete)
+    finally:
+        session.close()
+    print(f"🌊 Stored {stored} streams for {done} activities ({len(failed)} failed).")
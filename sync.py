@@ -0,0 +1,219 @@
+# sync.py
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+from sqlalchemy import func
+
+from cache import response_cache
+from db import Activity, SyncState
+from heatmap import update_from_db as update_heatmap
+from ingest import claim_legacy_rows, ingest_activities, legacy_rows_exist, parse_date
+from matcher import touches_segments
+from raw_store import get_activity_details
+import athletes
+import strava_api
+
+# Detail requests in flight at once. The rate limiter decides how fast they
+# actually go; this only bounds how many threads wait on Strava.
+DEFAULT_WORKERS = 8
+
+# Finished activities buffered before one bulk upsert and commit.
+FLUSH_EVERY = 25
+
+# Store activities whose route crosses no known segment from their summary
+# alone, without a detail request. Off by default: efforts on segments not in
+# the local library yet are missed until `matcher.py` or a refresh sync.
+SKIP_UNMATCHED = os.environ.get("STRAVA_SYNC_SKIP_UNMATCHED", "0") == "1"
+
+
+def to_epoch(dt):
+    """Epoch seconds for a stored (naive UTC) or parsed (aware) datetime."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def load_sync_state(session, athlete_id):
+    """Return the athlete's SyncState, seeding the watermark from their existing rows."""
+    state = session.get(SyncState, athlete_id)
+    if state is None:
+        newest = session.query(func.max(Activity.start_date)).filter(Activity.athlete_id == athlete_id).scalar()
+        state = SyncState(athlete_id=athlete_id, watermark=to_epoch(newest) if newest else 0)
+        session.add(state)
+        session.commit()
+    return state
+
+
+def claim_legacy_rows_for(session, client, athlete_id):
+    """Claim ownerless rows if `athlete_id` is the default credentials' athlete, who synced them.
+
+    Returns how many activities were claimed.
+    """
+    if not legacy_rows_exist(session):
+        return 0
+    if client is not athletes.clients.default and athlete_id != athletes.clients.default_athlete_id():
+        return 0
+    claimed = claim_legacy_rows(session, athlete_id)
+    session.commit()
+    response_cache.bump_generation()
+    try:
+        # Checks every route once, moving the claimed ones to the athlete's heatmap.
+        update_heatmap(session)
+    except Exception as e:
+        print(f"⚠️ Heatmap update failed: {e}")
+    print(f"🏷️ Claimed {claimed} activities stored before athletes were tracked for athlete {athlete_id}.")
+    return claimed
+
+
+def fetch_details(session, activities, workers, flush_every=FLUSH_EVERY, refresh=False, client=None):
+    """Fetch details for `activities` concurrently and store them as they arrive.
+
+    Details already in the raw store are read from disk instead of Strava
+    unless `refresh` is set.
+
+    Finished activities are upserted with their efforts in small batches, so a
+    failure part-way through keeps everything flushed so far.
+    Returns (inserted_activities, inserted_segments, failed activity summaries).
+    """
+    inserted_activities = 0
+    inserted_segments = 0
+    failed = []
+    batch = []
+
+    def flush():
+        nonlocal inserted_activities, inserted_segments
+        acts, segs = ingest_activities(session, batch)
+        session.commit()
+        inserted_activities += acts
+        inserted_segments += segs
+        batch.clear()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(get_activity_details, act["id"], refresh, client): act for act in activities}
+        for future in as_completed(futures):
+            act = futures[future]
+            try:
+                batch.append((act, future.result()))
+            except Exception as e:
+                print(f"⚠️ Error fetching details for {act['id']}: {e}")
+                failed.append(act)
+                continue
+            if len(batch) >= flush_every:
+                flush()
+    if batch:
+        flush()
+
+    return inserted_activities, inserted_segments, failed
+
+
+def sync_activities(session, limit=None, full=False, refresh=False, workers=DEFAULT_WORKERS,
+                    after=None, on_page=None, skip_unmatched=SKIP_UNMATCHED, client=None):
+    """Pull new activities and their segment efforts into the database.
+
+    Only activities that started after the athlete's watermark are listed,
+    oldest first, one page at a time. `full=True` lists the whole history
+    instead (a backfill); activities already stored are skipped with one
+    lookup per page unless `refresh=True`, which re-fetches them so changed
+    fields such as re-ranked PRs are updated. `limit` caps how many new activities one run ingests;
+    the next run carries on from the watermark.
+
+    `after` overrides where listing starts (to resume a backfill), and
+    `on_page(progress)` is called with the running totals and the run's
+    checkpoint before each page is committed, so its own writes land in the
+    same transaction as the page.
+
+    With `skip_unmatched`, new activities that matcher.py finds cross no
+    known segment are stored from their summary without a detail request.
+
+    `client` is the StravaClient of the athlete to sync (see athletes.py);
+    the default credentials otherwise. The session's connection is given
+    back before every wait on Strava, so many athletes can sync at once.
+    """
+    client = client or strava_api.client
+    athlete_id = client.athlete_id or client.get_athlete()["id"]
+    # Before the watermark is seeded from the athlete's rows.
+    claim_legacy_rows_for(session, client, athlete_id)
+    state = load_sync_state(session, athlete_id)
+    if client is athletes.clients.default:
+        athletes.remember_default(session, athlete_id)
+    if after is None:
+        after = 0 if full else (state.watermark or 0)
+    checkpoint = after
+    session.commit()
+
+    listed = 0
+    inserted_activities = 0
+    inserted_segments = 0
+    failed_activities = 0
+    skipped_details = 0
+    ingested_ids = []
+
+    for page in client.iter_activity_pages(after=after):
+        listed += len(page)
+        ids = [act["id"] for act in page]
+        existing = set() if refresh else {
+            row.id for row in session.query(Activity.id).filter(Activity.id.in_(ids))
+        }
+        new_activities = [act for act in page if act["id"] not in existing]
+        if limit is not None:
+            new_activities = new_activities[:limit - inserted_activities]
+
+        to_fetch = new_activities
+        if skip_unmatched and new_activities:
+            touching = touches_segments(session, new_activities)
+            to_fetch = [act for act in new_activities if act["id"] in touching]
+            skipped = [act for act in new_activities if act["id"] not in touching]
+            if skipped:
+                inserted_activities += ingest_activities(session, [(act, act) for act in skipped])[0]
+                # Like fetch_details' flushes: the raw store writes from other connections.
+                session.commit()
+                skipped_details += len(skipped)
+
+        # Ends the read transaction, so no connection is held while details download.
+        session.commit()
+        acts, segs, failed = fetch_details(session, to_fetch, workers, refresh=refresh, client=client)
+        inserted_activities += acts
+        inserted_segments += segs
+        failed_activities += len(failed)
+
+        # Pages come oldest first, so the watermark can move up to (but not
+        # past) the first activity on the page that is still not stored.
+        failed_ids = {act["id"] for act in failed}
+        ingested_ids.extend(act["id"] for act in new_activities if act["id"] not in failed_ids)
+        stored = (existing | {act["id"] for act in new_activities}) - failed_ids
+        for act in page:
+            if act["id"] not in stored:
+                break
+            checkpoint = to_epoch(parse_date(act["start_date"]))
+            state.watermark = max(state.watermark or 0, checkpoint)
+        state.last_synced_at = datetime.now(timezone.utc)
+        if on_page is not None:
+            on_page({
+                "listed_activities": listed,
+                "inserted_activities": inserted_activities,
+                "inserted_segments": inserted_segments,
+                "failed_activities": failed_activities,
+                "checkpoint": checkpoint,
+            })
+        session.commit()
+
+        if failed or (limit is not None and inserted_activities >= limit):
+            break
+
+    if inserted_activities:
+        response_cache.bump_generation()
+        try:
+            update_heatmap(session, ingested_ids)
+        except Exception as e:
+            print(f"⚠️ Heatmap update failed: {e}")
+    print(f"Listed {listed} activities, ingested {inserted_activities} ({skipped_details} without details)")
+    return {
+        "listed_activities": listed,
+        "inserted_activities": inserted_activities,
+        "inserted_segments": inserted_segments,
+        "failed_activities": failed_activities,
+        "skipped_details": skipped_details,
+        "watermark": state.watermark,
+        "checkpoint": checkpoint,
+    }
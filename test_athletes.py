@@ -0,0 +1,74 @@
+# test_athletes.py
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import athletes
+import strava_api
+from athletes import AthleteClients, UnknownAthlete
+from db import Activity, Athlete, SyncState
+
+
+@pytest.fixture
+def clients(engine):
+    factory = sessionmaker(bind=engine)
+    session = factory()
+    session.add(Athlete(id=2, refresh_token="r2", access_token="a2", expires_at=0))
+    session.add(Athlete(id=3, refresh_token="r3", revoked_at=datetime.now(timezone.utc)))
+    session.commit()
+    session.close()
+    default = strava_api.StravaClient(refresh_token="r1", rate_limiter=strava_api.rate_limiter, athlete_id=1)
+    return AthleteClients(session_factory=factory, default=default)
+
+
+def test_connected_athlete_gets_own_client(clients):
+    client = clients.get(2)
+    assert client is not clients.default
+    assert (client.athlete_id, client.refresh_token) == (2, "r2")
+    assert clients.get(2) is client
+
+
+def test_default_credentials_serve_none_and_their_own_athlete(clients):
+    assert clients.get(None) is clients.default
+    assert clients.get(1) is clients.default
+
+
+def test_unknown_athlete_never_falls_back_to_default(clients):
+    with pytest.raises(UnknownAthlete):
+        clients.get(4)
+
+
+def test_revoked_athlete_raises(clients):
+    with pytest.raises(UnknownAthlete, match="revoked"):
+        clients.get(3)
+
+
+def add_activity(session, activity_id, athlete_id):
+    session.add(Activity(id=activity_id, athlete_id=athlete_id, start_date=datetime(2024, 1, activity_id)))
+    session.commit()
+
+
+def test_default_athlete_is_the_only_one_with_activities(session, monkeypatch):
+    monkeypatch.setattr(athletes, "clients", None)
+    assert athletes.default_athlete(session) is None
+    add_activity(session, 1, None)
+    add_activity(session, 2, 7)
+    assert athletes.default_athlete(session) == 7
+
+
+def test_default_athlete_of_several_is_the_one_the_default_credentials_synced_as(session, monkeypatch):
+    monkeypatch.setattr(athletes, "clients", None)
+    add_activity(session, 1, 1)
+    add_activity(session, 2, 2)
+    assert athletes.default_athlete(session) is None
+
+    session.add_all([SyncState(athlete_id=1), SyncState(athlete_id=2)])
+    athletes.remember_default(session, 1)
+    session.commit()
+    assert athletes.default_athlete(session) == 1
+
+    # The env credentials were swapped for the other athlete's.
+    athletes.remember_default(session, 2)
+    session.commit()
+    assert athletes.default_athlete(session) == 2
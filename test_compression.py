@@ -0,0 +1,78 @@
+# test_compression.py
+import gzip
+
+import pytest
+from starlette.requests import Request
+
+import compression
+from cache import ResponseCache, cached_bytes
+
+
+def request(headers=(), path="/things"):
+    return Request({
+        "type": "http", "method": "GET", "path": path, "query_string": b"",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers],
+    })
+
+
+BODY = b'{"rows": [' + b",".join(b'{"n": %d}' % i for i in range(500)) + b"]}"
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache(name="test")
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("", None),
+    ("gzip", "gzip"),
+    ("gzip;q=0", None),
+    ("*", "gzip"),
+    ("gzip;q=0, *", None),
+    ("identity", None),
+    ("deflate, gzip;q=0.5", "gzip"),
+])
+def test_pick_encoding_follows_accept_encoding(monkeypatch, header, expected):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert compression.pick_encoding(request([("Accept-Encoding", header)]), len(BODY), "application/json") == expected
+
+
+def test_small_and_binary_bodies_stay_identity():
+    gz = request([("Accept-Encoding", "gzip")])
+    assert compression.pick_encoding(gz, compression.MIN_SIZE - 1, "application/json") is None
+    assert compression.pick_encoding(gz, len(BODY), "image/png") is None
+
+
+def test_each_encoding_has_its_own_etag(cache, monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    plain = cached_bytes(request(), lambda: BODY, "application/json", cache)
+    packed = cached_bytes(request([("Accept-Encoding", "gzip")]), lambda: BODY, "application/json", cache)
+
+    assert plain.body == BODY and "content-encoding" not in plain.headers
+    assert packed.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(packed.body) == BODY
+    assert plain.headers["etag"] != packed.headers["etag"]
+    assert "Accept-Encoding" in packed.headers["vary"]
+
+
+def test_if_none_match_only_matches_the_same_encoding(cache):
+    etag = cached_bytes(request(), lambda: BODY, "application/json", cache).headers["etag"]
+
+    assert cached_bytes(request([("If-None-Match", etag)]), lambda: BODY, "application/json", cache).status_code == 304
+    other = cached_bytes(request([("If-None-Match", etag), ("Accept-Encoding", "gzip")]),
+                         lambda: BODY, "application/json", cache)
+    assert other.status_code == 200
+
+
+def test_static_asset_is_read_once(tmp_path):
+    page = tmp_path / "index.html"
+    page.write_bytes(b"<html>" + b"x" * 4000 + b"</html>")
+    asset = compression.StaticAsset(str(page), "text/html; charset=utf-8")
+
+    first = asset.respond(request([("Accept-Encoding", "gzip")]))
+    page.write_bytes(b"changed")
+    again = asset.respond(request([("Accept-Encoding", "gzip"), ("If-None-Match", first.headers["etag"])]))
+
+    assert gzip.decompress(first.body).startswith(b"<html>")
+    assert "max-age" in first.headers["cache-control"]
+    assert again.status_code == 304
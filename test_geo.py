@@ -0,0 +1,37 @@
+# test_geo.py
+import numpy as np
+import pytest
+
+from geo import MAX_ZOOM, SimplifiedLines, resolve_tolerance, snap_tolerance, zoom_tolerance
+from polyline_codec import encode
+
+
+LINE = encode(np.column_stack([np.linspace(47.0, 47.1, 200), 8.0 + 0.001 * np.sin(np.linspace(0, 20, 200))]))
+
+
+def test_tolerances_snap_to_zoom_levels():
+    levels = {0.0} | {zoom_tolerance(z) for z in range(MAX_ZOOM + 1)}
+    for tolerance in np.geomspace(1e-9, 10, 500):
+        assert snap_tolerance(float(tolerance)) in levels
+        assert snap_tolerance(float(tolerance)) <= tolerance
+    assert resolve_tolerance(tolerance=zoom_tolerance(12) * 1.0001) == zoom_tolerance(12)
+    assert resolve_tolerance(zoom=12) == zoom_tolerance(12)
+    assert resolve_tolerance() == 0.0
+
+
+def test_cache_is_keyed_by_row_and_bounded_by_points():
+    cache = SimplifiedLines(max_points=250)
+    full = cache.get(("activity", 1), LINE, 0.0)
+    assert len(full) == 200
+    assert cache.get(("activity", 1), LINE, 0.0) is full
+
+    cache.get(("activity", 2), LINE, 0.0)
+    assert cache.points <= 250
+    assert len(cache._entries) == 1
+
+
+def test_changed_polyline_is_simplified_again():
+    cache = SimplifiedLines()
+    cache.get(("segment", 1), LINE, 0.0)
+    other = encode(np.array([[1.0, 2.0], [1.5, 2.5]]))
+    assert cache.get(("segment", 1), other, 0.0) == ((2.0, 1.0), (2.5, 1.5))
@@ -0,0 +1,81 @@
+# test_heatmap.py
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import heatmap
+from db import Activity
+from polyline_codec import encode
+
+
+@pytest.fixture(autouse=True)
+def heatmap_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(heatmap, "HEATMAP_DIR", str(tmp_path))
+    monkeypatch.setattr(heatmap, "_heatmaps", {})
+
+
+def route(lat, lng):
+    return encode(np.array([[lat, lng], [lat + 0.01, lng + 0.01]]))
+
+
+def add_activity(session, activity_id, athlete_id, lat=47.0):
+    session.add(Activity(id=activity_id, athlete_id=athlete_id, start_date=datetime(2024, 1, activity_id),
+                         polyline=route(lat, 8.0)))
+
+
+def drawn(athlete_id):
+    return heatmap.heatmap_for(athlete_id).activity_ids.tolist()
+
+
+def test_each_athlete_has_their_own_heatmap(session):
+    add_activity(session, 1, 10)
+    add_activity(session, 2, 20, lat=46.0)
+    session.commit()
+
+    assert heatmap.update_from_db(session) == 2
+    assert drawn(10) == [1]
+    assert drawn(20) == [2]
+    assert heatmap.heatmap_for(10).counts.sum() > 0
+    assert not np.array_equal(heatmap.heatmap_for(10).keys, heatmap.heatmap_for(20).keys)
+
+
+def test_claimed_routes_move_to_their_owner(session):
+    add_activity(session, 1, None)
+    session.commit()
+    heatmap.update_from_db(session)
+    assert drawn(None) == [1]
+
+    session.get(Activity, 1).athlete_id = 10
+    session.commit()
+    heatmap.update_from_db(session)
+
+    assert drawn(10) == [1]
+    assert drawn(None) == []
+    assert len(heatmap.heatmap_for(None).keys) == 0
+
+
+def test_remove_takes_routes_out_of_the_owners_heatmap(session):
+    add_activity(session, 1, 10)
+    add_activity(session, 2, 20)
+    session.commit()
+    heatmap.update_from_db(session)
+
+    assert heatmap.remove([1], [route(47.0, 8.0)], [10]) == 1
+    assert drawn(10) == []
+    assert drawn(20) == [2]
+
+
+def test_update_draws_the_given_activities_and_saves_each_grid_once(session, monkeypatch):
+    for activity_id in (1, 2, 3):
+        add_activity(session, activity_id, 10)
+    session.commit()
+    saves = []
+    monkeypatch.setattr(heatmap.Heatmap, "save", lambda self: saves.append(self.athlete_id))
+
+    assert heatmap.update_from_db(session, [2, 3], batch_size=1) == 2
+
+    assert drawn(10) == [2, 3]
+    assert saves == [10]
+    assert heatmap.update_from_db(session, [2, 3]) == 0
+    assert saves == [10]
@@ -0,0 +1,99 @@
+# test_ingest.py
+from datetime import datetime
+
+from sqlalchemy import select
+
+from db import SegmentBest, SegmentEffort
+from ingest import ingest_activities, refresh_segment_bests
+
+
+def add_effort(session, effort_id, elapsed_time, day, athlete_id=1, segment_id=7, is_pr=False):
+    session.add(SegmentEffort(
+        effort_id=effort_id, segment_id=segment_id, segment_name="Climb", elapsed_time=elapsed_time,
+        start_date=datetime(2024, 5, day), is_pr=is_pr, athlete_id=athlete_id,
+    ))
+
+
+def bests(session):
+    return {(b.athlete_id, b.segment_id): b for b in session.execute(select(SegmentBest)).scalars()}
+
+
+def test_best_effort_is_the_fastest_not_the_latest(session):
+    add_effort(session, 101, 100, 1, is_pr=True)
+    add_effort(session, 102, 200, 2)
+    add_effort(session, 103, 150, 3, is_pr=True)
+    session.flush()
+    refresh_segment_bests(session, [7])
+
+    best = bests(session)[(1, 7)]
+    assert best.best_time == 100
+    assert best.best_effort_id == 101
+    assert best.attempt_count == 3
+    assert best.pr_count == 2
+    assert best.last_attempt_date == datetime(2024, 5, 3)
+    assert best.last_pr_date == datetime(2024, 5, 3)
+
+
+def test_best_effort_ties_go_to_the_lowest_effort_id(session):
+    add_effort(session, 202, 90, 1)
+    add_effort(session, 201, 90, 2)
+    add_effort(session, 203, 120, 3)
+    session.flush()
+    refresh_segment_bests(session, [7])
+
+    assert bests(session)[(1, 7)].best_effort_id == 201
+
+
+def test_bests_are_kept_per_athlete(session):
+    add_effort(session, 301, 100, 1, athlete_id=1)
+    add_effort(session, 302, 80, 2, athlete_id=2)
+    add_effort(session, 303, 120, 3, athlete_id=1)
+    session.flush()
+    refresh_segment_bests(session, [7])
+
+    rows = bests(session)
+    assert (rows[(1, 7)].best_effort_id, rows[(1, 7)].attempt_count) == (301, 2)
+    assert (rows[(2, 7)].best_effort_id, rows[(2, 7)].attempt_count) == (302, 1)
+
+
+def test_estimated_efforts_do_not_count(session):
+    add_effort(session, 401, 150, 1)
+    # A locally matched effort: no Strava effort_id and a faster estimated time.
+    add_effort(session, None, 90, 2)
+    session.flush()
+    refresh_segment_bests(session, [7])
+
+    best = bests(session)[(1, 7)]
+    assert (best.best_time, best.best_effort_id, best.attempt_count) == (150, 401, 1)
+
+
+def test_segment_with_only_estimated_efforts_has_no_best(session):
+    add_effort(session, None, 90, 1)
+    session.flush()
+    refresh_segment_bests(session, [7])
+
+    assert bests(session) == {}
+
+
+def detailed_activity(pr_rank):
+    return {
+        "id": 1, "name": "Morning Ride", "type": "Ride", "athlete": {"id": 1}, "start_date": "2024-05-01T07:00:00Z",
+        "segment_efforts": [{
+            "id": 301, "elapsed_time": 95, "start_date": "2024-05-01T07:10:00Z", "pr_rank": pr_rank,
+            "segment": {"id": 7, "name": "Climb", "distance": 1200.0},
+        }],
+    }
+
+
+def test_reingested_effort_is_updated_in_place(session):
+    ingest_activities(session, [(detailed_activity(1), detailed_activity(1))])
+    session.commit()
+    row_id = session.execute(select(SegmentEffort.id)).scalar_one()
+
+    # Strava re-ranked it after a faster ride: the same effort id comes back without the PR.
+    ingest_activities(session, [(detailed_activity(2), detailed_activity(2))])
+    session.commit()
+
+    effort = session.execute(select(SegmentEffort)).scalar_one()
+    assert (effort.id, effort.effort_id, effort.pr_rank, effort.is_pr) == (row_id, 301, 2, False)
+    assert bests(session)[(1, 7)].pr_count == 0
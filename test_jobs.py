@@ -0,0 +1,91 @@
+# test_jobs.py
+import time
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+import jobs
+from db import Activity, SyncJob
+from strava_api import RateLimitExceeded
+from test_sync import PagingClient, day, offline, summaries  # noqa: F401 (offline is a fixture)
+
+
+class RateLimitedClient(PagingClient):
+    """Raises RateLimitExceeded once, when asked for page `limited_page` of a listing."""
+
+    def __init__(self, activities, limited_page, **kwargs):
+        super().__init__(activities, **kwargs)
+        self.limited_page = limited_page
+
+    def iter_activity_pages(self, after=0):
+        for number, page in enumerate(super().iter_activity_pages(after), start=1):
+            if number == self.limited_page:
+                self.limited_page = None
+                raise RateLimitExceeded(time.time())
+            yield page
+
+
+class RecordingRunner(jobs.JobRunner):
+    """Runs jobs in the test's thread and notes the job's stored status whenever it waits."""
+
+    def __init__(self, session_factory):
+        super().__init__(session_factory=session_factory)
+        self.statuses_while_waiting = []
+
+    def _sleep_until(self, until):
+        session = self.session_factory()
+        try:
+            self.statuses_while_waiting.append(session.execute(select(SyncJob.status)).scalar_one())
+        finally:
+            session.close()
+
+
+@pytest.fixture
+def runner(engine):
+    return RecordingRunner(sessionmaker(bind=engine))
+
+
+def run_job(session, runner, monkeypatch, client, checkpoint=None):
+    monkeypatch.setattr(jobs, "client_for", lambda athlete_id: client)
+    job = jobs.submit_sync(session, athlete_id=5)
+    job.checkpoint = checkpoint
+    session.commit()
+    runner.run(job.id)
+    session.expire_all()
+    return session.get(SyncJob, job.id)
+
+
+def test_rate_limited_job_waits_and_resumes_from_its_checkpoint(session, runner, offline, monkeypatch):
+    client = RateLimitedClient(summaries(5), limited_page=2)
+
+    job = run_job(session, runner, monkeypatch, client)
+
+    assert runner.statuses_while_waiting == ["waiting"]
+    assert client.listed_after == [0, day(2)]
+    assert sorted(client.detail_requests) == [1, 2, 3, 4, 5]
+    assert (job.status, job.checkpoint, job.inserted_activities, job.listed) == ("done", day(5), 5, 5)
+
+
+def test_queued_job_carries_on_from_its_checkpoint(session, runner, offline, monkeypatch):
+    client = PagingClient(summaries(5))
+
+    job = run_job(session, runner, monkeypatch, client, checkpoint=day(2))
+
+    assert client.listed_after == [day(2)]
+    assert sorted(client.detail_requests) == [3, 4, 5]
+    assert sorted(session.execute(select(Activity.id)).scalars()) == [3, 4, 5]
+    assert (job.status, job.checkpoint) == ("done", day(5))
+
+
+def test_job_gives_up_when_passes_stop_making_progress(session, runner, offline, monkeypatch):
+    client = PagingClient(summaries(5), failing={3})
+
+    job = run_job(session, runner, monkeypatch, client)
+
+    assert job.status == "failed"
+    assert job.error == "1 activities keep failing"
+    assert job.checkpoint == day(2)
+    # One pass that stored 1, 2 and 4, then MAX_IDLE_ATTEMPTS passes that stored nothing.
+    assert client.detail_requests.count(3) == 1 + jobs.MAX_IDLE_ATTEMPTS
+    assert job.inserted_activities == 3
@@ -0,0 +1,161 @@
+# test_main.py
+import json
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+import athletes
+from cache import response_cache
+from db import Activity, Segment, SegmentEffort, SyncState, get_db
+from ingest import refresh_segment_bests
+from main import app, decode_cursor, encode_cursor
+from rollups import rebuild_rollups
+
+
+@pytest.fixture
+def client(session):
+    def override():
+        yield session
+
+    app.dependency_overrides[get_db] = override
+    response_cache.bump_generation()
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def two_athletes(session):
+    session.add(Segment(segment_id=7, name="Climb", polyline="_p~iF~ps|U_ulLnnqC"))
+    for athlete_id, effort_id, elapsed in ((1, 11, 100), (2, 21, 90)):
+        session.add(Activity(id=athlete_id, athlete_id=athlete_id, start_date=datetime(2024, 1, 1)))
+        session.add(SegmentEffort(effort_id=effort_id, segment_id=7, elapsed_time=elapsed, is_pr=True,
+                                  activity_id=athlete_id, athlete_id=athlete_id,
+                                  start_date=datetime(2024, 1, 1)))
+    # Athlete 1 is who the default credentials synced as.
+    session.add(SyncState(athlete_id=1, watermark=0, default_credentials=True))
+    session.add(SyncState(athlete_id=2, watermark=0))
+    session.flush()
+    refresh_segment_bests(session, [7])
+    rebuild_rollups(session)
+    session.commit()
+
+
+def test_prs_table_is_scoped_to_one_athlete(client, two_athletes):
+    rows = client.get("/prs_table").json()
+    assert [(r["athlete_id"], r["best_time"]) for r in rows] == [(1, 100)]
+    assert "segment_polyline" not in rows[0]
+    rows = client.get("/prs_table?athlete_id=2").json()
+    assert [(r["athlete_id"], r["best_time"]) for r in rows] == [(2, 90)]
+
+
+def test_prs_geojson_is_scoped_to_one_athlete(client, two_athletes):
+    features = client.get("/prs_geojson").json()["features"]
+    assert [f["properties"]["athlete_id"] for f in features] == [1]
+
+
+def test_endpoints_without_athlete_id_show_the_default_athlete(client, two_athletes):
+    assert [r["athlete_id"] for r in client.get("/prs").json()] == [1]
+    assert [r["id"] for r in client.get("/activities").json()["data"]] == [1]
+    assert [r["athlete_id"] for r in client.get("/segments").json()] == [1]
+    assert {r["athlete_id"] for r in client.get("/stats").json()["data"]} == {1}
+    assert client.get("/segments/progress?ids=7").json()["segments"]["7"]["elapsed_time"] == [100]
+    assert [e["elapsed_time"] for e in client.get("/segment/7/progress").json()["data"]] == [100]
+    assert [e["elapsed_time"] for e in client.get("/segment/7/progress?athlete_id=2").json()["data"]] == [90]
+
+
+def test_default_athlete_is_read_without_calling_strava(client, two_athletes, monkeypatch):
+    def get_athlete():
+        raise AssertionError("request handler called Strava")
+
+    monkeypatch.setattr(athletes.clients, "_default_athlete_id", None)
+    monkeypatch.setattr(athletes.clients.default, "get_athlete", get_athlete)
+
+    for path in ("/prs_table", "/prs_geojson", "/heatmap/0/0/0.png"):
+        assert client.get(path).status_code == 200
+
+
+def test_small_responses_are_sent_as_named_by_their_etag(client, two_athletes):
+    plain = client.get("/prs_table", headers={"Accept-Encoding": "identity"})
+    accepting = client.get("/prs_table", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in accepting.headers
+    assert accepting.headers["etag"] == plain.headers["etag"]
+    assert accepting.content == plain.content
+
+
+def test_cache_invalidate_serves_data_written_by_another_process(client, two_athletes, session):
+    assert len(client.get("/prs_table").json()) == 1
+
+    # What `python raw_store.py replay` does: writes rows without touching this server's cache.
+    session.add(Segment(segment_id=8, name="Descent", polyline="_p~iF~ps|U_ulLnnqC"))
+    session.add(SegmentEffort(effort_id=12, segment_id=8, elapsed_time=60, is_pr=True,
+                              activity_id=1, athlete_id=1, start_date=datetime(2024, 1, 2)))
+    session.flush()
+    refresh_segment_bests(session, [8])
+    session.commit()
+    assert len(client.get("/prs_table").json()) == 1
+
+    generation = client.post("/cache/invalidate").json()["generation"]
+    assert generation == response_cache.generation
+    assert len(client.get("/prs_table").json()) == 2
+
+
+@pytest.fixture
+def activities(session):
+    # Two pairs share a start date, so pages have to break ties on id.
+    for activity_id, day, kind in ((1, 1, "Ride"), (2, 2, "Run"), (3, 2, "Ride"), (4, 3, "Ride"),
+                                   (5, 3, "Ride"), (6, 4, "Run")):
+        session.add(Activity(id=activity_id, name=f"Activity {activity_id}", type=kind, distance=1000.0 * activity_id,
+                             start_date=datetime(2024, 1, day)))
+    session.commit()
+
+
+def pages(client, **params):
+    ids, cursor = [], None
+    while True:
+        page = client.get("/activities", params={**params, **({"cursor": cursor} if cursor else {})}).json()
+        ids.append([a["id"] for a in page["data"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return ids
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(datetime(2024, 1, 2, 7, 30), 42)) == (datetime(2024, 1, 2, 7, 30), 42)
+
+
+def test_activity_pages_walk_every_activity_once(client, activities):
+    assert pages(client, limit=2) == [[6, 5], [4, 3], [2, 1]]
+    assert pages(client, limit=4) == [[6, 5, 4, 3], [2, 1]]
+    assert pages(client, limit=2, type="Ride") == [[5, 4], [3, 1]]
+
+
+def test_activity_ndjson_streams_every_match(client, activities):
+    response = client.get("/activities", params={"format": "ndjson", "before": "2024-01-04T00:00:00"})
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == [5, 4, 3, 2, 1]
+
+
+def test_invalid_cursor_is_rejected(client, activities):
+    assert client.get("/activities", params={"cursor": "not a cursor"}).status_code == 400
+
+
+def test_activity_matches_are_served_from_the_cache_without_a_lookup(client, session):
+    assert client.get("/activities/9/matches").status_code == 404
+    session.add(Activity(id=9, name="Late upload", start_date=datetime(2024, 1, 5)))
+    session.commit()
+    assert client.get("/activities/9/matches").json() == {"activity_id": 9, "matches": []}
+
+    # A hit doesn't read the activity again: with the row gone and no bump, the cached body is still served.
+    session.delete(session.get(Activity, 9))
+    session.commit()
+    assert client.get("/activities/9/matches").status_code == 200
+
+
+def test_segment_progress_leaves_out_estimated_efforts(client, two_athletes, session):
+    session.add(SegmentEffort(effort_id=None, segment_id=7, elapsed_time=30, activity_id=1, athlete_id=1,
+                              start_date=datetime(2024, 1, 2)))
+    session.commit()
+
+    data = client.get("/segment/7/progress?athlete_id=1").json()["data"]
+    assert [e["elapsed_time"] for e in data] == [100]
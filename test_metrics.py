@@ -0,0 +1,56 @@
+# test_metrics.py
+import re
+
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+import metrics
+from db import get_db
+from main import app
+
+STREAMS = 'method="GET",route="/activities/{activity_id}/streams",status="200"'
+
+
+def series(exposition, name, labels):
+    """{le: value} of a histogram's buckets plus "count", for one label set."""
+    found = {}
+    for line in exposition.splitlines():
+        match = re.fullmatch(rf'{name}_bucket\{{{re.escape(labels)},le="([^"]+)"\}} (\S+)', line)
+        if match:
+            found[match.group(1)] = float(match.group(2))
+        elif line.startswith(f"{name}_count{{{labels}}} "):
+            found["count"] = float(line.split()[-1])
+    return found
+
+
+def test_requests_are_labelled_by_route_template(session):
+    def override():
+        yield session
+
+    app.dependency_overrides[get_db] = override
+    try:
+        client = TestClient(app)
+        before = series(client.get("/metrics").text, "http_request_duration_seconds", STREAMS).get("count", 0)
+        assert client.get("/activities/7/streams").status_code == 200
+        assert client.get("/activities/8/streams").status_code == 200
+        response = client.get("/metrics")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    exposition = response.text
+    assert "# TYPE http_request_duration_seconds histogram" in exposition
+    assert "/activities/7/streams" not in exposition
+    buckets = series(exposition, "http_request_duration_seconds", STREAMS)
+    values = [buckets[repr(b)] for b in metrics.DEFAULT_BUCKETS] + [buckets["+Inf"]]
+    assert values == sorted(values)
+    assert buckets["count"] == buckets["+Inf"] == before + 2
+
+
+def test_sql_statements_are_timed_per_engine(engine):
+    metrics.instrument_engine(engine, "test")
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+    timed = series(metrics.render(), "sql_query_duration_seconds", 'engine="test",statement="SELECT"')
+    assert timed["count"] == timed["+Inf"] >= 1
@@ -0,0 +1,58 @@
+# test_polyline_codec.py
+import numpy as np
+import pytest
+
+from polyline_codec import bounds_batch, decode, decode_batch, encode, encode_batch
+
+# Google's documented example.
+EXAMPLE = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+EXAMPLE_POINTS = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+
+
+def random_batch(seed=0, n=50):
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(1, 40, n)
+    sizes[:3] = 0  # empty polylines at the start, too
+    starts = rng.uniform((-80, -179), (80, 179), (n, 2))
+    routes = [np.round(s + np.cumsum(rng.normal(0, 0.01, (k, 2)), axis=0), 5)
+              for s, k in zip(starts, sizes)]
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+    return np.concatenate(routes), offsets
+
+
+def test_decodes_the_reference_example():
+    np.testing.assert_allclose(decode(EXAMPLE), EXAMPLE_POINTS)
+    assert encode(EXAMPLE_POINTS) == EXAMPLE
+
+
+def test_batch_round_trip():
+    coords, offsets = random_batch()
+    encoded = encode_batch(coords, offsets)
+    assert encoded[:3] == ["", "", ""]
+    decoded, decoded_offsets = decode_batch(encoded + [None])
+    np.testing.assert_array_equal(decoded_offsets[:-1], offsets)
+    assert decoded_offsets[-1] == offsets[-1]
+    np.testing.assert_allclose(decoded, coords, atol=1e-9)
+
+
+def test_matches_the_polyline_package():
+    polyline = pytest.importorskip("polyline")
+    coords, offsets = random_batch(seed=1)
+    encoded = encode_batch(coords, offsets)
+    for i, line in enumerate(encoded[3:], start=3):
+        points = [tuple(p) for p in coords[offsets[i]:offsets[i + 1]]]
+        assert line == polyline.encode(points, 5)
+        np.testing.assert_allclose(decode(line), polyline.decode(line))
+
+
+@pytest.mark.parametrize("bad", ["_p~iF~ps|U_", "_p~iF", "abc def"])
+def test_malformed_polylines_raise(bad):
+    with pytest.raises(ValueError):
+        decode_batch([bad])
+
+
+def test_bounds_of_empty_polylines_are_nan():
+    coords, offsets = decode_batch(["", EXAMPLE])
+    bounds = bounds_batch(coords, offsets)
+    assert np.isnan(bounds[0]).all()
+    np.testing.assert_allclose(bounds[1], (38.5, -126.453, 43.252, -120.2))
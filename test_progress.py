@@ -0,0 +1,64 @@
+# test_progress.py
+from datetime import datetime
+
+import pytest
+
+from db import SegmentEffort
+from progress import parse_ids, segments_progress
+
+
+def add_effort(session, effort_id, segment_id, day, elapsed_time, athlete_id=1):
+    session.add(SegmentEffort(effort_id=effort_id, segment_id=segment_id, segment_name=f"Segment {segment_id}",
+                              elapsed_time=elapsed_time, start_date=datetime(2024, 1, day), athlete_id=athlete_id))
+
+
+@pytest.fixture
+def efforts(session):
+    # Segment 7 gets faster, segment 8 slower; added out of date order.
+    for effort_id, segment_id, day, elapsed in ((1, 7, 31, 80), (2, 7, 1, 100), (3, 7, 11, 110), (4, 7, 21, 90),
+                                               (5, 8, 1, 60), (6, 8, 16, 66), (7, 9, 1, 50)):
+        add_effort(session, effort_id, segment_id, day, elapsed)
+    add_effort(session, 8, 7, 5, 70, athlete_id=2)
+    session.commit()
+
+
+def test_parse_ids_keeps_first_seen_order():
+    assert parse_ids(["3,1", "2", "1, 4,"]) == [3, 1, 2, 4]
+
+
+def test_batch_progress_per_segment(session, efforts):
+    progress = segments_progress(session, [7, 8, 10], athlete_id=1)
+
+    assert sorted(progress) == [7, 8]
+    climb = progress[7]
+    assert climb["elapsed_time"] == [100, 110, 90, 80]
+    assert climb["rolling_best"] == [100, 100, 90, 80]
+    assert climb["dates"][0] == "2024-01-01T00:00:00"
+    assert climb["stats"]["attempts"] == 4
+    assert climb["stats"]["best_time"] == 80
+    assert climb["stats"]["improvement"] == 20
+    assert climb["stats"]["trend_per_30d"] < 0
+
+    descent = progress[8]
+    assert descent["rolling_best"] == [60, 60]
+    assert descent["stats"]["trend_per_30d"] == pytest.approx(12.0)
+
+
+def test_progress_of_every_athlete_without_athlete_id(session, efforts):
+    progress = segments_progress(session, [7])
+    assert progress[7]["rolling_best"] == [100, 70, 70, 70, 70]
+    assert progress[7]["stats"]["attempts"] == 5
+
+
+def test_single_effort_has_no_trend(session, efforts):
+    assert segments_progress(session, [9])[9]["stats"]["trend_per_30d"] is None
+
+
+def test_estimated_efforts_stay_out_of_progress(session, efforts):
+    # A locally matched effort: no Strava id, time estimated from the route.
+    add_effort(session, None, 7, 25, 40)
+    session.commit()
+
+    climb = segments_progress(session, [7], athlete_id=1)[7]
+    assert climb["elapsed_time"] == [100, 110, 90, 80]
+    assert climb["stats"]["best_time"] == 80
@@ -0,0 +1,82 @@
+# test_ratelimit.py
+import queue
+import threading
+import time
+
+from ratelimit import RateLimiter, TokenBucket, next_window_boundary, parse_rate_headers
+
+
+def headers(limit, usage, prefix="X-RateLimit"):
+    return {f"{prefix}-Limit": limit, f"{prefix}-Usage": usage}
+
+
+def test_windows_are_aligned_to_utc():
+    assert next_window_boundary(900, now=1000) == 1800
+    assert next_window_boundary(900, now=1800) == 2700
+
+
+def test_read_limits_win_over_overall_limits():
+    both = {**headers("200,2000", "5,50"), **headers("100,1000", "3,30", "X-ReadRateLimit")}
+    assert parse_rate_headers(both) == ((100, 1000), (3, 30))
+    assert parse_rate_headers(headers("200,2000", "5,50")) == ((200, 2000), (5, 50))
+    assert parse_rate_headers(headers("200", "5")) is None
+    assert parse_rate_headers({}) is None
+
+
+def test_bucket_refills_in_full_at_the_window_boundary():
+    bucket = TokenBucket(5, 900)
+    bucket.tokens = 0
+    reset_at = bucket.reset_at
+    bucket.refill(reset_at - 1)
+    assert bucket.tokens == 0
+    bucket.refill(reset_at)
+    assert bucket.tokens == 5
+    assert bucket.reset_at == reset_at + 900
+
+
+def test_headers_resync_the_budget_net_of_requests_in_flight():
+    limiter = RateLimiter(short_limit=100, daily_limit=1000)
+    limiter.acquire()
+    limiter.acquire()
+    # One response is back; the other request still counts against the budget.
+    limiter.update(headers("600,30000", "10,20"))
+    assert (limiter.short.limit, limiter.short.tokens) == (600, 589)
+    assert (limiter.daily.limit, limiter.daily.tokens) == (30000, 29979)
+    limiter.update({})
+    assert limiter.remaining() == 589
+    assert limiter._pending == 0
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_waiting_athletes_take_turns():
+    limiter = RateLimiter(short_limit=100, daily_limit=1000)
+    limiter.block_until(limiter.short.reset_at + 3600)
+    served = queue.Queue()
+
+    def call(key):
+        limiter.acquire(key)
+        served.put(key)
+
+    threads = [threading.Thread(target=call, args=("backfill",), daemon=True) for _ in range(3)]
+    for t in threads:
+        t.start()
+    wait_for(lambda: limiter.waiting() == {"backfill": 3})
+    threads.append(threading.Thread(target=call, args=("new",), daemon=True))
+    threads[-1].start()
+    wait_for(lambda: limiter.waiting() == {"backfill": 3, "new": 1})
+
+    order = []
+    for _ in range(4):
+        # Each response leaves room for exactly one more request.
+        limiter.update(headers("100,1000", "99,0"))
+        order.append(served.get(timeout=2))
+    for t in threads:
+        t.join(2)
+    assert order == ["backfill", "new", "backfill", "backfill"]
+    assert limiter.waiting() == {}
@@ -0,0 +1,36 @@
+# test_raw_store.py
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from db import RawResponse, Segment
+from raw_store import RawStore, replay
+
+
+SEGMENT = {"id": 7, "name": "Climb", "distance": 1200.0, "start_latlng": [47.0, 8.0], "end_latlng": [47.01, 8.01],
+           "xoms": {"kom": "2:05", "qom": "2:40"}, "map": {"polyline": "_p~iF~ps|U_ulLnnqC"}}
+
+
+def test_replay_keeps_when_strava_sent_the_payload(tmp_path, engine, session):
+    factory = sessionmaker(bind=engine)
+    store = RawStore(str(tmp_path), session_factory=factory, read_session_factory=factory)
+    fetched_at = datetime(2024, 2, 3, 4, 5, 6)
+    store.put("segment", 7, SEGMENT, fetched_at=fetched_at)
+
+    assert replay(session, kinds=("segment",), store=store) == {"segment": 1}
+
+    segment = session.get(Segment, 7)
+    assert (segment.kom_time, segment.qom_time) == (125, 160)
+    assert segment.fetched_at == fetched_at
+    assert session.execute(select(RawResponse.fetched_at)).scalar_one() == fetched_at
+
+
+def test_blobs_are_stored_once(tmp_path, engine):
+    factory = sessionmaker(bind=engine)
+    store = RawStore(str(tmp_path), session_factory=factory, read_session_factory=factory)
+    first = store.put("segment", 7, SEGMENT)
+    second = store.put("segment", 8, dict(SEGMENT))
+    assert first == second
+    assert store.get("segment", 8) == SEGMENT
+    assert store.prune() == 0
@@ -0,0 +1,73 @@
+# test_rollups.py
+from datetime import date, datetime
+
+from db import Activity, ActivityRollup
+from rollups import period_end, period_start, query_rollups, rebuild_rollups, refresh_rollups, year_over_year
+
+
+def add(session, activity_id, start, kind="Ride", athlete_id=1, distance=1000.0):
+    activity = Activity(id=activity_id, athlete_id=athlete_id, type=kind, start_date=start, distance=distance,
+                        moving_time=600, elapsed_time=700, total_elevation_gain=10.0)
+    session.add(activity)
+    return activity
+
+
+def snapshot(session):
+    return sorted(
+        (r.athlete_id, r.type, r.period, r.period_start, r.count, r.distance, r.moving_time)
+        for r in session.query(ActivityRollup)
+    )
+
+
+def test_periods():
+    sunday = date(2024, 1, 7)
+    assert period_start(sunday, "week") == date(2024, 1, 1)
+    assert period_start(datetime(2024, 1, 8, 6), "week") == date(2024, 1, 8)
+    assert period_start(sunday, "month") == date(2024, 1, 1)
+    assert period_end(date(2024, 1, 29), "week") == date(2024, 2, 5)
+    assert period_end(date(2024, 12, 1), "month") == date(2025, 1, 1)
+
+
+def test_sql_weeks_match_python_weeks(session):
+    add(session, 1, datetime(2024, 1, 7, 23, 30))
+    add(session, 2, datetime(2024, 1, 8, 0, 30))
+    session.commit()
+    rebuild_rollups(session)
+    weeks = [(r.period_start, r.count) for r in query_rollups(session, "week")]
+    assert weeks == [(date(2024, 1, 1), 1), (date(2024, 1, 8), 1)]
+
+
+def test_refresh_matches_a_full_rebuild(session):
+    add(session, 1, datetime(2024, 1, 30))
+    moved = add(session, 2, datetime(2024, 1, 31))
+    deleted = add(session, 3, datetime(2024, 2, 1), kind="Run")
+    add(session, 4, datetime(2024, 2, 1), athlete_id=None)
+    session.commit()
+    rebuild_rollups(session)
+
+    old_start = moved.start_date
+    moved.start_date = datetime(2024, 3, 15)
+    session.delete(deleted)
+    add(session, 5, datetime(2024, 2, 2), kind="Run", athlete_id=2)
+    session.flush()
+    refresh_rollups(session, {(1, old_start), (1, moved.start_date), (1, datetime(2024, 2, 1)),
+                              (2, datetime(2024, 2, 2))})
+    session.commit()
+    refreshed = snapshot(session)
+
+    rebuild_rollups(session)
+    assert refreshed == snapshot(session)
+    assert (0, "Ride", "month", date(2024, 2, 1), 1, 1000.0, 600) in refreshed
+
+
+def test_year_over_year_adds_up_athletes(session):
+    add(session, 1, datetime(2024, 3, 1), distance=1000.0)
+    add(session, 2, datetime(2024, 3, 2), athlete_id=2, distance=500.0)
+    add(session, 3, datetime(2023, 3, 5), distance=200.0)
+    session.commit()
+    rebuild_rollups(session)
+
+    totals = year_over_year(query_rollups(session, "month", types=["Ride"]))
+    assert totals[2024]["Ride"][2] == {"count": 2, "distance": 1500.0, "moving_time": 1200, "elevation_gain": 20.0}
+    assert totals[2023]["Ride"][2]["count"] == 1
+    assert totals[2024]["Ride"][0] is None
@@ -0,0 +1,75 @@
+# test_segment_gaps.py
+import time
+from datetime import datetime
+
+import pytest
+
+from db import Segment, SegmentEffort
+from ingest import refresh_segment_bests
+from segment_gaps import SegmentRefresher, point_features, segment_gaps, stale_segment_ids
+
+
+@pytest.fixture
+def segments(session):
+    # 7 only came with an effort payload: no start point, details never fetched.
+    session.add(Segment(segment_id=7, name="From an effort"))
+    session.add(Segment(segment_id=8, name="Fetched", start_lat=47.0, start_lng=8.0, kom_time=80,
+                        fetched_at=datetime.now()))
+    for effort_id, segment_id in ((1, 7), (2, 8)):
+        session.add(SegmentEffort(effort_id=effort_id, segment_id=segment_id, elapsed_time=100, athlete_id=1,
+                                  start_date=datetime(2024, 1, 1)))
+    session.flush()
+    refresh_segment_bests(session, [7, 8])
+    session.commit()
+
+
+def test_segments_without_coordinates_are_listed_and_stale(session, segments):
+    rows = {r["segment_id"]: r for r in segment_gaps(session)}
+    assert set(rows) == {7, 8}
+    assert rows[7]["stale"] and not rows[8]["stale"]
+    assert rows[8]["difference"] == 20
+    assert stale_segment_ids(session) == [7]
+
+
+def test_bbox_keeps_segments_starting_inside(session, segments):
+    rows = segment_gaps(session, bbox=(7.5, 46.5, 8.5, 47.5))
+    assert [r["segment_id"] for r in rows] == [8]
+    assert segment_gaps(session, bbox=(0.0, 0.0, 1.0, 1.0)) == []
+
+
+def test_point_features_without_a_start_have_no_geometry(session, segments):
+    features = {f["properties"]["segment_id"]: f for f in point_features(segment_gaps(session))}
+    assert features[7]["geometry"] is None
+    assert features[8]["geometry"] == {"type": "Point", "coordinates": [8.0, 47.0]}
+
+
+class CountingRefresher(SegmentRefresher):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.sweeps = 0
+        self.refreshed = []
+
+    def sweep(self):
+        self.last_sweep = time.monotonic()
+        self.sweeps += 1
+        return 0
+
+    def refresh(self, segment_ids):
+        self.refreshed.extend(segment_ids)
+        return len(segment_ids)
+
+
+def test_sweeps_run_while_requests_keep_waking_the_refresher():
+    refresher = CountingRefresher(sweep_interval=0.2)
+    refresher.start()
+    try:
+        deadline = time.monotonic() + 0.9
+        segment_id = 0
+        while time.monotonic() < deadline:
+            segment_id += 1
+            refresher.request([segment_id])
+            time.sleep(0.01)
+    finally:
+        refresher.stop(timeout=5)
+    assert refresher.sweeps >= 3
+    assert len(refresher.refreshed) > 10
@@ -0,0 +1,112 @@
+# test_strava_api.py
+import json
+import threading
+import time
+
+import pytest
+import requests
+
+from ratelimit import SHORT_WINDOW
+from strava_api import TOKEN_EXPIRY_MARGIN, RateLimitExceeded, StravaClient, retry_after
+
+
+def response(status=200, body=None, headers=None):
+    res = requests.Response()
+    res.status_code = status
+    res._content = json.dumps(body if body is not None else {}).encode()
+    res.headers.update(headers or {})
+    res.url = "https://strava.test"
+    return res
+
+
+class FakeSession:
+    """Answers token posts with a fresh token each time and GETs from `responses` in order."""
+
+    def __init__(self, responses=(), token_delay=0.0):
+        self.responses = list(responses)
+        self.token_delay = token_delay
+        self.posts = 0
+        self.tokens_sent = []
+        self._lock = threading.Lock()
+
+    def post(self, url, data=None, **kwargs):
+        time.sleep(self.token_delay)
+        with self._lock:
+            self.posts += 1
+            n = self.posts
+        return response(body={"access_token": f"token-{n}", "refresh_token": f"refresh-{n}",
+                              "expires_at": time.time() + 6 * 3600})
+
+    def get(self, url, headers=None, **kwargs):
+        self.tokens_sent.append(headers["Authorization"])
+        return self.responses.pop(0)
+
+
+def test_token_is_reused_until_shortly_before_it_expires():
+    seen = []
+    client = StravaClient(session=FakeSession(), on_token=seen.append)
+
+    assert client.get_access_token() == "token-1"
+    assert client.get_access_token() == "token-1"
+    assert client.refresh_token == "refresh-1"
+
+    client._expires_at = time.time() + TOKEN_EXPIRY_MARGIN - 1
+    assert client.get_access_token() == "token-2"
+    assert client.refresh_token == "refresh-2"
+    assert [d["access_token"] for d in seen] == ["token-1", "token-2"]
+
+
+def test_concurrent_callers_share_one_refresh():
+    session = FakeSession(token_delay=0.05)
+    client = StravaClient(session=session)
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(client.get_access_token())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert session.posts == 1
+    assert tokens == ["token-1"] * 8
+
+
+def test_401_refreshes_the_token_and_retries():
+    session = FakeSession([response(401), response(body={"id": 7})])
+    client = StravaClient(session=session)
+
+    assert client.get("/athlete") == {"id": 7}
+    assert session.tokens_sent == ["Bearer token-1", "Bearer token-2"]
+
+
+def test_retry_after_prefers_the_header_over_the_window_end():
+    now = 10 * SHORT_WINDOW + 100
+    assert retry_after(response(429, headers={"Retry-After": "12"}), now) == 12.0
+    assert retry_after(response(429), now) == SHORT_WINDOW - 100
+    assert retry_after(response(429, headers={"Retry-After": "soon"}), now) == SHORT_WINDOW - 100
+
+
+def test_short_429_is_waited_out():
+    session = FakeSession([response(429, headers={"Retry-After": "0"}), response(body=[])])
+    client = StravaClient(session=session)
+
+    assert client.get("/athlete/activities") == []
+    assert len(session.tokens_sent) == 2
+
+
+def test_429_longer_than_max_wait_raises():
+    session = FakeSession([response(429, headers={"Retry-After": "120"})])
+    client = StravaClient(session=session, max_wait=60)
+
+    with pytest.raises(RateLimitExceeded) as raised:
+        client.get("/athlete")
+    assert raised.value.retry_at == pytest.approx(time.time() + 120, abs=5)
+    assert client.rate_limiter.remaining() == 0
+    assert len(session.tokens_sent) == 1
+
+
+def test_429_on_the_last_attempt_raises():
+    session = FakeSession([response(429, headers={"Retry-After": "0"})])
+    client = StravaClient(session=session, max_retries=0)
+
+    with pytest.raises(RateLimitExceeded):
+        client.get("/athlete")
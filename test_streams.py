@@ -0,0 +1,48 @@
+# test_streams.py
+import numpy as np
+import pytest
+
+from streams import decode_stream, encode_stream, stream_rows
+
+
+def round_trip(kind, values):
+    return decode_stream(kind, *encode_stream(kind, values))
+
+
+def test_latlng_round_trip_across_the_antimeridian():
+    # Consecutive points on either side of ±180°: the int32 delta wraps around and back.
+    points = [[-33.9, 179.9999999], [-33.9, -179.9999999], [-34.0, 179.5], [89.9, -179.9]]
+    decoded = round_trip("latlng", points)
+    assert decoded.shape == (4, 2)
+    np.testing.assert_allclose(decoded, points, atol=1e-7)
+
+
+def test_integer_streams_come_back_exactly():
+    heartrate = [120, 121, 125, 119, 0, 180]
+    decoded = round_trip("heartrate", heartrate)
+    assert decoded.dtype == np.int32
+    assert decoded.tolist() == heartrate
+
+
+def test_missing_samples_are_stored_as_zero():
+    assert round_trip("watts", [200, None, 210]).tolist() == [200, 0, 210]
+
+
+def test_empty_stream():
+    length, scale, blob = encode_stream("altitude", [])
+    assert length == 0
+    assert len(decode_stream("altitude", length, scale, blob)) == 0
+
+
+def test_scaled_streams_keep_their_precision():
+    altitude = [512.34, 512.36, 498.01, 1203.99]
+    decoded = round_trip("altitude", altitude)
+    assert decoded.dtype == np.float64
+    np.testing.assert_allclose(decoded, altitude, atol=0.05)
+    velocity = [4.1234, 4.1236, 0.0, 12.5]
+    np.testing.assert_allclose(round_trip("velocity_smooth", velocity), velocity, atol=0.0005)
+
+
+def test_stream_rows_skip_empty_streams():
+    rows = stream_rows(1, {"time": {"data": [0, 1, 2]}, "heartrate": {"data": []}, "watts": None})
+    assert [(r["type"], r["length"], r["scale"]) for r in rows] == [("time", 3, 1.0)]
@@ -0,0 +1,166 @@
+# test_sync.py
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+import athletes
+import sync
+from db import Activity, ActivityRollup, SegmentBest, SegmentEffort, SyncState
+from ingest import parse_date, refresh_segment_bests
+from rollups import rebuild_rollups
+from sync import sync_activities, to_epoch
+
+
+class FakeClient:
+    """Lists no new activities; enough for what sync does around listing."""
+
+    def __init__(self, athlete_id=None, profile_id=5):
+        self.athlete_id = athlete_id
+        self.profile_id = profile_id
+
+    def get_athlete(self):
+        return {"id": self.profile_id}
+
+    def iter_activity_pages(self, after=0):
+        return iter(())
+
+
+class PagingClient(FakeClient):
+    """Lists `activities` oldest first, `per_page` at a time; details of `failing` ids raise."""
+
+    def __init__(self, activities, per_page=2, failing=(), athlete_id=5):
+        super().__init__(athlete_id=athlete_id)
+        self.activities = activities
+        self.per_page = per_page
+        self.failing = set(failing)
+        self.listed_after = []
+        self.detail_requests = []
+
+    def iter_activity_pages(self, after=0):
+        self.listed_after.append(after)
+        newer = [a for a in self.activities if to_epoch(parse_date(a["start_date"])) > after]
+        for i in range(0, len(newer), self.per_page):
+            yield newer[i:i + self.per_page]
+
+    def get_activity_details(self, activity_id):
+        self.detail_requests.append(activity_id)
+        if activity_id in self.failing:
+            raise ConnectionError("connection reset")
+        summary = next(a for a in self.activities if a["id"] == activity_id)
+        return {**summary, "segment_efforts": []}
+
+
+def summaries(n):
+    return [{"id": i, "name": f"Ride {i}", "type": "Ride", "athlete": {"id": 5},
+             "start_date": f"2024-01-{i:02d}T07:00:00Z"} for i in range(1, n + 1)]
+
+
+def day(i):
+    return to_epoch(datetime(2024, 1, i, 7))
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    # Details straight from the fake client, past the raw store; no heatmap.
+    monkeypatch.setattr(sync, "get_activity_details", lambda activity_id, refresh=False, client=None:
+                        client.get_activity_details(activity_id))
+    monkeypatch.setattr(sync, "update_heatmap", lambda session, activity_ids=None: None)
+
+
+def stored_ids(session):
+    return sorted(session.execute(select(Activity.id)).scalars())
+
+
+@pytest.fixture
+def default_client(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(athletes, "clients", athletes.AthleteClients(default=client))
+    return client
+
+
+@pytest.fixture
+def legacy(session):
+    session.add(Activity(id=1, name="Before athletes", type="Ride", start_date=datetime(2024, 3, 4, 7)))
+    session.add(SegmentEffort(effort_id=11, segment_id=7, elapsed_time=100, activity_id=1,
+                              start_date=datetime(2024, 3, 4, 7, 10)))
+    session.flush()
+    refresh_segment_bests(session, [7])
+    rebuild_rollups(session)
+    session.commit()
+
+
+def rollup_owners(session):
+    return sorted(tuple(r) for r in session.execute(select(ActivityRollup.athlete_id, ActivityRollup.period)))
+
+
+def test_default_credentials_claim_ownerless_rows(session, legacy, default_client):
+    result = sync_activities(session, client=default_client)
+
+    assert session.get(Activity, 1).athlete_id == 5
+    assert session.execute(select(SegmentEffort.athlete_id)).scalars().all() == [5]
+    assert [(b.athlete_id, b.best_effort_id) for b in session.execute(select(SegmentBest)).scalars()] == [(5, 11)]
+    assert rollup_owners(session) == [(5, "month"), (5, "week")]
+    # The watermark starts after the claimed history instead of relisting it.
+    assert result["watermark"] == to_epoch(datetime(2024, 3, 4, 7))
+    # Remembered, so request handlers can find the default athlete without asking Strava.
+    assert session.get(SyncState, 5).default_credentials
+
+
+def test_other_athletes_leave_ownerless_rows_alone(session, legacy, default_client):
+    sync_activities(session, client=FakeClient(athlete_id=6))
+
+    assert session.get(Activity, 1).athlete_id is None
+    assert session.execute(select(SegmentBest.athlete_id)).scalars().all() == [0]
+    assert rollup_owners(session) == [(0, "month"), (0, "week")]
+    assert not session.get(SyncState, 6).default_credentials
+
+
+def test_watermark_stops_before_the_first_failed_activity(session, offline):
+    client = PagingClient(summaries(5), failing={3})
+
+    result = sync_activities(session, client=client, workers=1)
+
+    assert stored_ids(session) == [1, 2, 4]
+    assert result["failed_activities"] == 1
+    assert result["watermark"] == result["checkpoint"] == day(2)
+    # The failed page ends the run; page three is left for next time.
+    assert client.listed_after == [0]
+
+    client.failing.clear()
+    client.detail_requests.clear()
+    result = sync_activities(session, client=client, workers=1)
+
+    assert client.listed_after[-1] == day(2)
+    assert client.detail_requests == [3, 5]
+    assert stored_ids(session) == [1, 2, 3, 4, 5]
+    assert result["watermark"] == day(5)
+
+
+def test_limit_holds_across_pages(session, offline):
+    client = PagingClient(summaries(5))
+
+    result = sync_activities(session, limit=3, client=client, workers=1)
+
+    assert result["inserted_activities"] == 3
+    assert sorted(client.detail_requests) == [1, 2, 3]
+    # Activity 4 was listed but cut off by the limit, so the watermark stops at 3.
+    assert result["watermark"] == day(3)
+
+    result = sync_activities(session, client=client, workers=1)
+    assert client.listed_after[-1] == day(3)
+    assert stored_ids(session) == [1, 2, 3, 4, 5]
+
+
+def test_full_sync_lists_from_the_start(session, offline):
+    client = PagingClient(summaries(4))
+    sync_activities(session, client=client, workers=1)
+    client.detail_requests.clear()
+
+    result = sync_activities(session, full=True, client=client, workers=1)
+
+    assert client.listed_after == [0, 0]
+    assert result["listed_activities"] == 4
+    assert result["inserted_activities"] == 0
+    assert client.detail_requests == []
+    assert result["watermark"] == day(4)
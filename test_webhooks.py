@@ -0,0 +1,83 @@
+# test_webhooks.py
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+import webhooks
+from athletes import UnknownAthlete
+from strava_api import RateLimitExceeded
+
+
+def add_event(session, object_id, aspect_type="create", owner_id=1, object_type="activity"):
+    event = webhooks.parse_event({
+        "object_type": object_type, "object_id": object_id, "aspect_type": aspect_type,
+        "owner_id": owner_id, "event_time": 1700000000,
+    })
+    event.received_at = datetime.now(timezone.utc)
+    event.attempts = 0
+    session.add(event)
+    session.commit()
+    return event
+
+
+def test_events_of_unknown_athletes_are_skipped(session, monkeypatch):
+    def client_for(athlete_id):
+        raise UnknownAthlete(athlete_id)
+
+    monkeypatch.setattr(webhooks, "client_for", client_for)
+    event = add_event(session, 11, owner_id=99)
+
+    result = webhooks.process_batch(session, [event])
+
+    assert result["failed"] == 1
+    assert event.processed_at is not None
+    assert event.attempts == 1
+    assert "athlete 99" in event.error
+
+
+def test_plan_keeps_the_latest_event_per_activity(session):
+    events = [add_event(session, 1), add_event(session, 1, "update"), add_event(session, 2),
+              add_event(session, 2, "delete"), add_event(session, 5, "update", object_type="athlete")]
+
+    fetch, remove, other = webhooks.plan(events)
+
+    assert fetch == {1: 1}
+    assert remove == [2]
+    assert [e.object_id for e in other] == [5]
+
+
+def test_failing_events_are_retried_until_max_attempts(session, monkeypatch):
+    def fetch_activity(activity_id, owner_id=None):
+        raise ConnectionError("connection reset")
+
+    monkeypatch.setattr(webhooks, "fetch_activity", fetch_activity)
+    event = add_event(session, 11)
+
+    for attempt in range(1, webhooks.MAX_ATTEMPTS):
+        webhooks.process_batch(session, webhooks.pending_events(session))
+        assert event.attempts == attempt
+        assert event.processed_at is None
+    webhooks.process_batch(session, webhooks.pending_events(session))
+
+    assert event.attempts == webhooks.MAX_ATTEMPTS
+    assert event.processed_at is not None
+    assert event.error == "connection reset"
+    assert webhooks.pending_events(session) == []
+
+
+def test_rate_limited_events_wait_without_using_an_attempt(session, monkeypatch):
+    retry_at = time.time() + 60
+
+    def fetch_activity(activity_id, owner_id=None):
+        raise RateLimitExceeded(retry_at)
+
+    monkeypatch.setattr(webhooks, "fetch_activity", fetch_activity)
+    event = add_event(session, 11)
+
+    with pytest.raises(RateLimitExceeded):
+        webhooks.process_batch(session, [event])
+
+    assert event.attempts == 0
+    assert event.processed_at is None
+    assert webhooks.pending_events(session) == [event]
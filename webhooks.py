@@ -0,0 +1,294 @@
+# webhooks.py
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+from sqlalchemy import func, select
+
+from athletes import UnknownAthlete, client_for, revoke
+from cache import response_cache
+from db import Activity, SessionLocal, WebhookEvent
+from heatmap import remove as remove_routes, update_from_db as update_heatmap
+from ingest import delete_activities, ingest_activities
+from metrics import Counter
+from raw_store import get_activity_details, raw_store
+from strava_api import RateLimitExceeded
+
+# Strava echoes this back when we create the push subscription.
+VERIFY_TOKEN = os.environ.get("STRAVA_WEBHOOK_VERIFY_TOKEN")
+# Seconds to let a burst of events collect before applying them; Strava
+# often sends a create followed by updates within a few seconds.
+BATCH_WINDOW = float(os.environ.get("STRAVA_WEBHOOK_BATCH_WINDOW", "2"))
+# Pending events read per batch.
+BATCH_SIZE = 500
+# Detail requests in flight at once.
+WORKERS = 4
+# A failing event is retried this many times before it is set aside.
+MAX_ATTEMPTS = 5
+# Seconds between checks for events left pending by a failure.
+RETRY_INTERVAL = 60
+
+WEBHOOK_EVENTS = Counter("webhook_events", "Strava push events applied by the webhook worker.",
+                         ("object_type", "aspect_type", "result"))
+
+
+def parse_event(payload):
+    """WebhookEvent from a Strava push event body; ValueError if it isn't one."""
+    try:
+        event = WebhookEvent(
+            object_type=str(payload["object_type"]),
+            object_id=int(payload["object_id"]),
+            aspect_type=str(payload["aspect_type"]),
+            owner_id=int(payload["owner_id"]) if payload.get("owner_id") is not None else None,
+            subscription_id=int(payload["subscription_id"]) if payload.get("subscription_id") is not None else None,
+            event_time=int(payload["event_time"]) if payload.get("event_time") is not None else None,
+            updates=json.dumps(payload.get("updates") or {}),
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"not a Strava push event: {e}")
+    if event.aspect_type not in ("create", "update", "delete"):
+        raise ValueError(f"unknown aspect_type {event.aspect_type!r}")
+    return event
+
+
+def enqueue(session, payload):
+    """Store one push event durably and wake the worker. Returns the stored event."""
+    event = parse_event(payload)
+    event.received_at = datetime.now(timezone.utc)
+    event.attempts = 0
+    session.add(event)
+    session.commit()
+    worker.notify()
+    return event
+
+
+def plan(events):
+    """Split pending events into ({activity id to fetch: owner id}, activity ids to delete, other events).
+
+    Only the latest event of each activity matters: a create followed by
+    updates is one fetch, and anything followed by a delete is a delete.
+    """
+    latest = {}
+    other = []
+    for event in sorted(events, key=lambda e: e.id):
+        if event.object_type == "activity":
+            latest[event.object_id] = event
+        else:
+            other.append(event)
+    fetch = {i: e.owner_id for i, e in latest.items() if e.aspect_type != "delete"}
+    remove = [i for i, e in latest.items() if e.aspect_type == "delete"]
+    return fetch, remove, other
+
+
+def fetch_activity(activity_id, owner_id=None):
+    """Fresh details of one activity, fetched with its owner's token.
+
+    None if Strava no longer has it (or it went private).
+    """
+    try:
+        return get_activity_details(activity_id, refresh=True, client=client_for(owner_id))
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return None
+        raise
+
+
+def remove_activities(session, activity_ids):
+    """Delete activities everywhere: tables, heatmap and raw store index. Returns how many existed."""
+    rows = session.execute(
+        select(Activity.id, Activity.polyline, Activity.athlete_id).where(Activity.id.in_(activity_ids))
+    ).all()
+    deleted = delete_activities(session, activity_ids)
+    session.commit()
+    if rows:
+        remove_routes([r.id for r in rows], [r.polyline for r in rows], [r.athlete_id for r in rows])
+    raw_store.forget("activity", activity_ids)
+    return deleted
+
+
+def process_batch(session, events, workers=WORKERS):
+    """Apply `events` and mark them processed; returns {"fetched": n, "deleted": n, "failed": n}.
+
+    Events whose activity could not be fetched stay pending (with their
+    attempt count raised) until MAX_ATTEMPTS; events of athletes we hold no
+    tokens for are set aside at once. RateLimitExceeded is re-raised
+    once the rest of the batch is recorded, so the caller can wait.
+    """
+    fetch_ids, remove_ids, other = plan(events)
+    failed = {}
+    gone = []
+    details = []
+    rate_limited = None
+    waiting = set()
+    skipped = set()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for activity_id, future in [(i, pool.submit(fetch_activity, i, owner)) for i, owner in fetch_ids.items()]:
+            try:
+                payload = future.result()
+            except RateLimitExceeded as e:
+                rate_limited = rate_limited or e
+                failed[activity_id] = str(e)
+                waiting.add(activity_id)
+                continue
+            except UnknownAthlete as e:
+                print(f"⚠️ Webhook: skipping activity {activity_id}: {e}")
+                failed[activity_id] = str(e)
+                skipped.add(activity_id)
+                continue
+            except Exception as e:
+                print(f"⚠️ Webhook: error fetching activity {activity_id}: {e}")
+                failed[activity_id] = str(e)
+                continue
+            if payload is None:
+                gone.append(activity_id)
+            else:
+                details.append(payload)
+
+    if details:
+        ingest_activities(session, [(d, d) for d in details])
+        session.commit()
+    deleted = remove_activities(session, remove_ids + gone) if remove_ids or gone else 0
+    for event in other:
+        if event.object_type == "athlete" and json.loads(event.updates or "{}").get("authorized") == "false":
+            revoke(session, event.object_id)
+            print(f"🚪 Webhook: athlete {event.object_id} revoked access; no longer syncing them.")
+
+    now = datetime.now(timezone.utc)
+    for event in events:
+        error = failed.get(event.object_id) if event.object_type == "activity" else None
+        # Waiting for the rate limit isn't the event's fault.
+        if not (error and event.object_id in waiting):
+            event.attempts = (event.attempts or 0) + 1
+        event.error = error
+        if error is None or event.attempts >= MAX_ATTEMPTS or event.object_id in skipped:
+            event.processed_at = now
+        result = ("skipped" if event.object_id in skipped else "failed") if error else "applied"
+        WEBHOOK_EVENTS.labels(event.object_type, event.aspect_type, result).inc()
+    session.commit()
+
+    if details or deleted:
+        response_cache.bump_generation()
+    if details:
+        try:
+            update_heatmap(session, [d["id"] for d in details])
+        except Exception as e:
+            print(f"⚠️ Heatmap update failed: {e}")
+    if rate_limited is not None:
+        raise rate_limited
+    return {"fetched": len(details), "deleted": deleted, "failed": len(failed)}
+
+
+def pending_events(session, limit=BATCH_SIZE):
+    return session.execute(
+        select(WebhookEvent).where(WebhookEvent.processed_at.is_(None)).order_by(WebhookEvent.id).limit(limit)
+    ).scalars().all()
+
+
+class WebhookWorker:
+    """Applies stored push events on a background thread.
+
+    Woken by every new event, it waits BATCH_WINDOW seconds for the rest of
+    a burst, then drains the queue batch by batch. Events left pending by a
+    failure are retried every RETRY_INTERVAL seconds, and on the next start
+    after a restart.
+    """
+
+    def __init__(self, session_factory=SessionLocal, batch_window=BATCH_WINDOW):
+        self.session_factory = session_factory
+        self.batch_window = batch_window
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._wake.set()
+        self._thread = threading.Thread(target=self._loop, name="webhook-events", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def notify(self):
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(RETRY_INTERVAL)
+            if self._stop.wait(self.batch_window):
+                return
+            self._wake.clear()
+            try:
+                self.drain()
+            except RateLimitExceeded as e:
+                print(f"⏳ Webhook events waiting for the rate limit until {time.ctime(e.retry_at)}.")
+                self._stop.wait(max(0.0, e.retry_at - time.time()))
+            except Exception:
+                import traceback
+                traceback.print_exc()
+
+    def drain(self):
+        """Apply pending events until none are left that can be applied now."""
+        session = self.session_factory()
+        try:
+            while not self._stop.is_set():
+                events = pending_events(session)
+                if not events:
+                    return
+                result = process_batch(session, events)
+                print(f"📬 Webhook batch of {len(events)} events: {result}")
+                if result["failed"]:
+                    return
+        finally:
+            session.close()
+
+
+worker = WebhookWorker()
+
+
+def create_subscription(callback_url, verify_token=VERIFY_TOKEN):
+    """Ask Strava to push events to `callback_url`; it validates the URL with a GET first."""
+    from strava_api import BASE_URL, client
+
+    response = client.session.post(f"{BASE_URL}/push_subscriptions", data={
+        "client_id": client.client_id, "client_secret": client.client_secret,
+        "callback_url": callback_url, "verify_token": verify_token,
+    }, timeout=client.timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+if __name__ == "__main__":
+    import sys
+    from db import init_db
+
+    init_db()
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    if command == "subscribe":
+        if not VERIFY_TOKEN or len(sys.argv) < 3:
+            sys.exit("usage: STRAVA_WEBHOOK_VERIFY_TOKEN=... python webhooks.py subscribe https://host/webhook")
+        print(f"✅ Subscribed: {create_subscription(sys.argv[2])}")
+    elif command == "drain":
+        worker.drain()
+    else:
+        session = SessionLocal()
+        try:
+            pending = session.execute(
+                select(func.count()).where(WebhookEvent.processed_at.is_(None))
+            ).scalar()
+            failed = session.execute(
+                select(func.count()).where(WebhookEvent.processed_at.isnot(None), WebhookEvent.error.isnot(None))
+            ).scalar()
+        finally:
+            session.close()
+        print(f"{pending} pending webhook events, {failed} given up after {MAX_ATTEMPTS} attempts.")